@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Ollama endpoint from appsettings.Production.json and pick a
+concurrency from measurements.
+
+Each --concurrency gets the same seeded sequence of --requests prompts from
+the prompt mix. They are sent exactly as ChainedAIService sends them: streamed
+from /api/generate with temperature 0.7 and num_predict 256, and with no
+keep_alive or num_ctx, so the Ollama service's own settings apply. For each
+concurrency it reports time to first token, per-request generation speed,
+overall tokens/s and p50/p95/p99 latency:
+
+    python3 benchmark-ollama.py /opt/mental-health-app/server/appsettings.Production.json \\
+        --concurrency 1,2,4 --output ollama-bench.json
+
+The server only reads Ollama:BaseUrl and Ollama:Model, so nothing is written
+to appsettings. The best concurrency (see --objective) is a recommendation
+for OLLAMA_NUM_PARALLEL on the Ollama service, next to its OLLAMA_KEEP_ALIVE.
+
+--stub runs against ollama_stub_server.py in-process instead of the
+configured endpoint, to try the harness offline.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_FILE = "/opt/mental-health-app/server/appsettings.Production.json"
+
+# Same defaults as LlmClient
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_MODEL = "tinyllama:latest"
+
+OBJECTIVES = {
+    # name -> (description, key into the summary, higher is better)
+    'latency': ("lowest p95 latency", ('latency', 'p95'), False),
+    'ttft': ("lowest p95 time to first token", ('ttft', 'p95'), False),
+    'throughput': ("most tokens/s across all requests", ('throughput_tokens_per_second',), True),
+}
+
+# As sent by ChainedAIService.CallOllamaModelAsync
+REQUEST_OPTIONS = {'temperature': 0.7, 'num_predict': 256}
+
+# (name, weight, prompt, num_predict): the kinds of requests the app sends
+DEFAULT_PROMPTS = (
+    ('short', 5, "Summarize in one sentence: the patient reports better sleep and less anxiety.", 256),
+    ('note', 3, "Write a structured clinical note (subjective, objective, assessment, plan) for a "
+                "follow-up visit. The patient has generalized anxiety disorder, sleeps six hours a "
+                "night, attends weekly therapy and reports fewer panic attacks since the last visit.", 256),
+    ('protocol', 2, "List the recommended follow-up steps, insurance documentation requirements and a "
+                    "clinical protocol outline for a patient newly diagnosed with major depressive "
+                    "disorder, moderate severity, with no prior treatment history. " * 3, 256),
+)
+
+
+def read_config(config_file):
+    with open(config_file, 'r') as f:
+        return json.load(f)
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def load_prompts(path):
+    """Prompt mix from a JSON list of {"name", "prompt", "weight", "num_predict"} objects"""
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    prompts = []
+    for i, entry in enumerate(entries):
+        if not entry.get('prompt'):
+            raise ValueError(f"prompt {i} has no 'prompt' text")
+        prompts.append((entry.get('name', f"prompt{i}"), float(entry.get('weight', 1)), entry['prompt'],
+                        int(entry.get('num_predict', REQUEST_OPTIONS['num_predict']))))
+    if not prompts:
+        raise ValueError("the prompt file is empty")
+    return tuple(prompts)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest rank is ceil(fraction * n); rounding half-up would put p95 a rank low for e.g. n = 12
+    return ordered[min(max(math.ceil(round(fraction * len(ordered), 9)) - 1, 0), len(ordered) - 1)]
+
+
+def distribution(values):
+    return {'p50': percentile(values, 0.50), 'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99)}
+
+
+def generate(base_url, model, prompt, num_predict, timeout):
+    """Stream one /api/generate request shaped like the server's; returns its measurements"""
+    body = json.dumps({
+        'model': model,
+        'prompt': prompt,
+        'stream': True,
+        'options': dict(REQUEST_OPTIONS, num_predict=num_predict),
+    }).encode('utf-8')
+    request = urllib.request.Request(f"{base_url}/api/generate", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    result = {'ttft': None, 'latency': None, 'eval_count': 0, 'eval_seconds': None, 'load_seconds': 0.0,
+              'error': None}
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            final = None
+            for line in response:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+                if result['ttft'] is None and chunk.get('response'):
+                    result['ttft'] = time.perf_counter() - started
+                if chunk.get('done'):
+                    final = chunk
+        result['latency'] = time.perf_counter() - started
+        if final is None:
+            raise RuntimeError("stream ended without a final chunk")
+        result['eval_count'] = final.get('eval_count', 0)
+        if final.get('eval_duration'):
+            result['eval_seconds'] = final['eval_duration'] / 1e9
+        result['load_seconds'] = final.get('load_duration', 0) / 1e9
+    except (urllib.error.URLError, OSError, ValueError, RuntimeError) as e:
+        result['error'] = str(getattr(e, 'reason', e))
+    return result
+
+
+def run_setting(args, prompts, concurrency):
+    """Send --requests prompts with `concurrency` in flight; returns the summary"""
+    rng = random.Random(args.seed)
+    names, weights = [p[0] for p in prompts], [p[1] for p in prompts]
+    by_name = {p[0]: p for p in prompts}
+    sequence = rng.choices(names, weights, k=args.requests)
+
+    def send(name):
+        _, _, prompt, num_predict = by_name[name]
+        return generate(args.base_url, args.model, prompt, num_predict, args.timeout)
+
+    # Not measured: loads the model if the service has unloaded it
+    for _ in range(args.warmup):
+        send(sequence[0])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, sequence))
+    wall = time.perf_counter() - started
+
+    ok = [r for r in results if not r['error']]
+    tokens = sum(r['eval_count'] for r in ok)
+    speeds = [r['eval_count'] / r['eval_seconds'] for r in ok if r['eval_seconds']]
+    errors = [r['error'] for r in results if r['error']]
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'wall_seconds': round(wall, 3),
+        'ttft': distribution([r['ttft'] for r in ok if r['ttft'] is not None]),
+        'latency': distribution([r['latency'] for r in ok]),
+        'tokens_per_second_per_request': round(sum(speeds) / len(speeds), 2) if speeds else None,
+        'throughput_tokens_per_second': round(tokens / wall, 2) if wall > 0 else None,
+        'requests_per_second': round(len(ok) / wall, 3) if wall > 0 else None,
+        'load_seconds': round(sum(r['load_seconds'] for r in ok), 3),
+    }
+
+
+def score(summary, objective):
+    """Value to optimise, or None if the setting can't be picked"""
+    _, path, _ = OBJECTIVES[objective]
+    if summary['errors']:
+        return None
+    value = summary
+    for key in path:
+        value = value[key]
+    return value
+
+
+def best_setting(summaries, objective):
+    _, _, higher_is_better = OBJECTIVES[objective]
+    candidates = [s for s in summaries if score(s, objective) is not None]
+    if not candidates:
+        return None
+    pick = max if higher_is_better else min
+    return pick(candidates, key=lambda s: score(s, objective))
+
+
+def format_seconds(value):
+    return "   -   " if value is None else f"{value:6.2f}s"
+
+
+def print_summary(summary):
+    ttft, latency = summary['ttft'], summary['latency']
+    speed = summary['tokens_per_second_per_request']
+    line = (f"  c={summary['concurrency']:<3} "
+            f"TTFT p50 {format_seconds(ttft['p50'])} p95 {format_seconds(ttft['p95'])}  "
+            f"latency p50 {format_seconds(latency['p50'])} p95 {format_seconds(latency['p95'])} "
+            f"p99 {format_seconds(latency['p99'])}  "
+            f"{'-' if speed is None else f'{speed:.1f}'} tok/s/req  "
+            f"{summary['throughput_tokens_per_second'] or 0:.1f} tok/s total")
+    if summary['errors']:
+        line += f"  ❌ {summary['errors']} errors ({summary['first_error']})"
+    print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama with the server's requests and pick a concurrency")
+    parser.add_argument('config_file', nargs='?', default=CONFIG_FILE,
+                        help=f"appsettings file with the Ollama section (default: {CONFIG_FILE})")
+    parser.add_argument('--base-url', help="Ollama endpoint (default: Ollama:BaseUrl from the config)")
+    parser.add_argument('--model', help="Model to benchmark (default: Ollama:Model from the config)")
+    parser.add_argument('--concurrency', default='1,2,4', help="Comma-separated requests in flight (default: 1,2,4)")
+    parser.add_argument('--requests', type=int, default=20, help="Measured requests per concurrency (default: 20)")
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="Unmeasured requests before each concurrency (default: 1)")
+    parser.add_argument('--prompts', metavar='PATH',
+                        help='JSON list of {"name", "prompt", "weight", "num_predict"} (default: a built-in mix)')
+    parser.add_argument('--seed', type=int, default=42, help="Seed for the prompt sequence (default: 42)")
+    parser.add_argument('--timeout', type=float, default=900, help="Seconds per request (default: 900)")
+    parser.add_argument('--objective', choices=OBJECTIVES, default='latency',
+                        help="What the best concurrency optimises (default: latency, i.e. p95 latency)")
+    parser.add_argument('--output', metavar='PATH', help="Write all results as JSON")
+    parser.add_argument('--stub', action='store_true', help="Benchmark an in-process ollama_stub_server instead")
+    args = parser.parse_args()
+    try:
+        args.concurrency = parse_list(args.concurrency, int)
+    except ValueError as e:
+        parser.error(f"--concurrency takes comma-separated integers ({e})")
+    if not args.concurrency:
+        parser.error("--concurrency needs at least one value")
+    if min(args.concurrency) < 1 or args.requests < 1 or args.warmup < 0:
+        parser.error("--concurrency and --requests must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 50)
+    print("Ollama Benchmark")
+    print("=" * 50)
+
+    config = {}
+    if os.path.exists(args.config_file):
+        try:
+            config = read_config(args.config_file)
+        except json.JSONDecodeError as e:
+            print(f"❌ Invalid JSON in config file: {e}")
+            sys.exit(1)
+    elif not (args.base_url or args.stub):
+        print(f"❌ Config file not found: {args.config_file}")
+        sys.exit(1)
+    section = config.get('Ollama', {})
+    args.model = args.model or section.get('Model') or DEFAULT_MODEL
+
+    stub = None
+    if args.stub:
+        import ollama_stub_server
+
+        stub = ollama_stub_server.StubOllamaServer(('127.0.0.1', 0), load_seconds=0.3, tokens_per_second=500,
+                                                   parallel=2, models=(args.model,), seed=args.seed).start()
+        args.base_url = stub.base_url
+    args.base_url = (args.base_url or section.get('BaseUrl') or DEFAULT_BASE_URL).rstrip('/')
+
+    try:
+        prompts = load_prompts(args.prompts) if args.prompts else DEFAULT_PROMPTS
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read --prompts: {e}")
+        sys.exit(1)
+
+    print(f"   Endpoint: {args.base_url}" + (" (stub)" if stub else ""))
+    print(f"   Model: {args.model}")
+    print(f"   {len(args.concurrency)} concurrencies x {args.requests} requests, prompt mix: "
+          + ", ".join(f"{name} x{weight:g}" for name, weight, _, _ in prompts))
+    print()
+
+    summaries = []
+    try:
+        for concurrency in args.concurrency:
+            summary = run_setting(args, prompts, concurrency)
+            print_summary(summary)
+            summaries.append(summary)
+    except KeyboardInterrupt:
+        print("\n⏹  Interrupted; picking from the concurrencies measured so far")
+    finally:
+        if stub:
+            stub.stop()
+
+    best = best_setting(summaries, args.objective)
+    print()
+    if best is None:
+        print("❌ No concurrency completed without errors")
+    else:
+        print(f"✅ Best for {OBJECTIVES[args.objective][0]}: concurrency {best['concurrency']}")
+        # Nothing in appsettings controls this: LlmClient and ChainedAIService only read BaseUrl and Model
+        print(f"   Recommendation: run the Ollama service with OLLAMA_NUM_PARALLEL={best['concurrency']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'base_url': args.base_url,
+                'stub': bool(stub),
+                'model': args.model,
+                'objective': args.objective,
+                'requests': args.requests,
+                'prompts': [{'name': name, 'weight': weight, 'num_predict': num_predict}
+                            for name, weight, _, num_predict in prompts],
+                'results': summaries,
+                'best': best,
+            }, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+    print("=" * 50)
+    if best is None:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Benchmark the PII encryption scripts against synthetic data.
+
+Builds a Users / UserRequests schema in an SQLite file (default) or in a
+scratch MySQL/MariaDB database, fills it with --rows rows per table and a
+configurable mix of plain text and already-encrypted DOBs and phones, then
+runs encrypt-dob-python.py and encrypt-mobilephone-python.py against it.
+
+Each run starts from the same data and happens in its own process, and
+reports rows/s, peak RSS, statements sent to the database and the time split
+between fetching, encrypting and writing. Results are written as JSON so
+runs can be compared:
+
+    python3 benchmark-pii-migration.py --rows 200000 \\
+        --variant default: --variant pool:"--workers 4" \
+        --variant pipelined:"--pipeline" --output before.json
+    python3 benchmark-pii-migration.py ... --compare before.json
+
+--write-strategies row,case,staging runs every variant once per write
+strategy on the same data, to compare per-row UPDATEs, the batched CASE
+UPDATE and the staging table + UPDATE ... JOIN.
+
+The SQLite stand-in translates pymysql's %s placeholders and UPDATE ... JOIN
+and provides REGEXP, CHAR_LENGTH, MOD, CRC32, CONCAT and IF, so the scripts
+run unchanged. Its numbers are for comparing code paths, not for predicting
+production times; use --mysql-config for that. The MySQL database named in
+that file is overwritten and must contain "bench" in its name.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import shlex
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import pii_crypto
+import pii_migration
+
+BENCHMARK_KEY = "BenchmarkEncryptionKey32BytesLong"
+TABLES = ('Users', 'UserRequests')
+
+# Migration path -> (script, column)
+PATHS = {
+    'dob': ('encrypt-dob-python.py', 'DateOfBirthEncrypted'),
+    'mobilephone': ('encrypt-mobilephone-python.py', 'MobilePhoneEncrypted'),
+}
+
+PHONE_FORMATS = ('+1555{:07d}', '(555) {:03d}-{:04d}', '555-{:03d}-{:04d}', '555{:07d}')
+
+UPDATE_JOIN_RE = re.compile(r'UPDATE (\w+) t JOIN (\w+) s ON (.+?) SET (.+?)(?: WHERE (.+))?$', re.DOTALL)
+
+
+class SqliteCursor:
+    """Just enough of a pymysql cursor for the migration scripts"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.db.cursor()
+        self.rowcount = -1
+
+    @staticmethod
+    def translate(sql):
+        sql = sql.replace('%%', '\0').replace('%s', '?').replace('\0', '%')
+        match = UPDATE_JOIN_RE.match(sql)
+        if match:
+            # MySQL "UPDATE a t JOIN b s ON .. SET t.x = .." is SQLite "UPDATE a AS t SET x = .. FROM b AS s WHERE .."
+            target, source, on, assignments, where = match.groups()
+            assignments = re.sub(r'(^|, )t\.(\w+) = ', r'\1\2 = ', assignments)
+            sql = f"UPDATE {target} AS t SET {assignments} FROM {source} AS s WHERE {on}"
+            if where:
+                sql += f" AND {where}"
+        return sql
+
+    def execute(self, sql, params=()):
+        self.connection.statements += 1
+        self.cursor.execute(self.translate(sql), tuple(params or ()))
+        self.rowcount = self.cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, sql, seq):
+        seq = list(seq)
+        # pymysql only folds INSERT/REPLACE; anything else is one round-trip per row
+        if re.match(r'\s*(INSERT|REPLACE)\b', sql, re.IGNORECASE):
+            self.connection.statements += 1
+        else:
+            self.connection.statements += len(seq)
+        self.cursor.executemany(self.translate(sql), seq)
+        self.rowcount = self.cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return tuple(self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        return tuple(self.cursor.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _BitXor:
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= int(value)
+
+    def finalize(self):
+        return self.value
+
+
+class SqliteConnection:
+    """SQLite stand-in for a pymysql connection, counting the statements it is sent"""
+
+    def __init__(self, path):
+        # --pipeline hands the read connection to a reader thread; it is still
+        # only used by one thread at a time
+        self.db = sqlite3.connect(path, isolation_level='DEFERRED', check_same_thread=False)
+        self.statements = 0
+        self.db.create_function('REGEXP', 2, lambda pattern, value:
+                                value is not None and re.search(pattern, value) is not None)
+        self.db.create_function('CHAR_LENGTH', 1, lambda v: None if v is None else len(v))
+        self.db.create_function('MOD', 2, lambda a, b: None if a is None else a % b)
+        self.db.create_function('CRC32', 1, lambda v: None if v is None else zlib.crc32(str(v).encode('utf-8')))
+        self.db.create_function('CONCAT', -1, lambda *args: None if None in args
+                                else ''.join(str(a) for a in args))
+        self.db.create_function('IF', 3, lambda condition, a, b: a if condition else b)
+        self.db.create_aggregate('BIT_XOR', 1, _BitXor)
+
+    def cursor(self, cursor_class=None):
+        return SqliteCursor(self)
+
+    def commit(self):
+        self.statements += 1
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.db.close()
+
+
+class Backend:
+    """Creates, fills and connects to the benchmark database"""
+
+    def __init__(self, args):
+        self.args = args
+        self.mysql_config = None
+        self.template = None
+        if args.mysql_config:
+            config = pii_migration.read_appsettings(args.mysql_config)
+            self.mysql_config = pii_migration.db_config_from_appsettings(config)
+            if 'bench' not in self.mysql_config['database'].lower():
+                raise SystemExit(f"❌ Refusing to overwrite database {self.mysql_config['database']!r}: "
+                                 "its name must contain 'bench'")
+
+    @property
+    def name(self):
+        return 'mysql' if self.mysql_config else 'sqlite'
+
+    def connect(self, path=None):
+        if self.mysql_config:
+            import pymysql
+
+            return pymysql.connect(**self.mysql_config)
+        return SqliteConnection(path)
+
+    def create_schema(self, conn):
+        id_column = ("Id INT NOT NULL AUTO_INCREMENT PRIMARY KEY" if self.mysql_config
+                     else "Id INTEGER PRIMARY KEY")
+        cursor = conn.cursor()
+        for table in TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(
+                f"CREATE TABLE {table} ({id_column}, Email VARCHAR(256) NOT NULL, "
+                "DateOfBirthEncrypted VARCHAR(500) NOT NULL DEFAULT '', "
+                "MobilePhoneEncrypted VARCHAR(500) NULL)"
+            )
+        cursor.close()
+        conn.commit()
+
+    def populate(self, workdir):
+        """Generate the data set once; every run starts from a copy of it"""
+        if self.mysql_config:
+            conn = self.connect()
+        else:
+            self.template = os.path.join(workdir, 'template.db')
+            conn = self.connect(self.template)
+            # WAL lets --stream server read on one connection while the other writes
+            conn.db.execute("PRAGMA journal_mode=WAL")
+        self.create_schema(conn)
+        generate_rows(conn, self.args)
+        conn.close()
+
+    def prepare_run(self, workdir):
+        """Fresh copy of the data set for one run; returns the SQLite path (None for MySQL)"""
+        if self.mysql_config:
+            self.populate(workdir)
+            return None
+        path = os.path.join(workdir, 'run.db')
+        shutil.copyfile(self.template, path)
+        return path
+
+
+def generate_rows(conn, args):
+    """Fill both tables with a seeded mix of plain text and ciphertext"""
+    rng = random.Random(args.seed)
+    encryptor = pii_crypto.FixedIvEncryptor(*pii_crypto.derive_key_and_iv(BENCHMARK_KEY),
+                                            cache_size=pii_migration.DEFAULT_CACHE_SIZE)
+    sql_insert = "INSERT INTO {} (Id, Email, DateOfBirthEncrypted, MobilePhoneEncrypted) VALUES (%s, %s, %s, %s)"
+    cursor = conn.cursor()
+    for table in TABLES:
+        rows = []
+        for row_id in range(1, args.rows + 1):
+            dob = f"{rng.randint(1930, 2015)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            if rng.random() < args.plain_dob_ratio:
+                dob += "T00:00:00.000000"
+            else:
+                dob = encryptor.encrypt(dob)
+
+            if rng.random() < args.null_phone_ratio:
+                phone = None
+            else:
+                number = rng.randint(0, 9999999)
+                phone_format = rng.choice(PHONE_FORMATS)
+                phone = (phone_format.format(number) if phone_format.count('{') == 1
+                         else phone_format.format(number // 10000, number % 10000))
+                if rng.random() >= args.plain_phone_ratio:
+                    phone = encryptor.encrypt(phone)
+            rows.append((row_id, f"user{row_id}@example.com", dob, phone))
+
+            if len(rows) == 5000:
+                cursor.executemany(sql_insert.format(table), rows)
+                rows = []
+        if rows:
+            cursor.executemany(sql_insert.format(table), rows)
+        conn.commit()
+    cursor.close()
+
+
+def statements_sent(conn):
+    """Statements executed on a connection so far"""
+    if isinstance(conn, SqliteConnection):
+        return conn.statements
+    cursor = conn.cursor()
+    cursor.execute("SHOW SESSION STATUS LIKE 'Questions'")
+    value = int(cursor.fetchone()[1])
+    cursor.close()
+    # Don't count the SHOW itself
+    return value - 1
+
+
+def instrument(timer):
+    """Charge the time spent in the shared reader, crypto pool and writer to stages"""
+    iter_batches = pii_migration.iter_batches
+    encrypt_chunks = pii_migration.encrypt_chunks
+    write = pii_migration.BatchWriter.write
+
+    pii_migration.iter_batches = lambda *a, **kw: timer.iterate('fetch', iter_batches(*a, **kw))
+    pii_migration.encrypt_chunks = lambda *a, **kw: timer.iterate('crypt', encrypt_chunks(*a, **kw))
+
+    def timed_write(self, updates):
+        with timer.stage('write'):
+            write(self, updates)
+
+    pii_migration.BatchWriter.write = timed_write
+
+
+def run_one(spec):
+    """Run one migration path in this process and return its measurements"""
+    module = pii_migration.load_script(PATHS[spec['path']][0])
+    _, column = PATHS[spec['path']]
+
+    saved_argv = sys.argv
+    sys.argv = [PATHS[spec['path']][0], 'benchmark.json', '--checkpoint', ''] + shlex.split(spec['script_args'])
+    try:
+        script_args = module.parse_args()
+    finally:
+        sys.argv = saved_argv
+
+    backend_args = argparse.Namespace(mysql_config=spec['mysql_config'])
+    backend = Backend(backend_args)
+    conn = backend.connect(spec['db_path'])
+    separate_reader = script_args.stream == 'server' or script_args.pipeline
+    read_conn = backend.connect(spec['db_path']) if separate_reader else conn
+    key, iv = pii_crypto.derive_key_and_iv(BENCHMARK_KEY)
+    checkpoint = pii_migration.Checkpoint('', 'benchmark')
+    extra = []
+    if spec['path'] == 'dob' and script_args.dob_table:
+        extra.append(pii_migration.load_dob_table(script_args.dob_table, key, iv, script_args.dob_range))
+
+    timer = pii_migration.StageTimer()
+    instrument(timer)
+    connections = [conn] if read_conn is conn else [conn, read_conn]
+    statements_before = sum(statements_sent(c) for c in connections)
+
+    encrypted = 0
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for table in TABLES:
+            counts = module.encrypt_table(conn, read_conn, checkpoint, table, table, key, iv, script_args, *extra)
+            encrypted += counts[0]
+    elapsed = time.perf_counter() - started
+
+    statements = sum(statements_sent(c) for c in connections) - statements_before
+    for c in connections:
+        c.close()
+
+    stages = {name: round(seconds, 4) for name, seconds in timer.seconds.items()}
+    stages['other'] = round(max(elapsed - sum(timer.seconds.values()), 0.0), 4)
+    return {
+        'path': spec['path'],
+        'variant': spec['variant'],
+        'script_args': spec['script_args'],
+        'column': column,
+        'rows_encrypted': encrypted,
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(encrypted / elapsed, 1) if elapsed > 0 else 0.0,
+        'statements': statements,
+        # ru_maxrss is in KiB on Linux; the pool's processes are reported separately
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_worker_rss_mib': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'stages': stages,
+    }
+
+
+def parse_variant(value):
+    """[PATH/]NAME:SCRIPT_ARGS -> (path or None, name, script args)"""
+    name, sep, script_args = value.partition(':')
+    path_name, _, name = name.rpartition('/')
+    if not sep or not name or (path_name and path_name not in PATHS):
+        raise argparse.ArgumentTypeError("expected [PATH/]NAME:SCRIPT_ARGS, e.g. pool:'--workers 4'")
+    return path_name or None, name, script_args
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the PII encryption scripts on synthetic data")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows per table (default: 100000)")
+    parser.add_argument('--plain-dob-ratio', type=float, default=0.5,
+                        help="Share of DOBs stored as plain text (default: 0.5)")
+    parser.add_argument('--plain-phone-ratio', type=float, default=0.5,
+                        help="Share of phones stored as plain text (default: 0.5)")
+    parser.add_argument('--null-phone-ratio', type=float, default=0.05,
+                        help="Share of NULL phones (default: 0.05)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the data (default: 42)")
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help=f"Comma-separated migration paths to run (default: {','.join(PATHS)})")
+    parser.add_argument('--variant', dest='variants', action='append', type=parse_variant, metavar='[PATH/]NAME:ARGS',
+                        help="Script options to benchmark, e.g. pool:'--workers 4', or "
+                             "dob/table:'--dob-table /tmp/dob.tbl' for one path only; repeatable "
+                             "(default: one run with the script defaults)")
+    parser.add_argument('--write-strategies', metavar='LIST',
+                        help="Comma-separated --write-strategy values; every variant is run once "
+                             f"with each (choices: {', '.join(pii_migration.WRITE_STRATEGIES)})")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Runs per path and variant; the fastest is reported (default: 1)")
+    parser.add_argument('--mysql-config', metavar='PATH',
+                        help="appsettings file of a scratch MySQL/MariaDB database instead of SQLite")
+    parser.add_argument('--workdir', help="Directory for the SQLite files (default: a temporary directory)")
+    parser.add_argument('--output', metavar='PATH', help="Write the results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="Earlier --output file to compare rows/s against")
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    for path_name in args.paths.split(','):
+        if path_name not in PATHS:
+            parser.error(f"unknown path {path_name!r}; choose from {', '.join(PATHS)}")
+    if not args.variants:
+        args.variants = [(None, 'default', '')]
+    if args.write_strategies:
+        strategies = args.write_strategies.split(',')
+        for strategy in strategies:
+            if strategy not in pii_migration.WRITE_STRATEGIES:
+                parser.error(f"unknown write strategy {strategy!r}; "
+                             f"choose from {', '.join(pii_migration.WRITE_STRATEGIES)}")
+        args.variants = [(path_name, strategy if name == 'default' else f"{name}+{strategy}",
+                          f"{script_args} --write-strategy {strategy}".strip())
+                         for path_name, name, script_args in args.variants for strategy in strategies]
+    return args
+
+
+def run_in_subprocess(spec):
+    """Each run gets a fresh process so peak RSS belongs to that run alone"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(spec)],
+        stdout=subprocess.PIPE, check=True, text=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_result(result, baseline=None):
+    stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['stages'].items())
+    line = (f"  {result['path']:<12} {result['variant']:<16} {result['rows_encrypted']:>9} rows "
+            f"{result['rows_per_second']:>10,.0f} rows/s  {result['statements']:>8} statements  "
+            f"RSS {result['peak_rss_mib']:.0f} MiB (+{result['peak_worker_rss_mib']:.0f} workers)  [{stages}]")
+    if baseline:
+        change = (result['rows_per_second'] / baseline['rows_per_second'] - 1) * 100
+        line += f"  {change:+.1f}% vs baseline"
+    print(line)
+
+
+def main():
+    args = parse_args()
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            for result in json.load(f)['results']:
+                baseline[(result['path'], result['variant'])] = result
+
+    backend = Backend(args)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pii-benchmark-')
+    print("=" * 50)
+    print("PII Migration Benchmark")
+    print("=" * 50)
+    print(f"Generating {args.rows} rows per table ({backend.name}, "
+          f"{args.plain_dob_ratio:.0%} plain DOBs, {args.plain_phone_ratio:.0%} plain phones)...")
+    started = time.perf_counter()
+    backend.populate(workdir)
+    print(f"✅ Data generated in {time.perf_counter() - started:.1f}s")
+    print()
+
+    results = []
+    try:
+        for path_name in args.paths.split(','):
+            for only_path, variant, script_args in args.variants:
+                if only_path and only_path != path_name:
+                    continue
+                best = None
+                for _ in range(args.repeat):
+                    spec = {
+                        'path': path_name,
+                        'variant': variant,
+                        'script_args': script_args,
+                        'db_path': backend.prepare_run(workdir),
+                        'mysql_config': args.mysql_config,
+                    }
+                    try:
+                        result = run_in_subprocess(spec)
+                    except subprocess.CalledProcessError:
+                        print(f"  ❌ {path_name} {variant}: run failed (see the error above)")
+                        break
+                    if best is None or result['seconds'] < best['seconds']:
+                        best = result
+                if best:
+                    print_result(best, baseline.get((path_name, variant)))
+                    results.append(best)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'backend': backend.name,
+                'rows_per_table': args.rows,
+                'plain_dob_ratio': args.plain_dob_ratio,
+                'plain_phone_ratio': args.plain_phone_ratio,
+                'null_phone_ratio': args.null_phone_ratio,
+                'seed': args.seed,
+                'python': sys.version.split()[0],
+                'results': results,
+            }, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
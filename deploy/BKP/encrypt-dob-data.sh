@@ -65,6 +65,9 @@ echo -e "\n${BLUE}Step 2: Copying encryption script to server...${NC}"
 scp -i "$SSH_KEY" -o StrictHostKeyChecking=no \
     "$PROJECT_DIR/deploy/encrypt-dob-python.py" \
     root@$SERVER_IP:/tmp/encrypt-dob.py
+scp -i "$SSH_KEY" -o StrictHostKeyChecking=no \
+    "$PROJECT_DIR"/deploy/pii_*.py \
+    root@$SERVER_IP:/tmp/
 
 # Install pycryptodome if needed and run encryption
 echo -e "\n${BLUE}Step 3: Installing dependencies and running encryption...${NC}"
@@ -95,7 +98,7 @@ ssh -i "$SSH_KEY" -o StrictHostKeyChecking=no root@$SERVER_IP << 'ENDSSH'
     if [ $? -eq 0 ]; then
         echo ""
         echo "✅ Encryption completed successfully!"
-        rm -f /tmp/encrypt-dob.py
+        rm -f /tmp/encrypt-dob.py /tmp/pii_*.py
     else
         echo ""
         echo "❌ Encryption failed. Check the error messages above."
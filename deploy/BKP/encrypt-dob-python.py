@@ -2,25 +2,35 @@
 """
 Script to encrypt existing plain text DateOfBirth data in UserRequests and Users tables.
 This implements the same AES-256 encryption logic as PiiEncryptionService.cs
+(see pii_crypto.py, checked against vectors from the C# service at startup)
+
+Rows are streamed in batches (see pii_migration.py, which must sit next to this
+script), so memory stays bounded by --batch-size regardless of table size.
+Each batch is written back and committed on its own, and its last Id is
+checkpointed so --resume continues a failed run.
+
+  --workers N       encrypt batches in a process pool (output is identical)
+  --cache-size N    per-process LRU for values that repeat
+  --dob-table PATH  precomputed date -> ciphertext table
+  --online          throttle for a database serving production traffic
+  --metrics-textfile PATH  Prometheus metrics (status lines every --status-interval)
+  --pipeline        fetch, encrypt and write concurrently on separate connections
+  --profile PATH    cProfile / sampled flame graph of the run, plus PATH.stages.json
+  --incremental     only rows past the previous pass's watermark (--poll to repeat)
 """
 
+import argparse
 import json
 import sys
-import hashlib
+import time
 from datetime import datetime
-import base64
 
-# Try different import paths for Crypto
-try:
-    from Crypto.Cipher import AES
-    from Crypto.Util.Padding import pad, unpad
-except ImportError:
-    try:
-        from Cryptodome.Cipher import AES
-        from Cryptodome.Util.Padding import pad, unpad
-    except ImportError:
-        print("❌ Error: pycryptodome not installed. Install with: apt-get install python3-pycryptodome")
-        sys.exit(1)
+import pii_crypto
+import pii_migration
+
+if not pii_crypto.BACKENDS:
+    print("❌ Error: pycryptodome not installed. Install with: apt-get install python3-pycryptodome")
+    sys.exit(1)
 
 try:
     import pymysql
@@ -28,60 +38,158 @@ except ImportError:
     print("❌ Error: pymysql not installed. Install with: apt-get install python3-pymysql")
     sys.exit(1)
 
-def get_encryption_key(config_path):
-    """Get encryption key from appsettings.Production.json"""
-    with open(config_path, 'r') as f:
-        config = json.load(f)
-        key = config.get('PiiEncryption', {}).get('Key') or config.get('Encryption', {}).get('Key')
-        if not key:
-            key = "DefaultEncryptionKey32BytesLong!!"  # Default fallback
-        return key
+def format_dob(date_time_str):
+    """Convert a stored plain text date into the "yyyy-MM-dd" string that gets encrypted"""
+    if isinstance(date_time_str, str):
+        # Handle ISO format: "2005-02-03T00:00:00.000000"
+        if 'T' in date_time_str:
+            date_part = date_time_str.split('T')[0]
+        else:
+            date_part = date_time_str.split(' ')[0]
+        
+        # Format as "yyyy-MM-dd" for storage
+        dt = datetime.strptime(date_part, '%Y-%m-%d')
+        return dt.strftime('%Y-%m-%d')
+    return str(date_time_str)
 
-def derive_key_and_iv(encryption_key):
-    """Derive AES key and IV from encryption key (same logic as C#)"""
-    # Derive 32-byte key using SHA256
-    key_hash = hashlib.sha256(encryption_key.encode('utf-8')).digest()
+# What the application stores when no DOB was given
+DOB_UNSET = '0001-01-01T00:00:00.000000'
+
+def is_plain_text_dob(dob_encrypted):
+    """Python side of DOB_BASE_FILTER / DOB_PLAINTEXT_FILTER: a stored plain text (ISO format) date"""
+    return (bool(dob_encrypted)
+            and dob_encrypted != DOB_UNSET
+            and not pii_migration.looks_like_ciphertext(dob_encrypted)
+            and ('T' in dob_encrypted or dob_encrypted.count('-') >= 2))
+
+DOB_BASE_FILTER = """
+    DateOfBirthEncrypted IS NOT NULL
+    AND DateOfBirthEncrypted != ''
+"""
+
+# ISO timestamps only; base64 ciphertext never contains ':'
+DOB_PLAINTEXT_FILTER = """
+    DateOfBirthEncrypted != '0001-01-01T00:00:00.000000'
+    AND DateOfBirthEncrypted LIKE '%%-%%-%%T%%:%%:%%'
+"""
+
+def encrypt_table(conn, read_conn, checkpoint, table, label, key, iv, args, dob_table=None, throttle=None,
+                  metrics=None):
+    """Encrypt plain text DateOfBirthEncrypted values in one table, batch by batch"""
+    encrypted_count = 0
+    skipped_count = 0
+    error_count = 0
+    fetched_count = 0
+    started = time.perf_counter()
+    metrics = metrics or pii_migration.make_metrics(args, 'encrypt-dob')
+    
+    scope = pii_migration.scan_scope(conn, checkpoint, table, 'DateOfBirthEncrypted', args)
+    if scope is None:
+        print(f"  ⏭  {table} already completed according to {args.checkpoint}")
+        return 0, 0
+    start_id, since, watermark = scope
+    if start_id and not args.incremental:
+        print(f"  ↪  Resuming {table} after Id {start_id}")
+    
+    candidates = pii_migration.count_rows(conn, table, pii_migration.and_where(DOB_BASE_FILTER, since), start_id)
+    writer = pii_migration.BatchWriter(
+        conn, table, 'DateOfBirthEncrypted',
+        strategy=args.write_strategy, batch_size=args.batch_size
+    )
+    metrics.start_table(table, 'DateOfBirthEncrypted', start_id, pii_migration.max_value(conn, table, 'Id'))
+    batches = pii_migration.read_stage(metrics.iterate('fetch', pii_migration.iter_batches(
+        read_conn, table, 'DateOfBirthEncrypted',
+        pii_migration.and_where(pii_migration.row_filter(DOB_BASE_FILTER, DOB_PLAINTEXT_FILTER, args.sql_filter),
+                                since),
+        batch_size=throttle or args.batch_size, mode=args.stream, start_id=start_id
+    )), args, metrics)
+    
+    def plain_text_rows():
+        nonlocal skipped_count, fetched_count
+        for batch in batches:
+            fetched_count += len(batch)
+            rows = []
+            for row_id, dob_encrypted in batch:
+                # Safety net behind the SQL filter: check it's plain text (ISO format)
+                if is_plain_text_dob(dob_encrypted):
+                    rows.append((row_id, dob_encrypted))
+                else:
+                    # Already encrypted (base64)
+                    skipped_count += 1
+            yield batch[-1][0], rows
+    
+    def commit_batch(updates, last_id, counts):
+        # Commit each batch so row locks are only held for one batch,
+        # then move the checkpoint past it
+        with metrics.stage('write'):
+            writer.write(updates)
+        checkpoint.record(table, 'DateOfBirthEncrypted', last_id)
+        if throttle:
+            throttle.record(writer.last_write_seconds)
+            with metrics.stage('throttle'):
+                throttle.wait()
+        metrics.progress(table, 'DateOfBirthEncrypted', last_id, **counts)
     
-    # Derive 16-byte IV from key + "IV"
-    iv_hash = hashlib.sha256((encryption_key + "IV").encode('utf-8')).digest()
-    iv = iv_hash[:16]
+    # Batches are encrypted in order, optionally across --workers processes
+    with pii_migration.write_stage(commit_batch, args, metrics) as submit:
+        for last_id, results in metrics.iterate('crypt', pii_migration.encrypt_chunks(
+                plain_text_rows(), key, iv, prepare=format_dob, workers=args.workers,
+                cache_size=args.cache_size, lookup_table=dob_table)):
+            updates = []
+            for row_id, encrypted_value, error in results:
+                if encrypted_value:
+                    updates.append((row_id, encrypted_value))
+                    if args.verbose:
+                        print(f"  ✅ Encrypted {label} {row_id}")
+                else:
+                    print(f"  ❌ Error encrypting {label} {row_id}: {error}")
+                    skipped_count += 1
+                    error_count += 1
+            encrypted_count += len(updates)
+            submit(updates, last_id, dict(fetched=fetched_count, encrypted=encrypted_count,
+                                          skipped=skipped_count, errors=error_count))
     
-    return key_hash, iv
+    checkpoint.complete(table, 'DateOfBirthEncrypted', watermark, args.watermark_columns.get(table, 'Id'))
+    metrics.finish_table(table, 'DateOfBirthEncrypted')
+    elapsed = time.perf_counter() - started
+    print("  🔎 " + pii_migration.format_filter_report(table, candidates, fetched_count, skipped_count))
+    print(f"  ⏱  {table}: {pii_migration.format_rate(encrypted_count, elapsed)}, "
+          f"writes {pii_migration.format_rate(writer.rows_written, writer.write_seconds)} "
+          f"in {writer.batches_committed} commits ({args.write_strategy})")
+    if throttle:
+        print(f"  🐢 {table}: online mode, batch size now {throttle.batch_size}, "
+              f"{throttle.paused_seconds:.1f}s spent pausing")
+    return encrypted_count, skipped_count
 
-def encrypt_datetime(date_time_str, key, iv):
-    """Encrypt a datetime string using AES-256-CBC"""
-    try:
-        # Parse the date string
-        if isinstance(date_time_str, str):
-            # Handle ISO format: "2005-02-03T00:00:00.000000"
-            if 'T' in date_time_str:
-                date_part = date_time_str.split('T')[0]
-            else:
-                date_part = date_time_str.split(' ')[0]
-            
-            # Format as "yyyy-MM-dd" for storage
-            dt = datetime.strptime(date_part, '%Y-%m-%d')
-            plain_text = dt.strftime('%Y-%m-%d')
-        else:
-            plain_text = str(date_time_str)
-        
-        # Encrypt using AES-256-CBC
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        padded_data = pad(plain_text.encode('utf-8'), AES.block_size)
-        encrypted = cipher.encrypt(padded_data)
-        
-        # Return base64 encoded
-        return base64.b64encode(encrypted).decode('utf-8')
-    except Exception as e:
-        print(f"Error encrypting {date_time_str}: {e}")
-        return None
+def parse_args():
+    parser = argparse.ArgumentParser(description="Encrypt plain text DateOfBirth data")
+    parser.add_argument('config_path', nargs='?',
+                        default='/opt/mental-health-app/server/appsettings.Production.json',
+                        help="Path to appsettings.Production.json")
+    pii_migration.add_stream_arguments(parser)
+    parser.add_argument('--dob-table', metavar='PATH',
+                        help="Precomputed date -> ciphertext table; built and saved here "
+                             "if missing or made with another key. Keep it as private as the key.")
+    parser.add_argument('--dob-range', default=pii_migration.DEFAULT_DOB_RANGE,
+                        help="First:last date covered by a newly built --dob-table "
+                             f"(default: {pii_migration.DEFAULT_DOB_RANGE})")
+    args = parser.parse_args()
+    pii_migration.check_arguments(parser, args)
+    return args
 
 def main():
-    config_path = '/opt/mental-health-app/server/appsettings.Production.json'
+    args = parse_args()
+    config_path = args.config_path
     
     # Get encryption key
-    encryption_key = get_encryption_key(config_path)
-    key, iv = derive_key_and_iv(encryption_key)
+    encryption_key = pii_migration.encryption_key_from_appsettings(pii_migration.read_appsettings(config_path))
+    key, iv = pii_crypto.derive_key_and_iv(encryption_key)
+    pii_crypto.self_test()
+    
+    dob_table = None
+    if args.dob_table:
+        dob_table = pii_migration.load_dob_table(args.dob_table, key, iv, args.dob_range)
+        print(f"DOB lookup table: {dob_table.count} dates from {args.dob_table}")
     
     # Get database connection string
     with open(config_path, 'r') as f:
@@ -95,103 +203,53 @@ def main():
             k, v = part.split('=', 1)
             conn_params[k.strip().lower()] = v.strip()
     
+    db_config = dict(
+        host=conn_params.get('server', 'localhost'),
+        port=int(conn_params.get('port', 3306)),
+        user=conn_params.get('user', 'mentalhealth_user'),
+        password=conn_params.get('password', ''),
+        database=conn_params.get('database', 'mentalhealthdb'),
+        charset='utf8mb4'
+    )
+    
     # Connect to database
     try:
-        conn = pymysql.connect(
-            host=conn_params.get('server', 'localhost'),
-            port=int(conn_params.get('port', 3306)),
-            user=conn_params.get('user', 'mentalhealth_user'),
-            password=conn_params.get('password', ''),
-            database=conn_params.get('database', 'mentalhealthdb'),
-            charset='utf8mb4'
-        )
-        
-        cursor = conn.cursor()
-        
-        # Encrypt UserRequests
-        print("Encrypting UserRequests DateOfBirth data...")
-        cursor.execute("""
-            SELECT Id, DateOfBirthEncrypted 
-            FROM UserRequests 
-            WHERE DateOfBirthEncrypted IS NOT NULL 
-            AND DateOfBirthEncrypted != '' 
-            AND DateOfBirthEncrypted != '0001-01-01T00:00:00.000000'
-            AND DateOfBirthEncrypted LIKE '%-%-%T%:%:%'
-        """)
-        
-        user_requests = cursor.fetchall()
-        encrypted_requests = 0
-        skipped_requests = 0
+        conn = pymysql.connect(**db_config)
+        # An unbuffered server-side cursor ties up its connection until the
+        # result set is drained, and --pipeline reads on another thread,
+        # so updates go over a second connection
+        read_conn = pymysql.connect(**db_config) if args.stream == 'server' or args.pipeline else conn
+        checkpoint = pii_migration.Checkpoint(args.checkpoint, db_config['database'])
+        throttle = pii_migration.make_throttle(args, conn, db_config)
+        metrics = pii_migration.make_metrics(args, 'encrypt-dob')
         
-        for req_id, dob_encrypted in user_requests:
-            try:
-                # Check if it's plain text (ISO format)
-                if 'T' in dob_encrypted or dob_encrypted.count('-') >= 2:
-                    # Encrypt it
-                    encrypted_value = encrypt_datetime(dob_encrypted, key, iv)
-                    if encrypted_value:
-                        cursor.execute("""
-                            UPDATE UserRequests 
-                            SET DateOfBirthEncrypted = %s 
-                            WHERE Id = %s
-                        """, (encrypted_value, req_id))
-                        encrypted_requests += 1
-                        print(f"  ✅ Encrypted UserRequest {req_id}")
-                    else:
-                        skipped_requests += 1
-                else:
-                    # Already encrypted (base64)
-                    skipped_requests += 1
-            except Exception as e:
-                print(f"  ❌ Error encrypting UserRequest {req_id}: {e}")
-                skipped_requests += 1
-        
-        # Encrypt Users
-        print("\nEncrypting Users DateOfBirth data...")
-        cursor.execute("""
-            SELECT Id, DateOfBirthEncrypted 
-            FROM Users 
-            WHERE DateOfBirthEncrypted IS NOT NULL 
-            AND DateOfBirthEncrypted != '' 
-            AND DateOfBirthEncrypted != '0001-01-01T00:00:00.000000'
-            AND DateOfBirthEncrypted LIKE '%-%-%T%:%:%'
-        """)
-        
-        users = cursor.fetchall()
-        encrypted_users = 0
-        skipped_users = 0
-        
-        for user_id, dob_encrypted in users:
-            try:
-                # Check if it's plain text (ISO format)
-                if 'T' in dob_encrypted or dob_encrypted.count('-') >= 2:
-                    # Encrypt it
-                    encrypted_value = encrypt_datetime(dob_encrypted, key, iv)
-                    if encrypted_value:
-                        cursor.execute("""
-                            UPDATE Users 
-                            SET DateOfBirthEncrypted = %s 
-                            WHERE Id = %s
-                        """, (encrypted_value, user_id))
-                        encrypted_users += 1
-                        print(f"  ✅ Encrypted User {user_id}")
-                    else:
-                        skipped_users += 1
-                else:
-                    # Already encrypted (base64)
-                    skipped_users += 1
-            except Exception as e:
-                print(f"  ❌ Error encrypting User {user_id}: {e}")
-                skipped_users += 1
-        
-        # Commit changes
-        conn.commit()
+        def run_pass():
+            conn.ping(reconnect=True)
+            
+            # Encrypt UserRequests
+            print("Encrypting UserRequests DateOfBirth data...")
+            encrypted_requests, skipped_requests = encrypt_table(
+                conn, read_conn, checkpoint, 'UserRequests', 'UserRequest', key, iv, args, dob_table, throttle, metrics
+            )
+            
+            # Encrypt Users
+            print("\nEncrypting Users DateOfBirth data...")
+            encrypted_users, skipped_users = encrypt_table(
+                conn, read_conn, checkpoint, 'Users', 'User', key, iv, args, dob_table, throttle, metrics
+            )
+            
+            print(f"\n✅ Encryption complete!")
+            print(f"   UserRequests: {encrypted_requests} encrypted, {skipped_requests} skipped")
+            print(f"   Users: {encrypted_users} encrypted, {skipped_users} skipped")
+            return encrypted_requests + encrypted_users
         
-        print(f"\n✅ Encryption complete!")
-        print(f"   UserRequests: {encrypted_requests} encrypted, {skipped_requests} skipped")
-        print(f"   Users: {encrypted_users} encrypted, {skipped_users} skipped")
+        with pii_migration.profiled(args, metrics):
+            run_pass()
+            if args.poll:
+                pii_migration.poll(run_pass, args.poll)
         
-        cursor.close()
+        if read_conn is not conn:
+            read_conn.close()
         conn.close()
         
     except Exception as e:
@@ -200,4 +258,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -66,6 +66,9 @@ echo ""
 echo -e "${BLUE}Step 2: Copying Python encryption script to server (fallback)...${NC}"
 
 # Copy Python encryption script as fallback
+scp -i "$SSH_KEY" -o StrictHostKeyChecking=no \
+    "$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"/pii_*.py \
+    root@$SERVER_IP:/tmp/ && \
 scp -i "$SSH_KEY" -o StrictHostKeyChecking=no \
     "$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/encrypt-mobilephone-python.py" \
     root@$SERVER_IP:/tmp/encrypt-mobilephone.py
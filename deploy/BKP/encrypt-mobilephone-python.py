@@ -1,43 +1,46 @@
 #!/usr/bin/env python3
 """
 Encrypt MobilePhone data using AES-256 encryption
-This script replicates the C# PiiEncryptionService logic for encrypting phone numbers.
+This script replicates the C# PiiEncryptionService logic for encrypting phone numbers
+(see pii_crypto.py, checked against vectors from the C# service at startup).
+
+Rows are streamed in batches (see pii_migration.py, which must sit next to this
+script), so memory stays bounded by --batch-size regardless of table size.
+Each batch is written back and committed on its own, and its last Id is
+checkpointed so --resume continues a failed run.
+
+  --workers N       encrypt batches in a process pool (output is identical)
+  --cache-size N    per-process LRU for values that repeat
+  --online          throttle for a database serving production traffic
+  --blind-index     also backfill MobilePhoneBlindIndex (see phone_blind_index;
+                    needs PiiEncryption:BlindIndexKey)
+  --normalize       encrypt plain text phones in their normalized form
+  --duplicate-report PATH  JSON report of phones shared by several rows
+  --pipeline        fetch, encrypt and write concurrently on separate connections
+  --metrics-textfile PATH  Prometheus metrics (status lines every --status-interval)
+  --profile PATH    cProfile / sampled flame graph of the run, plus PATH.stages.json
+  --incremental     only rows past the previous pass's watermark (--poll to repeat)
 """
 
+import argparse
+import os
+import re
 import sys
+import time
 import json
-import base64
 import hashlib
+import hmac
 import pymysql
-from Cryptodome.Cipher import AES
-from Cryptodome.Util.Padding import pad, unpad
+
+import pii_crypto
+import pii_migration
 
 def get_encryption_key_and_iv(config_file):
     """Get encryption key and IV from appsettings.Production.json
     Matches the C# PiiEncryptionService logic exactly"""
     try:
-        with open(config_file, 'r') as f:
-            config = json.load(f)
-            
-        # Try PiiEncryption:Key first
-        encryption_key = config.get('PiiEncryption', {}).get('Key', '')
-        if not encryption_key:
-            # Fallback to Encryption:Key
-            encryption_key = config.get('Encryption', {}).get('Key', '')
-        
-        if not encryption_key:
-            # Use default fallback (same as C#)
-            encryption_key = "DefaultEncryptionKey32BytesLong!!"
-        
-        # Derive key and IV exactly like C# code
-        # Key: SHA256 hash of encryption key (32 bytes)
-        key_hash = hashlib.sha256(encryption_key.encode('utf-8')).digest()
-        
-        # IV: First 16 bytes of SHA256 hash of (encryption_key + "IV")
-        iv_hash = hashlib.sha256((encryption_key + "IV").encode('utf-8')).digest()
-        iv = iv_hash[:16]
-        
-        return key_hash, iv
+        config = pii_migration.read_appsettings(config_file)
+        return pii_crypto.derive_key_and_iv(pii_migration.encryption_key_from_appsettings(config))
     except Exception as e:
         print(f"ERROR: Failed to read config file: {e}", file=sys.stderr)
         sys.exit(1)
@@ -69,61 +72,479 @@ def get_db_connection(config_file):
         print(f"ERROR: Failed to parse connection string: {e}", file=sys.stderr)
         sys.exit(1)
 
-def encrypt_phone(phone, key, iv):
-    """Encrypt phone number using AES-256-CBC with consistent IV (matches C# logic)"""
-    try:
-        # Create cipher with consistent IV (derived from key, not random)
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        
-        # Pad and encrypt (PKCS7 padding)
-        padded_data = pad(phone.encode('utf-8'), AES.block_size)
-        ciphertext = cipher.encrypt(padded_data)
-        
-        # Base64 encode (C# doesn't include IV in output, it's derived)
-        encrypted = base64.b64encode(ciphertext).decode('utf-8')
-        
-        return encrypted
-    except Exception as e:
-        print(f"ERROR: Encryption failed: {e}", file=sys.stderr)
-        return None
-
 def is_encrypted(phone_encrypted):
-    """Check if phone number is already encrypted"""
-    if not phone_encrypted:
-        return False
+    """Check if phone number is already encrypted
     
-    try:
-        # Try to decode base64
-        decoded = base64.b64decode(phone_encrypted)
-        # Encrypted data should be at least 16 bytes (IV) + some ciphertext
-        if len(decoded) < 16:
-            return False
-        # If it decodes successfully and is long enough, assume it's encrypted
-        # Plain text phone numbers are typically 10-20 characters
-        if len(phone_encrypted) > 30 and phone_encrypted.count('=') > 0:
-            return True
-        return False
-    except:
-        # If base64 decode fails, it's likely plain text
-        return False
+    Ciphertext is base64 of whole 16-byte AES blocks. A 12 character phone
+    encrypts to only 24 characters, so length alone can't tell them apart."""
+    return pii_migration.looks_like_ciphertext(phone_encrypted)
+
+# Characters .NET's string.Trim() removes (char.IsWhiteSpace). Python's
+# str.strip() also removes U+001C-U+001F, which .NET keeps.
+CSHARP_WHITESPACE = ''.join(chr(c) for c in (
+    *range(0x09, 0x0e), 0x20, 0x85, 0xa0, 0x1680, *range(0x2000, 0x200b),
+    0x2028, 0x2029, 0x202f, 0x205f, 0x3000
+))
+
+def _is_csharp_digit(c):
+    # char.IsDigit is Unicode category Nd (str.isdecimal, not str.isdigit),
+    # and a C# char can't hold a code point outside the BMP
+    return c.isdecimal() and c <= '\uffff'
 
 def normalize_phone(phone):
-    """Normalize phone number for comparison"""
+    """Normalize phone number for comparison
+    Matches NormalizePhoneNumber in UserRequestService.cs"""
     if not phone:
         return ""
+    phone = phone.strip(CSHARP_WHITESPACE)
     # Remove all non-digit characters except leading +
-    normalized = ""
     if phone.startswith('+'):
-        normalized = '+'
-    normalized += ''.join(c for c in phone if c.isdigit())
-    return normalized
+        return '+' + ''.join(c for c in phone[1:] if _is_csharp_digit(c))
+    return ''.join(c for c in phone if _is_csharp_digit(c))
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 encrypt-mobilephone-python.py <path-to-appsettings.Production.json>")
-        sys.exit(1)
+# Anything normalize_phone() drops: \D is everything that isn't Unicode Nd (like
+# str.isdecimal), plus the digits a C# char can't hold
+_NON_DIGIT_RE = re.compile(r'\D|[^\x00-\uffff]')
+_NORMALIZED_PHONE_RE = re.compile(r'\+?[0-9]+')
+
+def normalize_phones(phones):
+    """normalize_phone() over a whole batch
+    
+    Phones that are already normalized (the common case once a table has been
+    through --normalize) are passed through without being rebuilt."""
+    normalized_match = _NORMALIZED_PHONE_RE.fullmatch
+    strip_non_digits = _NON_DIGIT_RE.sub
+    results = []
+    for phone in phones:
+        if not phone:
+            results.append("")
+        elif normalized_match(phone):
+            results.append(phone)
+        else:
+            phone = phone.strip(CSHARP_WHITESPACE)
+            if phone.startswith('+'):
+                results.append('+' + strip_non_digits('', phone[1:]))
+            else:
+                results.append(strip_non_digits('', phone))
+    return results
+
+def mask_phone(phone):
+    """Normalized phone with all but the last two digits hidden, for reports"""
+    digits = phone.lstrip('+')
+    visible = digits[-2:] if len(digits) > 4 else ''
+    return phone[:len(phone) - len(digits)] + '*' * (len(digits) - len(visible)) + visible
+
+# (input, what UserRequestService.NormalizePhoneNumber returns)
+PHONE_NORMALIZATION_VECTORS = (
+    ('', ''),
+    ('   ', ''),
+    (' +1 (555) 123-4567 ', '+15551234567'),
+    ('555.123.4567 ext 89', '555123456789'),
+    ('1+555+123', '1555123'),
+    ('++1 555', '+1555'),
+    ('\u00a0+44 20 7946 0958\u3000', '+442079460958'),
+    ('\x1c+1555', '1555'),
+    ('\u0665\u0665\u0665-1234', '\u0665\u0665\u06651234'),
+    ('555\u00b2', '555'),
+    ('\U0001d7ce555', '555'),
+)
+
+def check_phone_normalization():
+    """Fail fast if normalize_phone() drifts from the C# normalization"""
+    for phone, expected in PHONE_NORMALIZATION_VECTORS:
+        if normalize_phone(phone) != expected:
+            raise RuntimeError(f"normalize_phone({phone!r}) does not match UserRequestService")
+    phones = [phone for phone, _ in PHONE_NORMALIZATION_VECTORS]
+    if normalize_phones(phones) != [expected for _, expected in PHONE_NORMALIZATION_VECTORS]:
+        raise RuntimeError("normalize_phones() does not match normalize_phone()")
+
+def phone_blind_index(phone, index_key):
+    """Blind index of a phone number: hex HMAC-SHA256 of the normalized phone
+    
+    Equal phones in different formats get the same index, so a duplicate check
+    is one indexed lookup instead of decrypting every row. None if nothing is
+    left after normalizing."""
+    normalized = normalize_phone(phone)
+    if not normalized:
+        return None
+    return hmac.new(index_key, normalized.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def is_plain_text_phone(phone_encrypted):
+    """Python side of PHONE_BASE_FILTER / PHONE_PLAINTEXT_FILTER"""
+    return bool(phone_encrypted) and not is_encrypted(phone_encrypted)
+
+PHONE_BASE_FILTER = """
+    MobilePhoneEncrypted IS NOT NULL
+    AND MobilePhoneEncrypted != ''
+"""
+
+# Everything that doesn't have the shape of a ciphertext is treated as plain text
+PHONE_PLAINTEXT_FILTER = "NOT " + pii_migration.ciphertext_predicate('MobilePhoneEncrypted')
+
+def encrypt_table(conn, read_conn, checkpoint, table, label, key, iv, args, throttle=None, metrics=None):
+    """Encrypt plain text MobilePhoneEncrypted values in one table, batch by batch"""
+    encrypted_count = 0
+    skipped_count = 0
+    error_count = 0
+    fetched_count = 0
+    normalized_count = 0
+    started = time.perf_counter()
+    metrics = metrics or pii_migration.make_metrics(args, 'encrypt-mobilephone')
+    
+    scope = pii_migration.scan_scope(conn, checkpoint, table, 'MobilePhoneEncrypted', args)
+    if scope is None:
+        print(f"⏭  {table} already completed according to {args.checkpoint}")
+        return 0, 0, 0
+    start_id, since, watermark = scope
+    if start_id and not args.incremental:
+        print(f"↪  Resuming {table} after Id {start_id}")
+    
+    candidates = pii_migration.count_rows(conn, table, pii_migration.and_where(PHONE_BASE_FILTER, since), start_id)
+    writer = pii_migration.BatchWriter(
+        conn, table, 'MobilePhoneEncrypted',
+        strategy=args.write_strategy, batch_size=args.batch_size
+    )
+    metrics.start_table(table, 'MobilePhoneEncrypted', start_id, pii_migration.max_value(conn, table, 'Id'))
+    batches = pii_migration.read_stage(metrics.iterate('fetch', pii_migration.iter_batches(
+        read_conn, table, 'MobilePhoneEncrypted',
+        pii_migration.and_where(pii_migration.row_filter(PHONE_BASE_FILTER, PHONE_PLAINTEXT_FILTER, args.sql_filter),
+                                since),
+        batch_size=throttle or args.batch_size, mode=args.stream, start_id=start_id
+    )), args, metrics)
+    
+    def plain_text_rows():
+        nonlocal skipped_count, fetched_count, normalized_count
+        for batch in batches:
+            fetched_count += len(batch)
+            rows = []
+            for row_id, phone_encrypted in batch:
+                # Safety net behind the SQL filter: check if already encrypted
+                if is_encrypted(phone_encrypted):
+                    skipped_count += 1
+                else:
+                    rows.append((row_id, phone_encrypted))
+            if args.normalize:
+                # Deterministic encryption only maps equal phones to equal ciphertexts
+                # if they are stored in the same format. A value without any digits
+                # is kept as it was rather than encrypted as an empty string.
+                normalized = normalize_phones([phone for _, phone in rows])
+                normalized_count += sum(1 for (_, phone), new in zip(rows, normalized) if new and new != phone)
+                rows = [(row_id, new or phone) for (row_id, phone), new in zip(rows, normalized)]
+            yield batch[-1][0], rows
+    
+    def commit_batch(updates, last_id, counts):
+        # Commit each batch so row locks are only held for one batch,
+        # then move the checkpoint past it
+        with metrics.stage('write'):
+            writer.write(updates)
+        checkpoint.record(table, 'MobilePhoneEncrypted', last_id)
+        if throttle:
+            throttle.record(writer.last_write_seconds)
+            with metrics.stage('throttle'):
+                throttle.wait()
+        metrics.progress(table, 'MobilePhoneEncrypted', last_id, **counts)
+    
+    # Batches are encrypted in order, optionally across --workers processes
+    with pii_migration.write_stage(commit_batch, args, metrics) as submit:
+        for last_id, results in metrics.iterate('crypt', pii_migration.encrypt_chunks(
+                plain_text_rows(), key, iv, workers=args.workers, cache_size=args.cache_size)):
+            updates = []
+            for row_id, encrypted, error in results:
+                if encrypted:
+                    updates.append((row_id, encrypted))
+                else:
+                    print(f"⚠️  Error processing {label} {row_id}: {error}", file=sys.stderr)
+                    error_count += 1
+            encrypted_count += len(updates)
+            submit(updates, last_id, dict(fetched=fetched_count, encrypted=encrypted_count,
+                                          skipped=skipped_count, errors=error_count))
+    
+    checkpoint.complete(table, 'MobilePhoneEncrypted', watermark, args.watermark_columns.get(table, 'Id'))
+    metrics.finish_table(table, 'MobilePhoneEncrypted')
+    elapsed = time.perf_counter() - started
+    print("🔎 " + pii_migration.format_filter_report(table, candidates, fetched_count, skipped_count))
+    if args.normalize:
+        print(f"📞 {table}: {normalized_count} phones normalized before encryption")
+    print(f"⏱  {table}: {pii_migration.format_rate(encrypted_count, elapsed)}, "
+          f"writes {pii_migration.format_rate(writer.rows_written, writer.write_seconds)} "
+          f"in {writer.batches_committed} commits ({args.write_strategy})")
+    if throttle:
+        print(f"🐢 {table}: online mode, batch size now {throttle.batch_size}, "
+              f"{throttle.paused_seconds:.1f}s spent pausing")
+    return encrypted_count, skipped_count, error_count
+
+BLIND_INDEX_COLUMN = 'MobilePhoneBlindIndex'
+
+BLIND_INDEX_FILTER = PHONE_BASE_FILTER + f"    AND {BLIND_INDEX_COLUMN} IS NULL\n"
+
+# Per-process state for the blind index pool, set by _init_blind_index_worker
+_blind_index_decryptor = None
+_blind_index_key = None
+
+def _init_blind_index_worker(key, iv, index_key):
+    global _blind_index_decryptor, _blind_index_key
+    _blind_index_decryptor = pii_crypto.FixedIvEncryptor(key, iv)
+    _blind_index_key = index_key
+
+def _plain_text_phones(rows):
+    """(Id, stored phone) rows -> (Id, plain text phone or None, error or None)"""
+    encrypted = [stored for _, stored in rows if is_encrypted(stored)]
+    decrypted = iter(_blind_index_decryptor.decrypt_batch(encrypted))
+    results = []
+    for row_id, stored in rows:
+        phone = stored
+        if is_encrypted(stored):
+            phone = next(decrypted)
+            if phone is None or not pii_migration.plausible_plain_text('MobilePhoneEncrypted', phone):
+                results.append((row_id, None, "does not decrypt with the configured key"))
+                continue
+        results.append((row_id, phone, None))
+    return results
+
+def _blind_index_chunk(rows):
+    """Blind-index (Id, stored phone) rows, returning (Id, index or None, error or None)"""
+    return [(row_id, phone_blind_index(phone, _blind_index_key) if phone is not None else None, error)
+            for row_id, phone, error in _plain_text_phones(rows)]
+
+def _normalized_phone_chunk(rows):
+    """Normalize (Id, stored phone) rows, returning (Id, normalized phone or None, error or None)"""
+    results = _plain_text_phones(rows)
+    normalized = iter(normalize_phones([phone for _, phone, _ in results if phone is not None]))
+    return [(row_id, next(normalized) if phone is not None else None, error) for row_id, phone, error in results]
+
+def ensure_blind_index_column(conn, table):
+    """Add the MobilePhoneBlindIndex column if it is missing"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (table, BLIND_INDEX_COLUMN)
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {BLIND_INDEX_COLUMN} VARCHAR(64) NULL")
+            print(f"✅ Added {table}.{BLIND_INDEX_COLUMN}")
+    finally:
+        cursor.close()
+
+def ensure_blind_index(conn, table):
+    """Create the index on MobilePhoneBlindIndex if it is missing
+    
+    Built after the backfill, so the backfill doesn't pay for index maintenance."""
+    index_name = f"IX_{table}_{BLIND_INDEX_COLUMN}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, index_name)
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(f"CREATE INDEX {index_name} ON {table} ({BLIND_INDEX_COLUMN})")
+            print(f"✅ Created index {index_name}")
+    finally:
+        cursor.close()
+
+def backfill_blind_index(conn, read_conn, checkpoint, table, label, key, iv, index_key, args, throttle=None,
+                         metrics=None):
+    """Fill MobilePhoneBlindIndex for rows that don't have one yet, batch by batch"""
+    indexed_count = 0
+    error_count = 0
+    fetched_count = 0
+    started = time.perf_counter()
+    metrics = metrics or pii_migration.make_metrics(args, 'encrypt-mobilephone')
+    
+    scope = pii_migration.scan_scope(conn, checkpoint, table, BLIND_INDEX_COLUMN, args)
+    if scope is None:
+        print(f"⏭  {table} blind index already completed according to {args.checkpoint}")
+        return 0, 0
+    start_id, since, watermark = scope
+    if start_id and not args.incremental:
+        print(f"↪  Resuming {table} blind index after Id {start_id}")
+    
+    writer = pii_migration.BatchWriter(
+        conn, table, BLIND_INDEX_COLUMN,
+        strategy=args.write_strategy, batch_size=args.batch_size
+    )
+    metrics.start_table(table, BLIND_INDEX_COLUMN, start_id, pii_migration.max_value(conn, table, 'Id'))
+    batches = pii_migration.read_stage(metrics.iterate('fetch', pii_migration.iter_batches(
+        read_conn, table, 'MobilePhoneEncrypted', pii_migration.and_where(BLIND_INDEX_FILTER, since),
+        batch_size=throttle or args.batch_size, mode=args.stream, start_id=start_id
+    )), args, metrics)
+    
+    def chunks():
+        nonlocal fetched_count
+        for batch in batches:
+            fetched_count += len(batch)
+            yield batch[-1][0], batch
+    
+    def commit_batch(updates, last_id, counts):
+        with metrics.stage('write'):
+            writer.write(updates)
+        checkpoint.record(table, BLIND_INDEX_COLUMN, last_id)
+        if throttle:
+            throttle.record(writer.last_write_seconds)
+            with metrics.stage('throttle'):
+                throttle.wait()
+        metrics.progress(table, BLIND_INDEX_COLUMN, last_id, **counts)
+    
+    with pii_migration.write_stage(commit_batch, args, metrics) as submit:
+        for last_id, results in metrics.iterate('crypt', pii_migration.process_chunks(
+                chunks(), _blind_index_chunk, _init_blind_index_worker, (key, iv, index_key), args.workers)):
+            updates = []
+            for row_id, index, error in results:
+                if index:
+                    updates.append((row_id, index))
+                elif error:
+                    print(f"⚠️  Error indexing {label} {row_id}: {error}", file=sys.stderr)
+                    error_count += 1
+            indexed_count += len(updates)
+            submit(updates, last_id, dict(fetched=fetched_count, encrypted=indexed_count, errors=error_count))
+    
+    checkpoint.complete(table, BLIND_INDEX_COLUMN, watermark, args.watermark_columns.get(table, 'Id'))
+    metrics.finish_table(table, BLIND_INDEX_COLUMN)
+    elapsed = time.perf_counter() - started
+    print(f"⏱  {table} blind index: {pii_migration.format_rate(indexed_count, elapsed)}")
+    return indexed_count, error_count
+
+def find_duplicate_phones(read_conn, key, iv, args, tables=('Users', 'UserRequests')):
+    """Group rows of all tables by normalized phone in one pass
+    
+    Each phone is looked up in a dict of the first row it was seen in, so this is
+    linear in the number of rows. Returns ({phone: [(table, Id), ...]} for phones
+    on more than one row, rows scanned, distinct phones, rows that didn't decrypt)."""
+    first_seen = {}
+    duplicates = {}
+    scanned = 0
+    error_count = 0
+    for table in tables:
+        batches = pii_migration.iter_batches(read_conn, table, 'MobilePhoneEncrypted', PHONE_BASE_FILTER,
+                                             batch_size=args.batch_size, mode=args.stream)
+        chunks = ((table, batch) for batch in batches)
+        for _, results in pii_migration.process_chunks(
+                chunks, _normalized_phone_chunk, _init_blind_index_worker, (key, iv, None), args.workers):
+            scanned += len(results)
+            for row_id, phone, error in results:
+                if error:
+                    error_count += 1
+                if not phone:
+                    continue
+                row = (table, row_id)
+                first = first_seen.setdefault(phone, row)
+                if first is not row:
+                    duplicates.setdefault(phone, [first]).append(row)
+    return duplicates, scanned, len(first_seen), error_count
+
+def report_duplicate_phones(read_conn, key, iv, args):
+    """Step 6: print a summary and write the --duplicate-report JSON"""
+    print("Step 6: Looking for phones shared by several rows...")
+    started = time.perf_counter()
+    duplicates, scanned, distinct, error_count = find_duplicate_phones(read_conn, key, iv, args)
+    elapsed = time.perf_counter() - started
+    groups = sorted(duplicates.items(), key=lambda item: (-len(item[1]), item[1][0]))
+    cross_table = sum(1 for _, rows in groups if len({table for table, _ in rows}) > 1)
+    print(f"✅ {scanned} phones scanned, {distinct} distinct after normalizing, "
+          f"{len(groups)} shared by more than one row ({cross_table} across tables), {error_count} errors")
+    for phone, rows in groups[:10]:
+        print(f"   {mask_phone(phone):<16} {len(rows)} rows: "
+              + ", ".join(f"{table} {row_id}" for table, row_id in rows[:5])
+              + (", ..." if len(rows) > 5 else ""))
+    print(f"⏱  {pii_migration.format_rate(scanned, elapsed)}")
+    
+    # Row Ids next to (masked) phones: readable by the owner only
+    fd = os.open(args.duplicate_report, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows_scanned': scanned,
+            'distinct_phones': distinct,
+            'errors': error_count,
+            'groups': [{
+                'phone': mask_phone(phone),
+                'count': len(rows),
+                'rows': [{'table': table, 'id': row_id} for table, row_id in rows],
+            } for phone, rows in groups],
+        }, f, indent=2)
+    print(f"✅ Duplicate report written to {args.duplicate_report}")
+    print()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Encrypt plain text MobilePhone data")
+    parser.add_argument('config_file', help="Path to appsettings.Production.json")
+    pii_migration.add_stream_arguments(parser)
+    parser.add_argument('--blind-index', action='store_true',
+                        help=f"After encrypting, backfill {BLIND_INDEX_COLUMN} (HMAC of the normalized phone, "
+                             "keyed by PiiEncryption:BlindIndexKey), adding the column and its index if missing")
+    parser.add_argument('--blind-index-only', action='store_true',
+                        help="Only backfill the blind index, skip encryption")
+    parser.add_argument('--normalize', action='store_true',
+                        help="Encrypt plain text phones as NormalizePhoneNumber() would normalize them "
+                             "(leading + and digits only), so equal phones get equal ciphertexts")
+    parser.add_argument('--duplicate-report', metavar='PATH',
+                        help="Afterwards, group the phones of both tables by normalized value and "
+                             "write the ones shared by several rows to PATH as JSON")
+    parser.add_argument('--duplicate-report-only', action='store_true',
+                        help="Only write the --duplicate-report, skip encryption")
+    args = parser.parse_args()
+    pii_migration.check_arguments(parser, args)
+    if args.duplicate_report_only and not args.duplicate_report:
+        parser.error("--duplicate-report-only needs --duplicate-report PATH")
+    return args
+
+def encrypt_tables(conn, read_conn, checkpoint, key, iv, args, throttle, metrics):
+    """Steps 3 and 4; returns the number of rows encrypted or failed"""
+    changed = 0
+    
+    # Encrypt Users table
+    print("Step 3: Encrypting Users table...")
+    try:
+        encrypted_count, skipped_count, error_count = encrypt_table(
+            conn, read_conn, checkpoint, 'Users', 'user', key, iv, args, throttle, metrics
+        )
+        print(f"✅ Users table: {encrypted_count} encrypted, {skipped_count} skipped, {error_count} errors")
+        print()
+        changed += encrypted_count + error_count
+    except Exception as e:
+        print(f"❌ Error processing Users table: {e}", file=sys.stderr)
+        conn.rollback()
+    
+    # Encrypt UserRequests table
+    print("Step 4: Encrypting UserRequests table...")
+    try:
+        encrypted_count, skipped_count, error_count = encrypt_table(
+            conn, read_conn, checkpoint, 'UserRequests', 'user request', key, iv, args, throttle, metrics
+        )
+        print(f"✅ UserRequests table: {encrypted_count} encrypted, {skipped_count} skipped, {error_count} errors")
+        print()
+        changed += encrypted_count + error_count
+    except Exception as e:
+        print(f"❌ Error processing UserRequests table: {e}", file=sys.stderr)
+        conn.rollback()
     
-    config_file = sys.argv[1]
+    return changed
+
+def backfill_blind_indexes(conn, read_conn, checkpoint, key, iv, index_key, args, throttle, metrics):
+    """Step 5; returns the number of rows indexed or failed"""
+    changed = 0
+    print("Step 5: Backfilling phone blind index...")
+    for table, label in (('Users', 'user'), ('UserRequests', 'user request')):
+        try:
+            ensure_blind_index_column(conn, table)
+            indexed_count, error_count = backfill_blind_index(
+                conn, read_conn, checkpoint, table, label, key, iv, index_key, args, throttle, metrics
+            )
+            ensure_blind_index(conn, table)
+            print(f"✅ {table} table: {indexed_count} indexed, {error_count} errors")
+            print()
+            changed += indexed_count + error_count
+        except Exception as e:
+            print(f"❌ Error indexing {table} table: {e}", file=sys.stderr)
+            conn.rollback()
+    return changed
+
+def main():
+    args = parse_args()
+    config_file = args.config_file
     
     print("=" * 50)
     print("MobilePhone Encryption Script")
@@ -133,8 +554,18 @@ def main():
     # Get encryption key and IV
     print("Step 1: Loading encryption key and IV...")
     key, iv = get_encryption_key_and_iv(config_file)
+    pii_crypto.self_test()
+    check_phone_normalization()
     print(f"✅ Encryption key loaded (length: {len(key)} bytes)")
     print(f"✅ IV loaded (length: {len(iv)} bytes)")
+    index_key = None
+    if args.blind_index or args.blind_index_only:
+        try:
+            index_key = pii_migration.blind_index_key_from_appsettings(pii_migration.read_appsettings(config_file))
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        print("✅ Blind index key loaded")
     print()
     
     # Get database connection
@@ -144,102 +575,43 @@ def main():
     
     try:
         conn = pymysql.connect(**db_config)
-        cursor = conn.cursor()
+        # An unbuffered server-side cursor ties up its connection until the
+        # result set is drained, and --pipeline reads on another thread,
+        # so updates go over a second connection
+        read_conn = pymysql.connect(**db_config) if args.stream == 'server' or args.pipeline else conn
+        checkpoint = pii_migration.Checkpoint(args.checkpoint, db_config['database'])
+        throttle = pii_migration.make_throttle(args, conn, db_config)
+        metrics = pii_migration.make_metrics(args, 'encrypt-mobilephone')
         print("✅ Database connection established")
+        print(f"✅ Reading rows in batches of {args.batch_size} ({args.stream} mode)")
         print()
     except Exception as e:
         print(f"❌ Database connection failed: {e}", file=sys.stderr)
         sys.exit(1)
     
-    # Encrypt Users table
-    print("Step 3: Encrypting Users table...")
-    try:
-        cursor.execute("""
-            SELECT Id, MobilePhoneEncrypted 
-            FROM Users 
-            WHERE MobilePhoneEncrypted IS NOT NULL 
-            AND MobilePhoneEncrypted != ''
-        """)
-        users = cursor.fetchall()
+    def run_pass():
+        conn.ping(reconnect=True)
+        changed = 0
         
-        encrypted_count = 0
-        skipped_count = 0
-        error_count = 0
+        if args.duplicate_report_only:
+            return changed
         
-        for user_id, phone_encrypted in users:
-            try:
-                # Check if already encrypted
-                if is_encrypted(phone_encrypted):
-                    skipped_count += 1
-                    continue
-                
-                # Encrypt the plain text phone
-                encrypted = encrypt_phone(phone_encrypted, key, iv)
-                if encrypted:
-                    cursor.execute("""
-                        UPDATE Users 
-                        SET MobilePhoneEncrypted = %s 
-                        WHERE Id = %s
-                    """, (encrypted, user_id))
-                    encrypted_count += 1
-                else:
-                    error_count += 1
-            except Exception as e:
-                print(f"⚠️  Error processing user {user_id}: {e}", file=sys.stderr)
-                error_count += 1
+        if not args.blind_index_only:
+            changed += encrypt_tables(conn, read_conn, checkpoint, key, iv, args, throttle, metrics)
         
-        conn.commit()
-        print(f"✅ Users table: {encrypted_count} encrypted, {skipped_count} skipped, {error_count} errors")
-        print()
-    except Exception as e:
-        print(f"❌ Error processing Users table: {e}", file=sys.stderr)
-        conn.rollback()
+        if args.blind_index or args.blind_index_only:
+            changed += backfill_blind_indexes(conn, read_conn, checkpoint, key, iv, index_key, args, throttle, metrics)
+        return changed
     
-    # Encrypt UserRequests table
-    print("Step 4: Encrypting UserRequests table...")
-    try:
-        cursor.execute("""
-            SELECT Id, MobilePhoneEncrypted 
-            FROM UserRequests 
-            WHERE MobilePhoneEncrypted IS NOT NULL 
-            AND MobilePhoneEncrypted != ''
-        """)
-        requests = cursor.fetchall()
-        
-        encrypted_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        for request_id, phone_encrypted in requests:
-            try:
-                # Check if already encrypted
-                if is_encrypted(phone_encrypted):
-                    skipped_count += 1
-                    continue
-                
-                # Encrypt the plain text phone
-                encrypted = encrypt_phone(phone_encrypted, key, iv)
-                if encrypted:
-                    cursor.execute("""
-                        UPDATE UserRequests 
-                        SET MobilePhoneEncrypted = %s 
-                        WHERE Id = %s
-                    """, (encrypted, request_id))
-                    encrypted_count += 1
-                else:
-                    error_count += 1
-            except Exception as e:
-                print(f"⚠️  Error processing user request {request_id}: {e}", file=sys.stderr)
-                error_count += 1
-        
-        conn.commit()
-        print(f"✅ UserRequests table: {encrypted_count} encrypted, {skipped_count} skipped, {error_count} errors")
-        print()
-    except Exception as e:
-        print(f"❌ Error processing UserRequests table: {e}", file=sys.stderr)
-        conn.rollback()
+    with pii_migration.profiled(args, metrics):
+        run_pass()
+        if args.duplicate_report:
+            report_duplicate_phones(read_conn, key, iv, args)
+        if args.poll:
+            pii_migration.poll(run_pass, args.poll)
     
-    cursor.close()
+    if read_conn is not conn:
+        read_conn.close()
     conn.close()
     
     print("=" * 50)
@@ -247,5 +619,4 @@ def main():
     print("=" * 50)
 
 if __name__ == "__main__":
-    main()
-
+    main()
\ No newline at end of file
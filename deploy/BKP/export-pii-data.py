@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Export decrypted DateOfBirth / MobilePhone data for audits and analytics.
+
+Uses the same appsettings.Production.json key and connection string as the
+encryption scripts (pii_migration.py and pii_crypto.py must sit next to this
+script). Each table is split into Id ranges of --chunk-rows; every range is
+read, decrypted and written to its own file by one of --workers processes,
+each with its own database connection, so memory stays flat and throughput
+grows with the number of cores:
+
+    python3 export-pii-data.py /opt/mental-health-app/server/appsettings.Production.json \\
+        --output-dir /var/tmp/pii-export --columns Id,Email,DateOfBirthEncrypted --min-id 1000
+
+Files are named <table>-<first Id>-<last Id>.csv (or .parquet with
+--format parquet, which needs pyarrow) and a manifest.json lists them with
+their row counts. Encrypted columns are written decrypted, under their name
+without the "Encrypted" suffix; values still in plain text are passed
+through and values that don't decrypt are left empty and counted. Parquet
+columns take their type from the table: integers, floats, dates and
+datetimes keep it, anything else (DECIMAL included) is written as text.
+
+The output is plain text PII: it is created owner-readable only. Delete it
+when the audit is done.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import pymysql
+    from pymysql.constants import FIELD_TYPE
+except ImportError:
+    print("❌ Error: pymysql not installed. Install with: apt-get install python3-pymysql")
+    sys.exit(1)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import pii_crypto
+import pii_migration
+
+TABLES = ('Users', 'UserRequests')
+PII_COLUMNS = ('DateOfBirthEncrypted', 'MobilePhoneEncrypted')
+DEFAULT_COLUMNS = ('Id',) + PII_COLUMNS
+DEFAULT_CHUNK_ROWS = 100000
+DEFAULT_EXPORT_BATCH_SIZE = 5000
+FORMATS = ('csv', 'parquet')
+COLUMN_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+# What the application stores when no DOB was given
+DOB_UNSET = '0001-01-01T00:00:00.000000'
+
+# Parquet type of a MySQL column type; every other column is written as text
+PARQUET_TYPES = {
+    FIELD_TYPE.TINY: 'int64', FIELD_TYPE.SHORT: 'int64', FIELD_TYPE.INT24: 'int64',
+    FIELD_TYPE.LONG: 'int64', FIELD_TYPE.LONGLONG: 'int64', FIELD_TYPE.YEAR: 'int64',
+    FIELD_TYPE.FLOAT: 'float64', FIELD_TYPE.DOUBLE: 'float64',
+    FIELD_TYPE.DATETIME: 'timestamp', FIELD_TYPE.TIMESTAMP: 'timestamp',
+    FIELD_TYPE.DATE: 'date32', FIELD_TYPE.NEWDATE: 'date32',
+}
+
+
+def output_name(column):
+    """Header for a column: encrypted columns lose their "Encrypted" suffix"""
+    return column[:-len('Encrypted')] if column in PII_COLUMNS else column
+
+
+# Per-process state, set by _init_export_worker
+_db_config = None
+_connection = None
+_decryptor = None
+_settings = None
+
+
+def _init_export_worker(db_config, key, iv, settings):
+    """`settings` holds columns, types, format, output_dir and batch_size"""
+    global _db_config, _connection, _decryptor, _settings
+    _db_config = db_config
+    _connection = None
+    _decryptor = pii_crypto.FixedIvEncryptor(key, iv)
+    _settings = settings
+
+
+def _decrypt_column(column, values):
+    """Decrypted values of one PII column and how many failed to decrypt"""
+    decrypted = iter(_decryptor.decrypt_batch([v for v in values if pii_migration.looks_like_ciphertext(v)]))
+    results = []
+    failed = 0
+    for value in values:
+        if not value or value == DOB_UNSET and column == 'DateOfBirthEncrypted':
+            results.append('')
+        elif pii_migration.looks_like_ciphertext(value):
+            plain_text = next(decrypted)
+            if plain_text is None or not pii_migration.plausible_plain_text(column, plain_text):
+                results.append('')
+                failed += 1
+            else:
+                results.append(plain_text)
+        elif column == 'DateOfBirthEncrypted' and pii_migration.DOB_PLAIN_TEXT_RE.match(value):
+            # Not migrated yet: "2005-02-03T00:00:00.000000" -> "2005-02-03", like the ciphertexts
+            results.append(value[:10])
+        else:
+            results.append(value)
+    return results, failed
+
+
+def parquet_types(conn, table, columns):
+    """Parquet type name of each column, from the table's column types"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE 1 = 0")
+        types = [PARQUET_TYPES.get(description[1], 'string') for description in cursor.description]
+    # Decrypted values are always text
+    return ['string' if column in PII_COLUMNS else name for column, name in zip(columns, types)]
+
+
+class CsvPart:
+    def __init__(self, path, columns, types=None):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._file = os.fdopen(fd, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([output_name(column) for column in columns])
+
+    def write(self, columns, values):
+        self._writer.writerows(zip(*values))
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetPart:
+    """`types` are parquet_types() names, so every part of a table has the same schema"""
+
+    def __init__(self, path, columns, types):
+        fields = [pyarrow.field(output_name(column), pyarrow.timestamp('us') if name == 'timestamp'
+                                else getattr(pyarrow, name)())
+                  for column, name in zip(columns, types)]
+        self.schema = pyarrow.schema(fields)
+        # Create the file owner-readable before pyarrow opens it
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, columns, values):
+        # One row group per fetched batch
+        self._writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(self._convert(column_values, field.type), type=field.type)
+             for column_values, field in zip(values, self.schema)],
+            schema=self.schema))
+
+    @staticmethod
+    def _convert(values, arrow_type):
+        if arrow_type == pyarrow.string():
+            # DECIMAL, TIME, JSON... as CSV writes them
+            return [value if value is None or isinstance(value, str) else str(value) for value in values]
+        # pymysql returns zero dates ("0000-00-00") as text; they have no date value
+        return [None if isinstance(value, str) else value for value in values]
+
+    def close(self):
+        self._writer.close()
+
+
+PART_WRITERS = {'csv': CsvPart, 'parquet': ParquetPart}
+
+
+def check_parquet_part():
+    """Write and read back typed and NULL values through ParquetPart; raises RuntimeError"""
+    columns = ('Id', 'Age', 'Score', 'CreatedAt', 'BirthDate', 'Balance', 'DateOfBirthEncrypted')
+    types = ('int64', 'int64', 'float64', 'timestamp', 'date32', 'string', 'string')
+    values = [
+        [1, 2, 3],
+        [42, None, 7],
+        [0.5, None, 2.0],
+        [datetime(2024, 5, 6, 7, 8, 9, 123456), '0000-00-00 00:00:00', None],
+        [date(2005, 2, 3), None, None],
+        [Decimal('12.50'), None, Decimal('-1')],
+        ['2005-02-03', '', None],
+    ]
+    expected = dict(zip([output_name(column) for column in columns], [
+        [1, 2, 3],
+        [42, None, 7],
+        [0.5, None, 2.0],
+        [datetime(2024, 5, 6, 7, 8, 9, 123456), None, None],
+        [date(2005, 2, 3), None, None],
+        ['12.50', None, '-1'],
+        ['2005-02-03', '', None],
+    ]))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'check.parquet')
+        part = ParquetPart(path, columns, types)
+        part.write(columns, values)
+        part.close()
+        written = pyarrow.parquet.read_table(path).to_pydict()
+    if written != expected:
+        raise RuntimeError(f"Parquet check failed: wrote {expected}, read back {written}")
+
+
+def _export_range(task):
+    """Export the rows of one [lo, hi) Id range to its own file.
+
+    Returns the range's manifest entry; no file is written for an empty range.
+    """
+    global _connection
+    table, lo, hi = task
+    columns = _settings['columns']
+    if _connection is None:
+        _connection = pymysql.connect(autocommit=True, **_db_config)
+
+    entry = {'table': table, 'lo': lo, 'hi': hi, 'rows': 0, 'failed': {c: 0 for c in columns if c in PII_COLUMNS}}
+    path = os.path.join(_settings['output_dir'], f"{table}-{lo}-{hi - 1}.{_settings['format']}")
+    tmp_path = f"{path}.tmp"
+    part = None
+    try:
+        batches = pii_migration.iter_batches(
+            _connection, table, ', '.join(c for c in columns if c != 'Id'), f"Id < {int(hi)}",
+            batch_size=_settings['batch_size'], start_id=lo - 1
+        )
+        for batch in batches:
+            # Rows are (Id, selected columns...); the output order follows --columns
+            fetched = dict(zip(['Id'] + [c for c in columns if c != 'Id'], zip(*batch)))
+            values = []
+            for column in columns:
+                column_values = list(fetched[column])
+                if column in PII_COLUMNS:
+                    column_values, failed = _decrypt_column(column, column_values)
+                    entry['failed'][column] += failed
+                values.append(column_values)
+            if part is None:
+                part = PART_WRITERS[_settings['format']](tmp_path, columns, _settings['types'][table])
+            part.write(columns, values)
+            entry['rows'] += len(batch)
+    except BaseException:
+        if part is not None:
+            part.close()
+            os.remove(tmp_path)
+        raise
+    if part is not None:
+        part.close()
+        # Only complete files get their final name
+        os.replace(tmp_path, path)
+        entry['file'] = os.path.basename(path)
+    return entry
+
+
+def export_ranges(tasks, db_config, key, iv, settings, workers):
+    """Yield manifest entries for (table, lo, hi) tasks in order"""
+    chunks = ((task, task) for task in tasks)
+    for _, entry in pii_migration.process_chunks(
+            chunks, _export_range, _init_export_worker, (db_config, key, iv, settings), workers):
+        yield entry
+
+
+def clip_ranges(ranges, min_id, max_id):
+    """Restrict [lo, hi) ranges to min_id <= Id <= max_id"""
+    clipped = []
+    for lo, hi in ranges:
+        if min_id is not None:
+            lo = max(lo, min_id)
+        if max_id is not None:
+            hi = min(hi, max_id + 1)
+        if lo < hi:
+            clipped.append((lo, hi))
+    return clipped
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export decrypted PII columns to CSV or Parquet files")
+    parser.add_argument('config_file', help="Path to appsettings.Production.json")
+    parser.add_argument('--output-dir', required=True, help="Directory for the exported files (created 0700)")
+    parser.add_argument('--format', choices=FORMATS, default='csv', help="Output format (default: csv)")
+    parser.add_argument('--tables', default=','.join(TABLES),
+                        help=f"Comma-separated tables (default: {','.join(TABLES)})")
+    parser.add_argument('--columns', default=','.join(DEFAULT_COLUMNS),
+                        help="Comma-separated columns to export; Id is always included and "
+                             f"{' / '.join(PII_COLUMNS)} are decrypted (default: {','.join(DEFAULT_COLUMNS)})")
+    parser.add_argument('--min-id', type=int, help="Only rows with Id >= this")
+    parser.add_argument('--max-id', type=int, help="Only rows with Id <= this")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"Width of the Id range in each output file (default: {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_EXPORT_BATCH_SIZE,
+                        help=f"Rows per query and per write (default: {DEFAULT_EXPORT_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Processes, each with its own connection (default: CPU count)")
+    args = parser.parse_args()
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error("--format parquet needs pyarrow. Install with: pip install pyarrow")
+    if args.chunk_rows < 1 or args.batch_size < 1:
+        parser.error("--chunk-rows and --batch-size must be at least 1")
+    if args.min_id is not None and args.max_id is not None and args.min_id > args.max_id:
+        parser.error("--min-id is greater than --max-id")
+    columns = ['Id']
+    for column in args.columns.split(','):
+        if not COLUMN_NAME_RE.fullmatch(column):
+            parser.error(f"invalid column name {column!r}")
+        if column not in columns:
+            columns.append(column)
+    if len(columns) == 1:
+        parser.error("--columns needs at least one column besides Id")
+    args.columns = tuple(columns)
+    return args
+
+
+def main():
+    args = parse_args()
+    tables = args.tables.split(',')
+
+    print("=" * 50)
+    print("PII Export")
+    print("=" * 50)
+
+    config = pii_migration.read_appsettings(args.config_file)
+    key, iv = pii_crypto.derive_key_and_iv(pii_migration.encryption_key_from_appsettings(config))
+    pii_crypto.self_test()
+    if args.format == 'parquet':
+        check_parquet_part()
+    db_config = pii_migration.db_config_from_appsettings(config)
+
+    try:
+        conn = pymysql.connect(**db_config)
+        ranges = {table: clip_ranges(pii_migration.id_ranges(conn, table, args.chunk_rows), args.min_id, args.max_id)
+                  for table in tables}
+        types = {table: parquet_types(conn, table, args.columns) for table in tables}
+        conn.close()
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(args.output_dir, mode=0o700, exist_ok=True)
+    settings = {'columns': args.columns, 'types': types, 'format': args.format, 'output_dir': args.output_dir,
+                'batch_size': args.batch_size}
+    tasks = [(table, lo, hi) for table in tables for lo, hi in ranges[table]]
+    print(f"✅ {len(tasks)} Id ranges in {len(tables)} tables, {args.workers} workers, "
+          f"columns {', '.join(args.columns)} -> {args.output_dir} ({args.format})")
+
+    entries = []
+    totals = {table: {'rows': 0, 'failed': 0, 'files': 0} for table in tables}
+    started = time.perf_counter()
+    try:
+        for entry in export_ranges(tasks, db_config, key, iv, settings, args.workers):
+            entries.append(entry)
+            total = totals[entry['table']]
+            total['rows'] += entry['rows']
+            total['failed'] += sum(entry['failed'].values())
+            total['files'] += 'file' in entry
+    except Exception as e:
+        print(f"❌ Export stopped: {e}", file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+
+    manifest_path = os.path.join(args.output_dir, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': db_config['database'],
+            'format': args.format,
+            'columns': [output_name(column) for column in args.columns],
+            'min_id': args.min_id,
+            'max_id': args.max_id,
+            'ranges': [entry for entry in entries if 'file' in entry],
+        }, f, indent=2)
+
+    print()
+    for table, total in totals.items():
+        print(f"✅ {table}: {total['rows']} rows in {total['files']} files, "
+              f"{total['failed']} values did not decrypt")
+    rows = sum(total['rows'] for total in totals.values())
+    print(f"⏱  {pii_migration.format_rate(rows, elapsed)}")
+    print(f"   Manifest: {manifest_path}")
+    print("=" * 50)
+    if any(total['failed'] for total in totals.values()):
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Encrypt every plain text PII column in one run.
+
+encrypt-dob-python.py and encrypt-mobilephone-python.py each scan Users and
+UserRequests one after the other, so covering both columns reads every table
+twice. This runner works from a list of column specs (table, column, plain
+text detector, transform) built from those two scripts, which must sit next
+to it together with pii_migration.py:
+
+  - each table is read once, selecting all of its PII columns and only the
+    rows where at least one of them is still plain text
+  - each batch is written back with one UPDATE that sets every changed column
+  - tables are migrated at the same time on --parallel-tables threads, each
+    with its own database connection, so the run takes about as long as the
+    largest table
+  - --workers processes are shared by all tables for the encryption
+  - with --pipeline each table also reads, encrypts and writes concurrently
+
+Progress is recorded per table and column in the same --checkpoint file as
+the single-column scripts, so either can --resume after the other. All of
+their read, write, metrics, --incremental / --poll and --online options apply.
+
+    python3 migrate-pii.py /opt/mental-health-app/server/appsettings.Production.json --workers 4
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import pymysql
+except ImportError:
+    print("❌ Error: pymysql not installed. Install with: apt-get install python3-pymysql")
+    sys.exit(1)
+
+import pii_crypto
+import pii_migration
+
+dob_script = pii_migration.load_script('encrypt-dob-python.py')
+phone_script = pii_migration.load_script('encrypt-mobilephone-python.py')
+
+
+class ColumnSpec:
+    """One PII column: where it lives, how to find its plain text and what gets encrypted"""
+
+    def __init__(self, table, column, base_filter, plain_text_filter, is_plain_text, prepare=None,
+                 dob_table=False):
+        self.table = table
+        self.column = column
+        self.base_filter = base_filter              # SQL: rows with a value at all
+        self.plain_text_filter = plain_text_filter  # SQL: value is still plain text
+        self.is_plain_text = is_plain_text          # Python twin of both filters
+        self.prepare = prepare                      # stored value -> text to encrypt
+        self.dob_table = dob_table                  # may be served from --dob-table
+
+    @property
+    def name(self):
+        return f"{self.table}.{self.column}"
+
+
+def column_specs():
+    specs = []
+    for table in ('UserRequests', 'Users'):
+        specs.append(ColumnSpec(table, 'DateOfBirthEncrypted',
+                                dob_script.DOB_BASE_FILTER, dob_script.DOB_PLAINTEXT_FILTER,
+                                dob_script.is_plain_text_dob, dob_script.format_dob, dob_table=True))
+        specs.append(ColumnSpec(table, 'MobilePhoneEncrypted',
+                                phone_script.PHONE_BASE_FILTER, phone_script.PHONE_PLAINTEXT_FILTER,
+                                phone_script.is_plain_text_phone))
+    return specs
+
+
+# Worker state, set by _init_runner_worker. Per thread, because without a
+# pool every table thread initialises and encrypts in-process.
+_worker = threading.local()
+
+
+def _init_runner_worker(key, iv, rules, cache_size=0, lookup_table=None):
+    """`rules` maps "Table.Column" to (is_plain_text, prepare, use_lookup)"""
+    _worker.rules = rules
+    _worker.encryptor = pii_crypto.FixedIvEncryptor(key, iv, cache_size)
+    _worker.lookup = lookup_table.lookup if lookup_table is not None else None
+
+
+def _encrypt_rows(task):
+    """Encrypt the plain text columns of (Id, value, ...) rows.
+
+    `task` is (table, columns, rows); returns (Id, {column: encrypted},
+    [(column, error)]) for every row with at least one plain text value.
+    """
+    table, columns, rows = task
+    rules = [_worker.rules[f"{table}.{column}"] for column in columns]
+    lookup = _worker.lookup
+    results = []
+    pending = []
+    for row in rows:
+        values = {}
+        errors = []
+        queued = False
+        for column, (is_plain_text, prepare, use_lookup), value in zip(columns, rules, row[1:]):
+            if not is_plain_text(value):
+                continue
+            try:
+                plain_text = prepare(value) if prepare else value
+            except Exception as e:
+                errors.append((column, str(e)))
+                continue
+            encrypted = lookup(plain_text) if use_lookup and lookup else None
+            if encrypted:
+                values[column] = encrypted
+            else:
+                # Encrypted below, together with every other column of the batch
+                pending.append((values, errors, column, plain_text))
+                queued = True
+        if values or errors or queued:
+            results.append((row[0], values, errors))
+
+    encrypted = pii_migration.encrypt_values(_worker.encryptor, [plain_text for *_, plain_text in pending])
+    for (values, errors, column, _), (value, error) in zip(pending, encrypted):
+        if value is not None:
+            values[column] = value
+        else:
+            errors.append((column, error))
+    return results
+
+
+def migrate_table(table, specs, db_config, checkpoint, key, iv, args, dob_table, pool, metrics):
+    """Encrypt all plain text columns of one table in a single scan, on its own connections"""
+    counts = {spec.column: {'encrypted': 0, 'errors': 0} for spec in specs}
+    started = time.perf_counter()
+    conn = pymysql.connect(**db_config)
+    # An unbuffered server-side cursor ties up its connection until the
+    # result set is drained, and --pipeline reads on another thread,
+    # so updates go over a second connection
+    read_conn = pymysql.connect(**db_config) if args.stream == 'server' or args.pipeline else conn
+    try:
+        conn.ping(reconnect=True)
+        throttle = pii_migration.make_throttle(args, conn, db_config)
+
+        scopes = {}
+        for spec in specs:
+            scope = pii_migration.scan_scope(conn, checkpoint, table, spec.column, args)
+            if scope is None:
+                print(f"[{table}] ⏭  {spec.column} already completed according to {args.checkpoint}")
+            else:
+                scopes[spec.column] = scope
+        active = [spec for spec in specs if spec.column in scopes]
+        if not active:
+            return counts
+
+        # Columns may have been resumed to different points; rescanning is harmless
+        start_id = min(scopes[spec.column][0] for spec in active)
+        # The same goes for --incremental: the oldest watermark (or none) covers every column.
+        # Fragments are "<column> >= '<timestamp>'" on one column, so the smallest is the oldest.
+        since = min(scopes[spec.column][1] for spec in active)
+        if start_id and not args.incremental:
+            print(f"[{table}] ↪  Resuming after Id {start_id}")
+        plain_text = " OR ".join(
+            f"({pii_migration.row_filter(spec.base_filter, spec.plain_text_filter, args.sql_filter)})"
+            for spec in active
+        )
+        columns = tuple(spec.column for spec in active)
+
+        end_id = pii_migration.max_value(conn, table, 'Id')
+        for column in columns:
+            metrics.start_table(table, column, start_id, end_id)
+        writer = pii_migration.MultiColumnWriter(conn, table, columns,
+                                                 strategy=args.write_strategy, batch_size=args.batch_size)
+        batches = pii_migration.read_stage(metrics.iterate('fetch', pii_migration.iter_batches(
+            read_conn, table, ', '.join(columns), pii_migration.and_where(plain_text, since),
+            batch_size=throttle or args.batch_size, mode=args.stream, start_id=start_id
+        )), args, metrics)
+        fetched = 0
+
+        def chunks():
+            nonlocal fetched
+            for batch in batches:
+                fetched += len(batch)
+                yield batch[-1][0], (table, columns, batch)
+
+        def commit_batch(updates, last_id, column_counts):
+            # Commit each batch so row locks are only held for one batch,
+            # then move the checkpoint of every scanned column past it. A
+            # column with failed rows keeps its checkpoint before them, so
+            # --resume scans them again.
+            with metrics.stage('write'):
+                writer.write(updates)
+            checkpoint.record(table, tuple(column for column in columns if not column_counts[column]['errors']),
+                              last_id)
+            if throttle:
+                throttle.record(writer.last_write_seconds)
+                with metrics.stage('throttle'):
+                    throttle.wait()
+            for column in columns:
+                metrics.progress(table, column, last_id, **column_counts[column])
+
+        with pii_migration.write_stage(commit_batch, args, metrics) as submit:
+            for last_id, results in metrics.iterate('crypt', pii_migration.process_chunks(
+                    chunks(), _encrypt_rows, _init_runner_worker,
+                    worker_initargs(key, iv, args, dob_table), args.workers, pool)):
+                updates = []
+                for row_id, values, errors in results:
+                    if values:
+                        updates.append((row_id, values))
+                    for column in values:
+                        counts[column]['encrypted'] += 1
+                    for column, error in errors:
+                        print(f"[{table}] ⚠️  Error encrypting {column} of {row_id}: {error}", file=sys.stderr)
+                        counts[column]['errors'] += 1
+                submit(updates, last_id, {column: dict(counts[column], fetched=fetched) for column in columns})
+
+        for spec in active:
+            if counts[spec.column]['errors']:
+                # Those rows are still plain text; --resume must scan them again
+                print(f"[{table}] ❌ {spec.column}: {counts[spec.column]['errors']} rows failed, "
+                      f"not marked complete", file=sys.stderr)
+            else:
+                checkpoint.complete(table, spec.column, scopes[spec.column][2],
+                                    args.watermark_columns.get(table, 'Id'))
+            metrics.finish_table(table, spec.column)
+        elapsed = time.perf_counter() - started
+        print(f"[{table}] ⏱  {pii_migration.format_rate(writer.rows_written, elapsed)}, "
+              f"{writer.batches_committed} commits ({args.write_strategy})")
+        return counts
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if read_conn is not conn:
+            read_conn.close()
+        conn.close()
+
+
+def worker_initargs(key, iv, args, dob_table):
+    rules = {spec.name: (spec.is_plain_text, spec.prepare, spec.dob_table) for spec in column_specs()}
+    return key, iv, rules, args.cache_size, dob_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Encrypt all plain text PII columns in one run")
+    parser.add_argument('config_file', help="Path to appsettings.Production.json")
+    parser.add_argument('--columns', metavar='TABLE.COLUMN,...',
+                        help="Only these columns (default: " +
+                             ", ".join(spec.name for spec in column_specs()) + ")")
+    parser.add_argument('--parallel-tables', type=int, default=2,
+                        help="Tables migrated at the same time, each on its own connection (default: 2)")
+    pii_migration.add_stream_arguments(parser)
+    parser.add_argument('--dob-table', metavar='PATH',
+                        help="Precomputed date -> ciphertext table, as in encrypt-dob-python.py")
+    parser.add_argument('--dob-range', default=pii_migration.DEFAULT_DOB_RANGE,
+                        help=f"First:last date of a newly built --dob-table (default: {pii_migration.DEFAULT_DOB_RANGE})")
+    args = parser.parse_args()
+    pii_migration.check_arguments(parser, args)
+    if args.parallel_tables < 1:
+        parser.error("--parallel-tables must be at least 1")
+    if args.columns:
+        known = {spec.name for spec in column_specs()}
+        for name in args.columns.split(','):
+            if name not in known:
+                parser.error(f"unknown column {name!r}; choose from {', '.join(sorted(known))}")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 50)
+    print("PII Migration")
+    print("=" * 50)
+
+    config = pii_migration.read_appsettings(args.config_file)
+    key, iv = pii_crypto.derive_key_and_iv(pii_migration.encryption_key_from_appsettings(config))
+    pii_crypto.self_test()
+
+    dob_table = None
+    if args.dob_table:
+        dob_table = pii_migration.load_dob_table(args.dob_table, key, iv, args.dob_range)
+        print(f"DOB lookup table: {dob_table.count} dates from {args.dob_table}")
+
+    specs = column_specs()
+    if args.columns:
+        specs = [spec for spec in specs if spec.name in args.columns.split(',')]
+    tables = {}
+    for spec in specs:
+        tables.setdefault(spec.table, []).append(spec)
+
+    db_config = pii_migration.db_config_from_appsettings(config)
+    checkpoint = pii_migration.Checkpoint(args.checkpoint, db_config['database'])
+    print(f"✅ {len(specs)} columns in {len(tables)} tables, "
+          f"{min(args.parallel_tables, len(tables))} at a time, {args.workers} encryption processes")
+    print()
+
+    # One pool for all tables, started before any thread so workers aren't forked mid-query
+    metrics = pii_migration.make_metrics(args, 'migrate-pii')
+    pool = None
+    if args.workers > 1:
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_runner_worker,
+                                   initargs=worker_initargs(key, iv, args, dob_table))
+
+    # Columns with rows that failed to encrypt, in any pass
+    incomplete = set()
+
+    def run_pass():
+        totals = {}
+        failed = []
+        with ThreadPoolExecutor(max_workers=args.parallel_tables) as threads:
+            futures = {
+                table: threads.submit(migrate_table, table, table_specs, db_config, checkpoint,
+                                      key, iv, args, dob_table, pool, metrics)
+                for table, table_specs in tables.items()
+            }
+            for table, future in futures.items():
+                try:
+                    for column, counts in future.result().items():
+                        totals[f"{table}.{column}"] = counts
+                except Exception as e:
+                    print(f"❌ Error processing {table} table: {e}", file=sys.stderr)
+                    failed.append(table)
+
+        print()
+        for name, counts in totals.items():
+            print(f"✅ {name}: {counts['encrypted']} encrypted, {counts['errors']} errors")
+            if counts['errors']:
+                incomplete.add(name)
+        return sum(c['encrypted'] + c['errors'] for c in totals.values()) + len(failed), failed
+
+    try:
+        with pii_migration.profiled(args, metrics):
+            started = time.perf_counter()
+            _, failed = run_pass()
+            print(f"⏱  All tables: {time.perf_counter() - started:.2f}s")
+            if args.poll:
+                pii_migration.poll(lambda: run_pass()[0], args.poll)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    print("=" * 50)
+    if failed:
+        print(f"❌ Migration incomplete: {', '.join(failed)} failed; re-run with --resume")
+        print("=" * 50)
+        sys.exit(1)
+    if incomplete:
+        print(f"❌ Migration incomplete: rows of {', '.join(sorted(incomplete))} could not be encrypted; "
+              f"fix them and re-run with --resume")
+        print("=" * 50)
+        sys.exit(2)
+    print("✅ Migration completed!")
+    print("=" * 50)
+
+
+if __name__ == '__main__':
+    main()
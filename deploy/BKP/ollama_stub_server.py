@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an Ollama server, for testing benchmark-ollama.py and
+warm-up scripts without a model.
+
+Implements /api/generate (streamed and not), /api/tags, /api/ps and
+/api/version, and simulates the latencies that matter when tuning:
+
+  - loading a model that isn't resident (--load-seconds), and unloading it
+    once its keep_alive expires
+  - prompt evaluation, slower for a larger num_ctx
+  - token generation at --tokens-per-second per request
+  - only --parallel requests generating at once (OLLAMA_NUM_PARALLEL);
+    the rest queue
+
+    python3 ollama_stub_server.py --port 11435 --tokens-per-second 40
+
+It can also be started in-process with StubOllamaServer (see
+benchmark-ollama.py --stub).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODEL = "tinyllama:latest"
+DEFAULT_KEEP_ALIVE = "5m"
+DEFAULT_NUM_CTX = 2048
+DEFAULT_NUM_PREDICT = 128
+
+WORDS = ("the patient reports improved sleep and reduced anxiety over the past two weeks "
+         "continue current plan and review medication adherence at next visit").split()
+
+
+def parse_keep_alive(value):
+    """Ollama keep_alive ("5m", "30s", "1h", seconds, negative = forever) -> seconds or None for forever"""
+    if value is None:
+        value = DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return None if value < 0 else float(value)
+    match = re.fullmatch(r'\s*(-?\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*', str(value))
+    if not match:
+        raise ValueError(f"invalid keep_alive {value!r}")
+    number = float(match.group(1))
+    if number < 0:
+        return None
+    return number * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}[match.group(2)]
+
+
+class StubModel:
+    """Residency of one model: loaded on first use, unloaded when keep_alive runs out"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.expires_at = None
+        self.num_ctx = None
+
+    def is_loaded(self, now):
+        if self.loaded and self.expires_at is not None and now >= self.expires_at:
+            self.loaded = False
+        return self.loaded
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, load_seconds=2.0, tokens_per_second=30.0, prompt_tokens_per_second=400.0,
+                 parallel=1, jitter=0.1, models=(DEFAULT_MODEL,), seed=None):
+        super().__init__(address, StubOllamaHandler)
+        self.load_seconds = load_seconds
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.jitter = jitter
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.models = {name: StubModel(name) for name in models}
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a daemon thread; returns self"""
+        threading.Thread(target=self.serve_forever, name='ollama-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def vary(self, seconds):
+        with self.random_lock:
+            return max(seconds * (1 + self.random.uniform(-self.jitter, self.jitter)), 0.0)
+
+    def load(self, model, keep_alive, num_ctx):
+        """Make `model` resident; returns the seconds spent loading"""
+        with model.lock:
+            now = time.monotonic()
+            load_duration = 0.0
+            # Ollama reloads the model when the context size changes
+            if not model.is_loaded(now) or model.num_ctx != num_ctx:
+                load_duration = self.vary(self.load_seconds * max(num_ctx / DEFAULT_NUM_CTX, 1.0) ** 0.5)
+                time.sleep(load_duration)
+                model.loaded = True
+                model.num_ctx = num_ctx
+            seconds = parse_keep_alive(keep_alive)
+            model.expires_at = None if seconds is None else time.monotonic() + seconds
+            if seconds == 0:
+                model.loaded = False
+            return load_duration
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/api/version':
+            self._send_json(200, {'version': '0.0.0-stub'})
+        elif self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': name, 'model': name} for name in server.models]})
+        elif self.path == '/api/ps':
+            now = time.monotonic()
+            self._send_json(200, {'models': [
+                {'name': name, 'model': name, 'context_length': model.num_ctx}
+                for name, model in server.models.items() if model.is_loaded(now)
+            ]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            options = request.get('options') or {}
+            num_ctx = int(options.get('num_ctx', DEFAULT_NUM_CTX))
+            num_predict = int(options.get('num_predict', DEFAULT_NUM_PREDICT))
+            parse_keep_alive(request.get('keep_alive'))
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        model = self.server.models.get(request.get('model'))
+        if model is None:
+            self._send_json(404, {'error': f"model '{request.get('model')}' not found"})
+            return
+        self._generate(model, request, num_ctx, num_predict)
+
+    def _generate(self, model, request, num_ctx, num_predict):
+        server = self.server
+        started = time.monotonic()
+        stream = request.get('stream', True)
+        prompt = request.get('prompt', '')
+        with server.slots:
+            load_duration = server.load(model, request.get('keep_alive'), num_ctx)
+            # An empty prompt only loads (or unloads) the model
+            if not prompt:
+                self._send_json(200, self._final(model, started, load_duration, 0, 0.0, 0, 0.0, 'load'))
+                return
+
+            prompt_tokens = min(max(len(prompt) // 4, 1), num_ctx)
+            prompt_eval = server.vary(prompt_tokens / server.prompt_tokens_per_second
+                                      * max(num_ctx / DEFAULT_NUM_CTX, 1.0) ** 0.25)
+            time.sleep(prompt_eval)
+
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+            eval_started = time.monotonic()
+            words = []
+            for i in range(num_predict):
+                time.sleep(server.vary(1.0 / server.tokens_per_second))
+                word = WORDS[i % len(WORDS)] + ' '
+                words.append(word)
+                if stream:
+                    self._write_chunk({'model': model.name, 'created_at': _now(), 'response': word, 'done': False})
+            eval_duration = time.monotonic() - eval_started
+            final = self._final(model, started, load_duration, prompt_tokens, prompt_eval, num_predict,
+                                eval_duration, 'length')
+        if stream:
+            self._write_chunk(final)
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            final['response'] = ''.join(words)
+            self._send_json(200, final)
+
+    def _write_chunk(self, body):
+        data = json.dumps(body).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    @staticmethod
+    def _final(model, started, load_duration, prompt_tokens, prompt_eval, eval_count, eval_duration, reason):
+        # Durations are in nanoseconds, like Ollama's
+        return {
+            'model': model.name, 'created_at': _now(), 'response': '', 'done': True, 'done_reason': reason,
+            'total_duration': int((time.monotonic() - started) * 1e9),
+            'load_duration': int(load_duration * 1e9),
+            'prompt_eval_count': prompt_tokens, 'prompt_eval_duration': int(prompt_eval * 1e9),
+            'eval_count': eval_count, 'eval_duration': int(eval_duration * 1e9),
+        }
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ollama stand-in that simulates model latency")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=11435, help="Port to listen on (default: 11435)")
+    parser.add_argument('--model', dest='models', action='append',
+                        help=f"Model name to serve; repeatable (default: {DEFAULT_MODEL})")
+    parser.add_argument('--load-seconds', type=float, default=2.0,
+                        help="Time to load a model that isn't resident (default: 2.0)")
+    parser.add_argument('--tokens-per-second', type=float, default=30.0,
+                        help="Generation speed of one request (default: 30)")
+    parser.add_argument('--prompt-tokens-per-second', type=float, default=400.0,
+                        help="Prompt evaluation speed (default: 400)")
+    parser.add_argument('--parallel', type=int, default=1,
+                        help="Requests generating at once, like OLLAMA_NUM_PARALLEL (default: 1)")
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help="Relative random variation of every delay (default: 0.1)")
+    parser.add_argument('--seed', type=int, help="Random seed for the jitter")
+    args = parser.parse_args()
+    if args.parallel < 1 or args.tokens_per_second <= 0 or args.prompt_tokens_per_second <= 0:
+        parser.error("--parallel, --tokens-per-second and --prompt-tokens-per-second must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+    server = StubOllamaServer(
+        (args.host, args.port), load_seconds=args.load_seconds, tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second, parallel=args.parallel, jitter=args.jitter,
+        models=args.models or (DEFAULT_MODEL,), seed=args.seed
+    )
+    print(f"✅ Ollama stub listening on {server.base_url} "
+          f"({', '.join(server.models)}, {args.tokens_per_second:g} tokens/s, {args.parallel} parallel)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹  Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+AES-256-CBC encryption compatible with PiiEncryptionService.cs, shared by the
+PII scripts (they import it from the same directory).
+
+PiiEncryptionService derives the key as SHA256(key) and a fixed IV as the
+first 16 bytes of SHA256(key + "IV"), pads with PKCS7 and stores base64. As
+every value starts its CBC chain from the same IV, a batch is encrypted with
+one AES call per block position instead of one cipher object per value:
+round k XORs the k-th block of every value that has one with its chaining
+block and ECB-encrypts them together. Dates and phone numbers fit in one
+block, so a batch of them is a single AES call.
+
+The AES block primitive comes from a backend, pycryptodome (as Crypto or
+Cryptodome) or cryptography. By default the fastest one installed is picked
+with a short micro-benchmark; set PII_CRYPTO_BACKEND to force one. Every
+backend is checked against TEST_VECTORS, which were produced by
+PiiEncryptionService itself:
+
+    python3 pii_crypto.py --self-test
+"""
+
+import argparse
+import base64
+import binascii
+import collections
+import functools
+import hashlib
+import os
+import sys
+import threading
+import time
+
+try:
+    from Crypto.Cipher import AES as _PycryptodomeAES
+except ImportError:
+    try:
+        from Cryptodome.Cipher import AES as _PycryptodomeAES
+    except ImportError:
+        _PycryptodomeAES = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher as _Cipher, algorithms as _algorithms, modes as _modes
+except ImportError:
+    _Cipher = None
+
+BLOCK_SIZE = 16
+
+# PKCS7 padding for every possible remainder
+_PADDING = [bytes([BLOCK_SIZE - n]) * (BLOCK_SIZE - n) for n in range(BLOCK_SIZE)]
+
+# (PiiEncryption:Key, plain text, PiiEncryptionService.Encrypt(plain text)),
+# generated with the service class and .NET 8
+TEST_VECTORS = (
+    ("DefaultEncryptionKey32BytesLong!!", "2005-02-03", "UVHasOv2TfQh1+9q7Y1BLA=="),
+    ("DefaultEncryptionKey32BytesLong!!", "1999-12-31", "zny24V2ORsb+1y7MLq3umg=="),
+    ("DefaultEncryptionKey32BytesLong!!", "+15551234567", "RWznvtlV17CbVydy6tUDhg=="),
+    ("DefaultEncryptionKey32BytesLong!!", "5551234567", "/5l0qIkOv0Knma4TIIVziQ=="),
+    ("DefaultEncryptionKey32BytesLong!!", "a", "wBxyhV4DhwwkSUUUaRH8fw=="),
+    ("DefaultEncryptionKey32BytesLong!!", "", ""),
+    # Exactly one block, so PKCS7 adds a whole block of padding
+    ("DefaultEncryptionKey32BytesLong!!", "0123456789abcdef", "pFvZK/v4ewmim6tYHzPSsIz+jkDyofWZYg3vdGFyKys="),
+    ("DefaultEncryptionKey32BytesLong!!", "(555) 123-4567 ext. 89", "7L3WvmfGgo4VsWsmpcNe/fWF6eLM2uhmtGU49iolElY="),
+    ("DefaultEncryptionKey32BytesLong!!", "Zoë Łukasiewicz-Ørsted, 北京 🙂",
+     "nHp9FpsR2myjH28Dd6yGPntUFMyg24cXfx21PQ2DEXHtWuXEEm2PU6XbdeC8UAg/"),
+    ("production key with spaces & ünïcode", "2005-02-03", "jl8K+adnxb0fwBlyiGfL5Q=="),
+    ("production key with spaces & ünïcode", "+447700900123", "A6sdc8b0dxISFgdAcTmiHQ=="),
+    ("production key with spaces & ünïcode", "x" * 100,
+     "fTjR3FKZuFu/qCY1CaJU38H+unjCVFa/x7UWwfS9pXQlLG0dMYsLVPILDBybIXLp/bNiyPL5REJ7VA61IZNFSPZT4HG9"
+     "uIIhuoJXf+Lr7UPOwM4n+PbFr08vbOxrse42+04qsVnIhHZu3EhpFApISA=="),
+)
+
+
+def derive_key_and_iv(encryption_key):
+    """Derive the AES key and fixed IV exactly like PiiEncryptionService"""
+    key = hashlib.sha256(encryption_key.encode('utf-8')).digest()
+    iv = hashlib.sha256((encryption_key + "IV").encode('utf-8')).digest()[:BLOCK_SIZE]
+    return key, iv
+
+
+class PycryptodomeBackend:
+    name = 'pycryptodome'
+
+    def __init__(self, key):
+        cipher = _PycryptodomeAES.new(key, _PycryptodomeAES.MODE_ECB)
+        self.encrypt_blocks = cipher.encrypt
+        self.decrypt_blocks = cipher.decrypt
+
+
+class CryptographyBackend:
+    name = 'cryptography'
+
+    def __init__(self, key):
+        self._cipher = _Cipher(_algorithms.AES(key), _modes.ECB())
+        # ECB contexts keep no state between whole blocks, so one pair serves
+        # every call, but a context must not be used by two threads at once
+        self._contexts = threading.local()
+
+    def _context(self):
+        contexts = self._contexts
+        if not hasattr(contexts, 'encrypt'):
+            contexts.encrypt = self._cipher.encryptor().update
+            contexts.decrypt = self._cipher.decryptor().update
+        return contexts
+
+    def encrypt_blocks(self, data):
+        return self._context().encrypt(data)
+
+    def decrypt_blocks(self, data):
+        return self._context().decrypt(data)
+
+
+BACKENDS = {}
+if _PycryptodomeAES is not None:
+    BACKENDS[PycryptodomeBackend.name] = PycryptodomeBackend
+if _Cipher is not None:
+    BACKENDS[CryptographyBackend.name] = CryptographyBackend
+
+
+# Rows per encrypt_batch / decrypt_batch call in the scripts: pii_migration's
+# default batch size and export-pii-data.py's
+BENCHMARK_BATCH_SIZES = (1000, 5000)
+
+
+def benchmark_backends(batch_sizes=BENCHMARK_BATCH_SIZES, rounds=3):
+    """Seconds each installed backend takes to encrypt and decrypt one batch of each size"""
+    key, iv = derive_key_and_iv("pii-crypto-benchmark")
+    # Phones and DOBs, as the scripts see them
+    plain_texts = [f"+1555{n:07d}" if n % 2 else f"{1940 + n % 80}-{n % 12 + 1:02d}-{n % 28 + 1:02d}"
+                   for n in range(max(batch_sizes))]
+    timings = {}
+    for name in BACKENDS:
+        encryptor = FixedIvEncryptor(key, iv, backend=name)
+        encrypted = encryptor.encrypt_batch(plain_texts)
+        total = 0.0
+        for size in batch_sizes:
+            best = None
+            for _ in range(rounds):
+                started = time.perf_counter()
+                encryptor.encrypt_batch(plain_texts[:size])
+                encryptor.decrypt_batch(encrypted[:size])
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            total += best
+        timings[name] = total
+    return timings
+
+
+@functools.lru_cache(maxsize=None)
+def select_backend(name='auto'):
+    """Backend class for `name`; 'auto' means PII_CRYPTO_BACKEND, else the fastest installed"""
+    if name == 'auto':
+        name = os.environ.get('PII_CRYPTO_BACKEND', 'auto')
+    if not BACKENDS:
+        raise ImportError("No AES backend installed. Install with: apt-get install python3-pycryptodome "
+                          "(or pip install cryptography)")
+    if name == 'auto':
+        timings = benchmark_backends()
+        name = min(timings, key=timings.get)
+    if name not in BACKENDS:
+        raise ValueError(f"AES backend {name!r} is not installed (available: {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+def _unpad(data):
+    padding = data[-1]
+    if not 1 <= padding <= BLOCK_SIZE or data[-padding:] != _PADDING[BLOCK_SIZE - padding]:
+        raise ValueError("Padding is incorrect")
+    return data[:-padding]
+
+
+class FixedIvEncryptor:
+    """Encrypts and decrypts like PiiEncryptionService, one value or a whole batch at a time.
+
+    With `cache_size` > 0 the most recently encrypted values are remembered;
+    the output is deterministic, so repeated DOBs and phones skip AES.
+    An encryptor may be shared between threads: the cache is locked and the
+    backends keep no per-call state that threads could trip over.
+    """
+
+    def __init__(self, key, iv, cache_size=0, backend='auto'):
+        self.backend = select_backend(backend)(key)
+        self._iv = iv
+        self._iv_value = int.from_bytes(iv, 'big')
+        self._cache = collections.OrderedDict() if cache_size > 0 else None
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def encrypt(self, plain_text):
+        if self._cache is not None:
+            return self.encrypt_batch((plain_text,))[0]
+        data = plain_text.encode('utf-8')
+        if not data:
+            return ''
+        data += _PADDING[len(data) % BLOCK_SIZE]
+        out = bytearray()
+        previous = self._iv_value
+        for offset in range(0, len(data), BLOCK_SIZE):
+            block = int.from_bytes(data[offset:offset + BLOCK_SIZE], 'big') ^ previous
+            encrypted = self.backend.encrypt_blocks(block.to_bytes(BLOCK_SIZE, 'big'))
+            out += encrypted
+            previous = int.from_bytes(encrypted, 'big')
+        return base64.b64encode(out).decode('ascii')
+
+    def encrypt_batch(self, plain_texts):
+        """Base64 ciphertexts of `plain_texts`, in order; empty strings stay empty as in C#"""
+        if self._cache is None:
+            return [base64.b64encode(raw).decode('ascii') if raw else ''
+                    for raw in self.encrypt_raw(plain_texts)]
+
+        cache = self._cache
+        results = [None] * len(plain_texts)
+        missing = {}
+        with self._cache_lock:
+            for i, plain_text in enumerate(plain_texts):
+                cached = cache.get(plain_text)
+                if cached is not None:
+                    cache.move_to_end(plain_text)
+                    results[i] = cached
+                else:
+                    missing.setdefault(plain_text, []).append(i)
+        if missing:
+            # AES runs outside the lock; the cache is only touched under it
+            encrypted_values = []
+            for plain_text, raw in zip(missing, self.encrypt_raw(list(missing))):
+                encrypted = base64.b64encode(raw).decode('ascii') if raw else ''
+                for i in missing[plain_text]:
+                    results[i] = encrypted
+                encrypted_values.append((plain_text, encrypted))
+            with self._cache_lock:
+                for plain_text, encrypted in encrypted_values:
+                    cache[plain_text] = encrypted
+                    cache.move_to_end(plain_text)
+                while len(cache) > self._cache_size:
+                    cache.popitem(last=False)
+        return results
+
+    def encrypt_raw(self, plain_texts):
+        """Raw ciphertext bytes of `plain_texts` (b'' for an empty string)"""
+        padded = []
+        for plain_text in plain_texts:
+            data = plain_text.encode('utf-8')
+            padded.append(data + _PADDING[len(data) % BLOCK_SIZE] if data else b'')
+        results = [b''] * len(padded)
+        if not padded:
+            return results
+
+        # Round k encrypts block k of every value that is that long, chained to its block k - 1
+        active = [i for i, data in enumerate(padded) if data]
+        previous = {}
+        offset = 0
+        while active:
+            blocks = b''.join(padded[i][offset:offset + BLOCK_SIZE] for i in active)
+            if offset == 0:
+                chain = self._iv * len(active)
+            else:
+                chain = b''.join(previous[i] for i in active)
+            mixed = (int.from_bytes(blocks, 'big') ^ int.from_bytes(chain, 'big')).to_bytes(len(blocks), 'big')
+            encrypted = self.backend.encrypt_blocks(mixed)
+            for n, i in enumerate(active):
+                block = encrypted[n * BLOCK_SIZE:(n + 1) * BLOCK_SIZE]
+                results[i] += block
+                previous[i] = block
+            offset += BLOCK_SIZE
+            active = [i for i in active if len(padded[i]) > offset]
+        return results
+
+    def decrypt(self, cipher_text):
+        """Decrypt a base64 ciphertext; raises ValueError if it isn't valid for this key"""
+        data = self._decode(cipher_text)
+        decrypted = self.backend.decrypt_blocks(data)
+        chain = self._iv + data[:-BLOCK_SIZE]
+        plain = (int.from_bytes(decrypted, 'big') ^ int.from_bytes(chain, 'big')).to_bytes(len(data), 'big')
+        return _unpad(plain).decode('utf-8')
+
+    def decrypt_batch(self, cipher_texts):
+        """Plain texts of `cipher_texts`, in order, with None for any value that doesn't decrypt"""
+        results = [None] * len(cipher_texts)
+        valid = []
+        for i, cipher_text in enumerate(cipher_texts):
+            try:
+                valid.append((i, self._decode(cipher_text)))
+            except ValueError:
+                pass
+        if not valid:
+            return results
+
+        # Every block of every value in one call, then undo the chaining in one XOR
+        data = b''.join(raw for _, raw in valid)
+        chain = b''.join(self._iv + raw[:-BLOCK_SIZE] for _, raw in valid)
+        plain = (int.from_bytes(self.backend.decrypt_blocks(data), 'big')
+                 ^ int.from_bytes(chain, 'big')).to_bytes(len(data), 'big')
+        offset = 0
+        for i, raw in valid:
+            try:
+                results[i] = _unpad(plain[offset:offset + len(raw)]).decode('utf-8')
+            except ValueError:
+                pass
+            offset += len(raw)
+        return results
+
+    @staticmethod
+    def _decode(cipher_text):
+        try:
+            data = base64.b64decode(cipher_text, validate=True)
+        except (binascii.Error, TypeError) as e:
+            raise ValueError(f"Ciphertext is not base64: {e}") from None
+        if not data or len(data) % BLOCK_SIZE:
+            raise ValueError("Ciphertext is not a whole number of AES blocks")
+        return data
+
+
+def self_test(backend='auto'):
+    """Check a backend against TEST_VECTORS, one at a time and as a batch; raises RuntimeError"""
+    by_key = {}
+    for key_text, plain_text, expected in TEST_VECTORS:
+        by_key.setdefault(key_text, []).append((plain_text, expected))
+    for key_text, vectors in by_key.items():
+        for cache_size in (0, 8):
+            encryptor = FixedIvEncryptor(*derive_key_and_iv(key_text), cache_size, backend)
+            plain_texts = [plain_text for plain_text, _ in vectors]
+            expected = [encrypted for _, encrypted in vectors]
+            # Twice, so a warm cache is checked too
+            for _ in range(2):
+                if encryptor.encrypt_batch(plain_texts) != expected:
+                    raise RuntimeError(f"{encryptor.backend.name}: batch encryption differs from PiiEncryptionService")
+            for plain_text, encrypted in vectors:
+                if encryptor.encrypt(plain_text) != encrypted:
+                    raise RuntimeError(f"{encryptor.backend.name}: encrypting {plain_text!r} "
+                                       f"differs from PiiEncryptionService")
+                if encrypted and encryptor.decrypt(encrypted) != plain_text:
+                    raise RuntimeError(f"{encryptor.backend.name}: decrypting {encrypted!r} failed")
+            decrypted = encryptor.decrypt_batch([encrypted for encrypted in expected if encrypted] + ['not base64!'])
+            if decrypted != [plain_text for plain_text in plain_texts if plain_text] + [None]:
+                raise RuntimeError(f"{encryptor.backend.name}: batch decryption failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the PII crypto backends")
+    parser.add_argument('--self-test', action='store_true',
+                        help="Check every installed backend against the PiiEncryptionService test vectors")
+    parser.add_argument('--rows', type=int, default=100000,
+                        help="Values per backend for the throughput figures (default: 100000)")
+    args = parser.parse_args()
+
+    if not BACKENDS:
+        print("❌ No AES backend installed. Install with: apt-get install python3-pycryptodome")
+        sys.exit(1)
+    failed = False
+    if args.self_test:
+        for name in BACKENDS:
+            try:
+                self_test(name)
+                print(f"✅ {name}: {len(TEST_VECTORS)} PiiEncryptionService test vectors match")
+            except RuntimeError as e:
+                print(f"❌ {e}")
+                failed = True
+
+    key, iv = derive_key_and_iv("pii-crypto-benchmark")
+    phones = [f"+1555{n:07d}" for n in range(args.rows)]
+    for name in BACKENDS:
+        encryptor = FixedIvEncryptor(key, iv, backend=name)
+        started = time.perf_counter()
+        for start in range(0, len(phones), 1000):
+            encryptor.encrypt_batch(phones[start:start + 1000])
+        elapsed = time.perf_counter() - started
+        print(f"⏱  {name}: {args.rows / elapsed:,.0f} phones/s in batches of 1000")
+    print(f"   Selected backend: {select_backend().name}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
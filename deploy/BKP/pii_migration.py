@@ -0,0 +1,1446 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the PII encryption migration scripts
+(encrypt-dob-python.py and encrypt-mobilephone-python.py).
+
+Rows are read in bounded batches so peak memory depends on the batch size,
+not on the size of the Users / UserRequests tables, and written back in
+batches that are committed one at a time. Encryption can be spread over a
+process pool (--workers) while results still reach a single, ordered writer.
+
+The AES itself is in pii_crypto.py, which encrypts each batch in a few calls.
+PiiEncryptionService uses a fixed key-derived IV, so a given plain text always
+encrypts to the same ciphertext. Repeated values are served from an LRU cache
+and DOBs can come from a precomputed DobLookupTable instead of running AES.
+
+After every committed batch the last Id is recorded in a Checkpoint file, so
+--resume continues a failed run where it stopped instead of rescanning.
+
+--incremental only looks at rows past the high-water mark of the previous
+pass (see scan_scope), and --poll repeats such passes.
+
+--pipeline overlaps reading, encryption and writing on separate threads and
+connections (see read_stage / write_stage).
+
+--online paces the run for a live primary with an OnlineThrottle.
+
+--profile records where a run spends its time (see profiled).
+"""
+
+import base64
+import contextlib
+import cProfile
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pii_crypto
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CACHE_SIZE = 65536
+DEFAULT_DOB_RANGE = '1900-01-01:2030-12-31'
+DEFAULT_CHECKPOINT_FILE = '/var/tmp/pii-migration-checkpoint.json'
+DEFAULT_ENCRYPTION_KEY = "DefaultEncryptionKey32BytesLong!!"
+DEFAULT_REWIND = 1000
+DEFAULT_PROFILE_INTERVAL = 0.005
+DEFAULT_PIPELINE_DEPTH = 2
+# Rows per multi-row INSERT into a staging table, well under max_allowed_packet
+STAGING_INSERT_ROWS = 1000
+
+# Read modes
+#   keyset   - repeated "WHERE Id > last_id ORDER BY Id LIMIT n" queries
+#   server   - one unbuffered server-side cursor (needs its own connection)
+#   buffered - legacy behaviour, fetchall() then split into batches
+STREAM_MODES = ('keyset', 'server', 'buffered')
+
+# Write strategies
+#   case        - one "UPDATE ... SET col = CASE Id WHEN .. THEN .. END" per batch
+#   executemany - pymysql executemany() of the single-row UPDATE (pymysql only
+#                 folds INSERT/REPLACE, so this is still a round-trip per row)
+#   row         - legacy behaviour, one UPDATE round-trip per row
+#   staging     - multi-row INSERTs into a session TEMPORARY table, then one
+#                 "UPDATE ... JOIN" per batch, so the server applies the whole
+#                 batch as a single set-based statement
+WRITE_STRATEGIES = ('case', 'executemany', 'row', 'staging')
+
+
+def read_appsettings(config_path):
+    """Load appsettings.Production.json"""
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def encryption_key_from_appsettings(config):
+    """PiiEncryption:Key, then Encryption:Key, then the C# default"""
+    return (config.get('PiiEncryption', {}).get('Key')
+            or config.get('Encryption', {}).get('Key')
+            or DEFAULT_ENCRYPTION_KEY)
+
+
+def blind_index_key_from_appsettings(config):
+    """HMAC key for blind indexes: SHA256 of PiiEncryption:BlindIndexKey.
+
+    There is no fallback to the encryption key. An index key derived from it
+    would change with every rotate-pii-key.py run and leave every stored index
+    silently stale. Raises ValueError when the setting is missing.
+    """
+    secret = config.get('PiiEncryption', {}).get('BlindIndexKey')
+    if not secret:
+        raise ValueError("PiiEncryption:BlindIndexKey is not set; blind indexes need their own key, "
+                         "separate from PiiEncryption:Key")
+    return hashlib.sha256(secret.encode('utf-8')).digest()
+
+
+def db_config_from_appsettings(config):
+    """pymysql.connect() arguments from ConnectionStrings:MySQL"""
+    parts = {}
+    for part in config.get('ConnectionStrings', {}).get('MySQL', '').split(';'):
+        if '=' in part:
+            k, v = part.split('=', 1)
+            parts[k.strip().lower()] = v.strip()
+    return {
+        'host': parts.get('server', 'localhost'),
+        'port': int(parts.get('port', 3306)),
+        'user': parts.get('user', 'mentalhealth_user'),
+        'password': parts.get('password', ''),
+        'database': parts.get('database', 'mentalhealthdb'),
+        'charset': 'utf8mb4',
+    }
+
+
+def build_select(table, column, where):
+    """Build the SELECT used by every read mode.
+
+    `where` is a SQL fragment passed through pymysql parameter substitution,
+    so literal percent signs must be written as %%.
+    """
+    sql = f"SELECT Id, {column} FROM {table} WHERE Id > %s"
+    if where:
+        sql += f" AND ({where})"
+    return sql + " ORDER BY Id"
+
+
+# Base64 of a whole number of AES blocks, i.e. what PiiEncryptionService writes
+CIPHERTEXT_RE = re.compile(r'([A-Za-z0-9+/]{4})+([A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?')
+
+
+def looks_like_ciphertext(value):
+    """True when `value` is base64 that decodes to a multiple of 16 bytes"""
+    if not value or CIPHERTEXT_RE.fullmatch(value) is None:
+        return False
+    return (len(value) // 4 * 3 - value.count('=')) % 16 == 0
+
+
+def ciphertext_predicate(column):
+    """SQL version of looks_like_ciphertext(), so ciphertext can be filtered server-side"""
+    return (
+        f"({column} REGEXP '^([A-Za-z0-9+/]{{4}})+([A-Za-z0-9+/]{{2}}==|[A-Za-z0-9+/]{{3}}=)?$' "
+        f"AND MOD(CHAR_LENGTH({column}) / 4 * 3 "
+        f"- (CHAR_LENGTH({column}) - CHAR_LENGTH(REPLACE({column}, '=', ''))), 16) = 0)"
+    )
+
+
+def row_filter(base, plain_text, sql_filter=True):
+    """Combine a table's base WHERE fragment with its plain text predicate"""
+    if not sql_filter:
+        return base
+    return f"({base}) AND ({plain_text})"
+
+
+def count_rows(conn, table, where, start_id=0):
+    """Count rows past start_id matching a WHERE fragment (for filter reporting)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE Id > %s AND ({where})", (start_id,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def iter_keyset_batches(conn, table, column, where='', batch_size=DEFAULT_BATCH_SIZE, start_id=0):
+    """Yield lists of (Id, value) rows using keyset pagination on Id.
+
+    `batch_size` may be an int or a callable returning the size of the next batch.
+    """
+    sql = build_select(table, column, where) + " LIMIT %s"
+    last_id = start_id
+    cursor = conn.cursor()
+    try:
+        while True:
+            # A callable batch size lets OnlineThrottle resize every query
+            size = batch_size() if callable(batch_size) else batch_size
+            cursor.execute(sql, (last_id, size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            yield list(rows)
+            last_id = rows[-1][0]
+            if len(rows) < size:
+                break
+    finally:
+        cursor.close()
+
+
+def iter_server_batches(conn, table, column, where='', batch_size=DEFAULT_BATCH_SIZE, start_id=0):
+    """Yield lists of (Id, value) rows from an unbuffered server-side cursor.
+
+    The connection is busy until the result set is fully read, so UPDATEs
+    must be sent over a different connection.
+    """
+    import pymysql.cursors
+
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(build_select(table, column, where), (start_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield list(rows)
+    finally:
+        cursor.close()
+
+
+def iter_buffered_batches(conn, table, column, where='', batch_size=DEFAULT_BATCH_SIZE, start_id=0):
+    """Yield lists of (Id, value) rows after loading the whole result set"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(build_select(table, column, where), (start_id,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    for i in range(0, len(rows), batch_size):
+        yield list(rows[i:i + batch_size])
+
+
+def iter_batches(conn, table, column, where='', batch_size=DEFAULT_BATCH_SIZE, mode='keyset', start_id=0):
+    """Yield batches of (Id, value) rows using the requested read mode"""
+    readers = {
+        'keyset': iter_keyset_batches,
+        'server': iter_server_batches,
+        'buffered': iter_buffered_batches,
+    }
+    if mode not in readers:
+        raise ValueError(f"Unknown stream mode: {mode}")
+    if callable(batch_size) and mode != 'keyset':
+        raise ValueError("Only keyset mode supports an adaptive batch size")
+    if not callable(batch_size) and batch_size < 1:
+        raise ValueError("Batch size must be at least 1")
+    return readers[mode](conn, table, column, where, batch_size, start_id)
+
+
+class BatchWriter:
+    """Write (Id, new_value) pairs back to one column, committing per batch.
+
+    A guarded writer takes (Id, new_value, old_value) triples and leaves a row
+    alone if the application changed it after it was read.
+    """
+
+    def __init__(self, conn, table, column, strategy='case', batch_size=DEFAULT_BATCH_SIZE,
+                 guarded=False):
+        if strategy not in WRITE_STRATEGIES:
+            raise ValueError(f"Unknown write strategy: {strategy}")
+        self.conn = conn
+        self.table = table
+        self.column = column
+        self.strategy = strategy
+        self.batch_size = batch_size
+        self.guarded = guarded
+        self.rows_written = 0
+        self.batches_committed = 0
+        self.write_seconds = 0.0
+        self.last_write_seconds = 0.0
+        self.staging_table = f"pii_staging_{table}_{column}" + ("_guarded" if guarded else "")
+        self._staging_created = False
+
+    def write(self, updates):
+        """Write a list of (Id, new_value) pairs, one commit per batch_size rows"""
+        self.last_write_seconds = 0.0
+        for i in range(0, len(updates), self.batch_size):
+            chunk = updates[i:i + self.batch_size]
+            started = time.perf_counter()
+            cursor = self.conn.cursor()
+            try:
+                getattr(self, f'_write_{self.strategy}')(cursor, chunk)
+            finally:
+                cursor.close()
+            self.conn.commit()
+            elapsed = time.perf_counter() - started
+            self.last_write_seconds += elapsed
+            self.write_seconds += elapsed
+            self.rows_written += len(chunk)
+            self.batches_committed += 1
+
+    def _write_case(self, cursor, chunk):
+        if self.guarded:
+            whens = " ".join([f"WHEN %s THEN IF({self.column} = %s, %s, {self.column})"] * len(chunk))
+            params = [v for row_id, new, old in chunk for v in (row_id, old, new)]
+        else:
+            whens = " ".join(["WHEN %s THEN %s"] * len(chunk))
+            params = [value for pair in chunk for value in pair]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        params.extend(row[0] for row in chunk)
+        cursor.execute(
+            f"UPDATE {self.table} SET {self.column} = CASE Id {whens} END "
+            f"WHERE Id IN ({placeholders})",
+            params
+        )
+
+    def _single_row_update(self):
+        sql = f"UPDATE {self.table} SET {self.column} = %s WHERE Id = %s"
+        return sql + f" AND {self.column} = %s" if self.guarded else sql
+
+    def _write_executemany(self, cursor, chunk):
+        cursor.executemany(self._single_row_update(), [(row[1], row[0]) + row[2:] for row in chunk])
+
+    def _write_row(self, cursor, chunk):
+        sql = self._single_row_update()
+        for row in chunk:
+            cursor.execute(sql, (row[1], row[0]) + row[2:])
+
+    def _staging_columns(self):
+        """Value columns of the staging table, in the order of a chunk's rows after the Id"""
+        return ('NewValue', 'OldValue') if self.guarded else ('NewValue',)
+
+    def _staging_rows(self, chunk):
+        return [tuple(row) for row in chunk]
+
+    def _staging_update(self):
+        sql = (f"UPDATE {self.table} t JOIN {self.staging_table} s ON t.Id = s.Id "
+               f"SET t.{self.column} = s.NewValue")
+        return sql + f" WHERE t.{self.column} = s.OldValue" if self.guarded else sql
+
+    def _write_staging(self, cursor, chunk):
+        columns = self._staging_columns()
+        if not self._staging_created:
+            # Temporary tables are private to this connection and dropped with it;
+            # creating and emptying one doesn't commit the open transaction
+            definitions = ", ".join(f"{column} VARCHAR(1024) NULL" for column in columns)
+            cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {self.staging_table} "
+                           f"(Id BIGINT NOT NULL PRIMARY KEY, {definitions})")
+            self._staging_created = True
+        cursor.execute(f"DELETE FROM {self.staging_table}")
+        rows = self._staging_rows(chunk)
+        row_placeholders = "(" + ", ".join(["%s"] * (len(columns) + 1)) + ")"
+        for i in range(0, len(rows), STAGING_INSERT_ROWS):
+            part = rows[i:i + STAGING_INSERT_ROWS]
+            cursor.execute(
+                f"INSERT INTO {self.staging_table} (Id, {', '.join(columns)}) "
+                f"VALUES {', '.join([row_placeholders] * len(part))}",
+                [value for row in part for value in row]
+            )
+        cursor.execute(self._staging_update())
+
+
+class MultiColumnWriter(BatchWriter):
+    """Write (Id, {column: new_value}) rows to several columns of one table.
+
+    The CASE strategy sets every column through its own CASE in a single
+    UPDATE per batch; columns a row doesn't change are left as they are.
+    """
+
+    def __init__(self, conn, table, columns, strategy='case', batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(conn, table, ', '.join(columns), strategy, batch_size)
+        self.columns = tuple(columns)
+        self.staging_table = f"pii_staging_{table}"
+
+    def _write_case(self, cursor, chunk):
+        assignments = []
+        params = []
+        for column in self.columns:
+            pairs = [(row_id, values[column]) for row_id, values in chunk if column in values]
+            if not pairs:
+                continue
+            whens = " ".join(["WHEN %s THEN %s"] * len(pairs))
+            assignments.append(f"{column} = CASE Id {whens} ELSE {column} END")
+            params.extend(value for pair in pairs for value in pair)
+        placeholders = ", ".join(["%s"] * len(chunk))
+        params.extend(row_id for row_id, _ in chunk)
+        cursor.execute(
+            f"UPDATE {self.table} SET {', '.join(assignments)} WHERE Id IN ({placeholders})",
+            params
+        )
+
+    def _write_row(self, cursor, chunk):
+        for row_id, values in chunk:
+            columns = [column for column in self.columns if column in values]
+            assignments = ", ".join(f"{column} = %s" for column in columns)
+            cursor.execute(f"UPDATE {self.table} SET {assignments} WHERE Id = %s",
+                           [values[column] for column in columns] + [row_id])
+
+    # pymysql's executemany() is a round-trip per UPDATE anyway
+    _write_executemany = _write_row
+
+    def _staging_columns(self):
+        return self.columns
+
+    def _staging_rows(self, chunk):
+        # A column the row doesn't change is staged as NULL and kept by the COALESCE
+        return [(row_id,) + tuple(values.get(column) for column in self.columns) for row_id, values in chunk]
+
+    def _staging_update(self):
+        assignments = ", ".join(f"t.{column} = COALESCE(s.{column}, t.{column})" for column in self.columns)
+        return f"UPDATE {self.table} t JOIN {self.staging_table} s ON t.Id = s.Id SET {assignments}"
+
+
+DOB_PLAIN_TEXT_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def plausible_plain_text(column, plain_text):
+    """Reject decryptions that only succeeded by chance (wrong key, valid padding)"""
+    if column == 'DateOfBirthEncrypted':
+        return DOB_PLAIN_TEXT_RE.fullmatch(plain_text) is not None
+    return plain_text.isprintable()
+
+
+def key_fingerprint(key, iv):
+    """Short, non-reversible identifier of a derived key/IV pair"""
+    return hashlib.sha256(b'pii-dob-table' + key + iv).digest()[:16]
+
+
+class DobLookupTable:
+    """Precomputed ciphertexts for every "yyyy-MM-dd" date in a range.
+
+    A formatted date is 10 bytes, i.e. one padded AES block, so each entry is
+    a single 16-byte ciphertext block stored at its day offset from the first
+    date. The file is header + raw blocks (~16 bytes per date) and is tied to
+    the key by a fingerprint. Anyone holding it can map ciphertexts back to
+    dates, so it is written owner-readable only and should be treated like
+    the key itself.
+    """
+
+    MAGIC = b'PIIDOB1\n'
+    HEADER = struct.Struct('<8s16sII')
+
+    def __init__(self, fingerprint, first_ordinal, blocks):
+        self.fingerprint = fingerprint
+        self.first_ordinal = first_ordinal
+        self.count = len(blocks) // pii_crypto.BLOCK_SIZE
+        self.blocks = blocks
+
+    @classmethod
+    def build(cls, key, iv, first_day, last_day):
+        first = first_day.toordinal()
+        count = last_day.toordinal() - first + 1
+        if count < 1:
+            raise ValueError("DOB range end is before its start")
+        dates = [date.fromordinal(ordinal).strftime('%Y-%m-%d') for ordinal in range(first, first + count)]
+        # One block per date, so the whole range is a single AES call
+        blocks = b''.join(pii_crypto.FixedIvEncryptor(key, iv).encrypt_raw(dates))
+        return cls(key_fingerprint(key, iv), first, blocks)
+
+    @classmethod
+    def load(cls, path, key, iv):
+        """Load a table file, or return None if it is missing or for another key"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, fingerprint, first, count = cls.HEADER.unpack_from(data)
+        blocks = data[cls.HEADER.size:]
+        if (magic != cls.MAGIC or fingerprint != key_fingerprint(key, iv)
+                or len(blocks) != count * pii_crypto.BLOCK_SIZE):
+            return None
+        return cls(fingerprint, first, blocks)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.fingerprint, self.first_ordinal, self.count))
+            f.write(self.blocks)
+        os.replace(tmp_path, path)
+
+    def lookup(self, plain_text):
+        """Return the ciphertext for a "yyyy-MM-dd" string, or None if outside the table"""
+        if len(plain_text) != 10:
+            return None
+        try:
+            offset = date.fromisoformat(plain_text).toordinal() - self.first_ordinal
+        except ValueError:
+            return None
+        if not 0 <= offset < self.count:
+            return None
+        start = offset * pii_crypto.BLOCK_SIZE
+        return base64.b64encode(self.blocks[start:start + pii_crypto.BLOCK_SIZE]).decode('utf-8')
+
+
+def parse_date_range(value):
+    """Parse "yyyy-MM-dd:yyyy-MM-dd" into two dates"""
+    first, _, last = value.partition(':')
+    return date.fromisoformat(first), date.fromisoformat(last)
+
+
+def load_dob_table(path, key, iv, date_range=DEFAULT_DOB_RANGE):
+    """Load the DOB table at `path`, building and saving it when missing or stale"""
+    table = DobLookupTable.load(path, key, iv)
+    if table is None:
+        first_day, last_day = parse_date_range(date_range)
+        table = DobLookupTable.build(key, iv, first_day, last_day)
+        table.save(path)
+    encryptor = pii_crypto.FixedIvEncryptor(key, iv)
+    for ordinal in (table.first_ordinal, table.first_ordinal + table.count - 1):
+        plain_text = date.fromordinal(ordinal).strftime('%Y-%m-%d')
+        if table.lookup(plain_text) != encryptor.encrypt(plain_text):
+            raise RuntimeError(f"DOB table {path} does not match the encryption key")
+    return table
+
+
+def encrypt_values(encryptor, plain_texts):
+    """encrypt_batch() as (encrypted, error) pairs; if the batch fails, values are retried
+    one at a time so a single bad value doesn't fail its neighbours"""
+    try:
+        return [(encrypted, None) for encrypted in encryptor.encrypt_batch(plain_texts)]
+    except Exception:
+        results = []
+        for plain_text in plain_texts:
+            try:
+                results.append((encryptor.encrypt(plain_text), None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+
+# Per-process state for the encryption pool, set by _init_worker
+_worker_settings = None
+_worker_encryptor = None
+_worker_prepare = None
+_worker_lookup = None
+
+
+def _init_worker(key, iv, prepare, cache_size=0, lookup_table=None):
+    global _worker_settings, _worker_encryptor, _worker_prepare, _worker_lookup
+    settings = (key, iv, prepare, cache_size, lookup_table)
+    if settings == _worker_settings:
+        # Keep the warm cache when the same process moves on to the next table
+        return
+    _worker_settings = settings
+    _worker_encryptor = pii_crypto.FixedIvEncryptor(key, iv, cache_size)
+    _worker_prepare = prepare
+    _worker_lookup = lookup_table.lookup if lookup_table is not None else None
+
+
+def _encrypt_chunk(rows):
+    """Encrypt (Id, value) rows, returning (Id, encrypted or None, error or None)"""
+    results = []
+    pending = []
+    for row_id, value in rows:
+        try:
+            plain_text = _worker_prepare(value) if _worker_prepare else value
+        except Exception as e:
+            results.append((row_id, None, str(e)))
+            continue
+        encrypted = _worker_lookup(plain_text) if _worker_lookup else None
+        if encrypted is None:
+            # Filled in below, with the rest of the batch
+            pending.append((len(results), plain_text))
+        results.append((row_id, encrypted, None))
+    encrypted = encrypt_values(_worker_encryptor, [plain_text for _, plain_text in pending])
+    for (n, _), (value, error) in zip(pending, encrypted):
+        results[n] = (results[n][0], value, error)
+    return results
+
+
+def process_chunks(chunks, worker, initializer, initargs, workers=1, pool=None):
+    """Run `worker` over an iterable of (context, rows) pairs, yielding (context, results) in order.
+
+    `worker` and `initializer` must be module-level functions so they can be
+    sent to worker processes. With workers > 1 at most 2 * workers chunks are
+    in flight, so memory stays bounded while the reader keeps the pool busy.
+    An existing `pool` (already initialised) can be shared between callers,
+    e.g. tables migrated on separate threads.
+    """
+    if workers <= 1:
+        initializer(*initargs)
+        for context, rows in chunks:
+            yield context, worker(rows)
+        return
+
+    with contextlib.ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                                                           initargs=initargs))
+        in_flight = deque()
+        for context, rows in chunks:
+            in_flight.append((context, pool.submit(worker, rows)))
+            if len(in_flight) >= 2 * workers:
+                context, future = in_flight.popleft()
+                yield context, future.result()
+        while in_flight:
+            context, future = in_flight.popleft()
+            yield context, future.result()
+
+
+def encrypt_chunks(chunks, key, iv, prepare=None, workers=1, cache_size=0, lookup_table=None):
+    """Encrypt an iterable of (context, rows) pairs, yielding (context, results) in order.
+
+    `prepare` turns a stored value into the plain text that is encrypted and
+    must be a module-level function. Each process keeps its own LRU of
+    `cache_size` entries and consults `lookup_table` first if given.
+    """
+    return process_chunks(chunks, _encrypt_chunk, _init_worker,
+                          (key, iv, prepare, cache_size, lookup_table), workers)
+
+
+def _put(items, item, stop):
+    """Block until `item` is queued or `stop` is set; returns whether it was queued"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(iterable, depth=DEFAULT_PIPELINE_DEPTH, name='pii-reader'):
+    """Yield the items of `iterable`, produced up to `depth` items ahead on a background thread.
+
+    The producer blocks once `depth` items are waiting, so a slow consumer
+    holds the reader back instead of letting batches pile up in memory.
+    Errors are re-raised in the consumer. Anything the producer touches,
+    such as a database connection, must not be used by the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not _put(items, (item, None), stop):
+                    return
+            _put(items, (done, None), stop)
+        except BaseException as e:
+            _put(items, (done, e), stop)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BackgroundWriter:
+    """Calls `apply(*item)` for submitted items in order, on a background thread.
+
+    submit() blocks while `depth` items are waiting, which is the pipeline's
+    back-pressure. After a failed apply() the remaining items are dropped and
+    the error is raised by the next submit() or by close().
+    """
+
+    _DONE = object()
+
+    def __init__(self, apply, depth=DEFAULT_PIPELINE_DEPTH, name='pii-writer'):
+        self.apply = apply
+        self._items = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._items.get()
+            if item is self._DONE:
+                return
+            if self._error is None:
+                try:
+                    self.apply(*item)
+                except BaseException as e:
+                    self._error = e
+
+    def submit(self, *item):
+        if self._error is not None:
+            raise self._error
+        self._items.put(item)
+
+    def close(self, raise_error=True):
+        """Wait for every submitted item to be applied"""
+        self._items.put(self._DONE)
+        self._thread.join()
+        if raise_error and self._error is not None:
+            raise self._error
+
+
+def read_stage(batches, args, timer):
+    """With --pipeline, fetch `batches` on a reader thread while the caller encrypts.
+
+    Time the caller spends waiting for the reader is charged to 'fetch-wait'.
+    """
+    if not args.pipeline:
+        return batches
+    return timer.iterate('fetch-wait', prefetch(batches, args.pipeline_depth))
+
+
+@contextlib.contextmanager
+def write_stage(commit_batch, args, timer):
+    """Yield the function batches are handed to for writing.
+
+    Without --pipeline that is `commit_batch` itself. With it, batches are
+    committed in order on a writer thread, so batch N is written while
+    batch N+1 is encrypted; the caller waits ('write-wait') only when
+    --pipeline-depth batches are already queued. `commit_batch` must write,
+    commit and checkpoint a batch, exactly as it would inline, and the
+    caller must leave the write connection alone until the block ends.
+    """
+    if not args.pipeline:
+        yield commit_batch
+        return
+    writer = BackgroundWriter(commit_batch, args.pipeline_depth)
+
+    def submit(*item):
+        with timer.stage('write-wait'):
+            writer.submit(*item)
+
+    try:
+        yield submit
+    except BaseException:
+        writer.close(raise_error=False)
+        raise
+    with timer.stage('write-wait'):
+        writer.close()
+
+
+class Checkpoint:
+    """Last committed Id per database, table and column, kept in a small JSON file.
+
+    The file is rewritten atomically after every committed batch, so it never
+    points past data that has not been committed. Tables migrated on separate
+    threads can share one Checkpoint.
+    """
+
+    def __init__(self, path, database):
+        self.path = path
+        self.database = database
+        self.state = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.state = json.load(f)
+
+    def _entry(self, table, column):
+        return self.state.get(self.database, {}).get(f"{table}.{column}", {})
+
+    def last_id(self, table, column):
+        return self._entry(table, column).get('last_id', 0)
+
+    def is_complete(self, table, column):
+        return self._entry(table, column).get('complete', False)
+
+    def watermark(self, table, column, source='Id'):
+        """High-water mark of the last finished --incremental pass, if it used `source`"""
+        entry = self._entry(table, column)
+        if entry.get('watermark_source', 'Id') != source:
+            return None
+        return entry.get('watermark')
+
+    def record(self, table, column, last_id, complete=False, **extra):
+        """Record progress for a column, or for a tuple of columns read in one scan"""
+        columns = (column,) if isinstance(column, str) else column
+        with self._lock:
+            for name in columns:
+                entry = self.state.setdefault(self.database, {}).setdefault(f"{table}.{name}", {})
+                entry.update(extra)
+                entry.update({
+                    'last_id': last_id,
+                    'complete': complete,
+                    'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                })
+            self.save()
+
+    def complete(self, table, column, watermark=None, source='Id'):
+        extra = {'watermark': watermark, 'watermark_source': source} if watermark is not None else {}
+        self.record(table, column, self.last_id(table, column), complete=True, **extra)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def resume_point(checkpoint, table, column, resume):
+    """Id to continue after, or None when a resumed table has already finished"""
+    if not resume:
+        return 0
+    if checkpoint.is_complete(table, column):
+        return None
+    return checkpoint.last_id(table, column)
+
+
+def load_script(filename):
+    """Import one of the hyphen-named scripts next to this module, e.g. encrypt-dob-python.py.
+
+    The module is registered in sys.modules so functions from it (such as a
+    `prepare` callback) can be handed to --workers processes.
+    """
+    name = "pii_script_" + os.path.splitext(filename)[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(__file__), filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def max_value(conn, table, column):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MAX({column}) FROM {table}")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def scan_scope(conn, checkpoint, table, column, args):
+    """Where this run starts reading: (start_id, extra WHERE fragment, watermark).
+
+    Without --incremental this is just the --resume point and the watermark
+    is None; the result is None when a resumed table has already finished.
+
+    With --incremental the scan starts at the high-water mark the previous
+    pass stored, minus --rewind, so a transaction that was given a lower Id
+    but committed after the previous pass read MAX(Id) is still seen.
+    The new mark is read before scanning; pass it to Checkpoint.complete().
+    A --watermark-column (e.g. UserRequests=UpdatedAt) replaces the Id with
+    an indexed timestamp, which also catches plain text written by UPDATEs.
+    """
+    if not args.incremental:
+        start_id = resume_point(checkpoint, table, column, args.resume)
+        return None if start_id is None else (start_id, '', None)
+
+    source = args.watermark_columns.get(table, 'Id')
+    previous = checkpoint.watermark(table, column, source)
+    current = max_value(conn, table, source)
+    if source == 'Id':
+        return max((previous or 0) - args.rewind, 0), '', current or 0
+    current = current.isoformat(sep=' ') if current is not None else previous
+    if previous is None:
+        return 0, '', current
+    # Generated here from a stored datetime, so it is safe to inline
+    since = datetime.fromisoformat(previous) - timedelta(seconds=args.rewind)
+    return 0, f"{source} >= '{since:%Y-%m-%d %H:%M:%S.%f}'", current
+
+
+def id_ranges(conn, table, chunk_size):
+    """[lo, hi) Id ranges covering the table, aligned to multiples of chunk_size.
+
+    Alignment keeps the boundaries identical between runs and databases, so
+    checksums of the same range can be compared directly.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(Id), MAX(Id) FROM {table}")
+        min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return []
+    first = (min_id // chunk_size) * chunk_size
+    return [(lo, lo + chunk_size) for lo in range(first, max_id + 1, chunk_size)]
+
+
+def and_where(*fragments):
+    """Join non-empty WHERE fragments with AND"""
+    return " AND ".join(f"({f})" for f in fragments if f)
+
+
+def poll(run_pass, interval):
+    """Run an --incremental pass every `interval` seconds until interrupted.
+
+    run_pass() returns how many rows it changed or failed on. The output of
+    passes that found nothing is dropped, so an idle loop stays quiet.
+    """
+    print(f"🔁 Polling every {interval:g}s for new plain text, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(interval)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                changed = run_pass()
+            if changed:
+                print(f"🕑 {time.strftime('%Y-%m-%d %H:%M:%S')}: {changed} rows")
+                print(output.getvalue(), end='')
+    except KeyboardInterrupt:
+        print("\n⏹  Polling stopped")
+
+
+class OnlineThrottle:
+    """Pacing for migrations that run against a live primary.
+
+    The batch size follows the observed write latency: it grows by a quarter
+    while batches commit under the target and halves as soon as one does not.
+    Between batches the throttle sleeps, and it holds the migration while any
+    load signal (Threads_running, InnoDB row lock waits, replica lag) is over
+    its threshold.
+    """
+
+    def __init__(self, conn, max_batch_size, min_batch_size=50, target_latency=0.2,
+                 pause=0.1, max_threads_running=None, max_lock_waits=None,
+                 replica_conn=None, max_replica_lag=None, check_interval=5.0):
+        self.conn = conn
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min(min_batch_size, max_batch_size)
+        self.batch_size = self.min_batch_size
+        self.target_latency = target_latency
+        self.pause = pause
+        self.max_threads_running = max_threads_running
+        self.max_lock_waits = max_lock_waits
+        self.replica_conn = replica_conn
+        self.max_replica_lag = max_replica_lag
+        self.check_interval = check_interval
+        self.paused_seconds = 0.0
+
+    def __call__(self):
+        return self.batch_size
+
+    def record(self, seconds):
+        """Adjust the batch size after a batch committed in `seconds`"""
+        if seconds > self.target_latency:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        else:
+            self.batch_size = min(self.max_batch_size, max(self.batch_size + 1, self.batch_size * 5 // 4))
+
+    def _global_status(self, name):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SHOW GLOBAL STATUS LIKE %s", (name,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return int(row[1]) if row else 0
+
+    def _replica_lag(self):
+        cursor = self.replica_conn.cursor()
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Exception:
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            status = dict(zip([d[0] for d in cursor.description], row))
+        finally:
+            cursor.close()
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        # NULL lag means replication is stopped, which is treated as overloaded
+        return float('inf') if lag is None else float(lag)
+
+    def overload_reason(self):
+        """Return why the database is over a threshold, or None if it is not"""
+        if self.max_threads_running is not None:
+            running = self._global_status('Threads_running')
+            if running > self.max_threads_running:
+                return f"Threads_running {running} > {self.max_threads_running}"
+        if self.max_lock_waits is not None:
+            waits = self._global_status('Innodb_row_lock_current_waits')
+            if waits > self.max_lock_waits:
+                return f"InnoDB row lock waits {waits} > {self.max_lock_waits}"
+        if self.replica_conn is not None and self.max_replica_lag is not None:
+            lag = self._replica_lag()
+            if lag is not None and lag > self.max_replica_lag:
+                return f"replica lag {lag}s > {self.max_replica_lag}s"
+        return None
+
+    def wait(self):
+        """Sleep between batches and hold while the database is overloaded"""
+        started = time.perf_counter()
+        time.sleep(self.pause)
+        reason = self.overload_reason()
+        while reason:
+            print(f"  ⏸  Pausing migration: {reason}")
+            time.sleep(self.check_interval)
+            reason = self.overload_reason()
+        self.paused_seconds += time.perf_counter() - started
+
+
+def make_throttle(args, conn, db_config):
+    """Build an OnlineThrottle from the --online options, or return None"""
+    if not args.online:
+        return None
+    replica_conn = None
+    if args.replica:
+        import pymysql
+
+        host, _, port = args.replica.partition(':')
+        replica_conn = pymysql.connect(**dict(db_config, host=host, port=int(port or 3306)))
+    return OnlineThrottle(
+        conn,
+        max_batch_size=args.batch_size,
+        min_batch_size=args.min_batch_size,
+        target_latency=args.target_latency_ms / 1000.0,
+        pause=args.pause_ms / 1000.0,
+        max_threads_running=args.max_threads_running,
+        max_lock_waits=args.max_lock_waits,
+        replica_conn=replica_conn,
+        max_replica_lag=args.max_replica_lag,
+        check_interval=args.load_check_interval,
+    )
+
+
+def reject_arguments(parser, args, dests):
+    """parser.error() for shared options (by dest) that a script accepts via
+    add_stream_arguments() but does not implement, when given a non-default value"""
+    for dest in dests:
+        if getattr(args, dest) != parser.get_default(dest):
+            parser.error(f"--{dest.replace('_', '-')} is not supported by this script")
+
+
+def check_arguments(parser, args):
+    """Reject option combinations the migration engine can't honour"""
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.online and args.stream != 'keyset':
+        parser.error("--online needs --stream keyset to resize batches")
+    if args.pipeline_depth < 1:
+        parser.error("--pipeline-depth must be at least 1")
+    if args.profile_interval <= 0:
+        parser.error("--profile-interval must be positive")
+    if args.poll:
+        args.incremental = True
+    if args.incremental and args.resume:
+        parser.error("--incremental continues from its own watermark; drop --resume")
+    args.watermark_columns = {}
+    for value in args.watermark_column:
+        table, sep, column = value.partition('=')
+        if not sep or not table or not column:
+            parser.error(f"--watermark-column expects TABLE=COLUMN, got {value!r}")
+        args.watermark_columns[table] = column
+
+
+class StageTimer:
+    """Wall time per stage (e.g. fetch / crypt / write) of a migration run.
+
+    Stages may nest, as when the encryption generator pulls the next batch
+    from the reader; time is charged to the innermost stage only, so the
+    totals add up to the time spent inside any stage. Each thread has its
+    own stack of open stages.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self._stack
+        now = time.perf_counter()
+        if stack:
+            outer = stack[-1]
+            outer[2] += now - outer[1]
+        stack.append([name, now, 0.0])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            name, started, seconds = stack.pop()
+            self._observe(name, seconds + now - started)
+            if stack:
+                stack[-1][1] = now
+
+    def iterate(self, name, iterable):
+        """Yield from `iterable`, charging the time spent producing each item to `name`"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _observe(self, name, seconds):
+        """Called with the time charged to one entry into a stage"""
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+
+class MigrationMetrics(StageTimer):
+    """Progress, throughput and per-batch stage latency of a migration run.
+
+    Scripts report cumulative counts after every batch with progress(). A
+    status line with rows/s and an ETA is printed every `status_interval`
+    seconds, and the same figures can be written as a Prometheus textfile
+    (for node_exporter's textfile collector) and/or appended as JSON lines.
+    """
+
+    # Upper bounds, in seconds, of the per-batch stage latency histograms
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    COUNTS = ('fetched', 'encrypted', 'skipped', 'errors')
+
+    def __init__(self, script, status_interval=10.0, textfile=None, jsonl=None):
+        super().__init__()
+        self.script = script
+        self.status_interval = status_interval
+        self.textfile = textfile
+        self.jsonl = jsonl
+        self.started = time.time()
+        self.histograms = {}
+        self.tables = {}
+        self._last_report = time.monotonic()
+
+    def _observe(self, name, seconds):
+        super()._observe(name, seconds)
+        with self._lock:
+            histogram = self.histograms.setdefault(name, {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def start_table(self, table, column, start_id, end_id):
+        """Begin tracking one scan; progress is measured over the Id range (start_id, end_id]"""
+        with self._lock:
+            self.tables[f"{table}.{column}"] = {
+                'table': table, 'column': column, 'start_id': start_id, 'end_id': end_id or 0,
+                'last_id': start_id, 'batches': 0, 'started': time.monotonic(), 'seconds': 0.0,
+                'complete': False, **{name: 0 for name in self.COUNTS},
+            }
+
+    def progress(self, table, column, last_id, **counts):
+        """Record a committed batch with the scan's cumulative counts"""
+        with self._lock:
+            entry = self.tables[f"{table}.{column}"]
+            entry['last_id'] = last_id
+            entry['batches'] += 1
+            entry['seconds'] = time.monotonic() - entry['started']
+            entry.update(counts)
+        self.report()
+
+    def finish_table(self, table, column):
+        with self._lock:
+            entry = self.tables[f"{table}.{column}"]
+            entry['complete'] = True
+            entry['last_id'] = max(entry['last_id'], entry['end_id'])
+            entry['seconds'] = time.monotonic() - entry['started']
+            finished = dict(entry)
+        if finished['batches']:
+            print(self.status_line(finished))
+        self.report(force=True)
+
+    @staticmethod
+    def _figures(entry):
+        span = entry['end_id'] - entry['start_id']
+        done = entry['last_id'] - entry['start_id']
+        ratio = 1.0 if entry['complete'] or span <= 0 else min(max(done / span, 0.0), 1.0)
+        seconds = entry['seconds']
+        rate = entry['encrypted'] / seconds if seconds > 0 else 0.0
+        eta = seconds * (1 - ratio) / ratio if 0 < ratio < 1 else (0.0 if ratio >= 1 else None)
+        return ratio, rate, eta
+
+    def status_line(self, entry):
+        ratio, rate, eta = self._figures(entry)
+        eta_text = f"ETA {eta:,.0f}s" if eta is not None else "ETA ?"
+        return (f"📊 {entry['table']}.{entry['column']}: {ratio:.0%} of Ids, {entry['encrypted']:,} encrypted "
+                f"({rate:,.0f} rows/s), {entry['skipped']:,} skipped, {entry['errors']:,} errors, "
+                f"{entry['batches']:,} batches, {eta_text}")
+
+    def report(self, force=False):
+        """Print status lines and refresh the sinks, at most once per status_interval unless forced"""
+        now = time.monotonic()
+        if not force and now - self._last_report < self.status_interval:
+            return
+        self._last_report = now
+        with self._lock:
+            entries = [dict(entry) for entry in self.tables.values() if not entry['complete']]
+            snapshot = self.snapshot()
+        if not force:
+            for entry in entries:
+                print(self.status_line(entry))
+        if self.textfile:
+            self.write_textfile(snapshot)
+        if self.jsonl:
+            with open(self.jsonl, 'a') as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+    def snapshot(self):
+        tables = []
+        for entry in self.tables.values():
+            ratio, rate, eta = self._figures(entry)
+            figures = dict(progress=round(ratio, 4), rows_per_second=round(rate, 1),
+                           eta_seconds=None if eta is None else round(eta, 1))
+            tables.append(dict({k: v for k, v in entry.items() if k != 'started'}, **figures))
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'script': self.script,
+            'elapsed_seconds': round(time.time() - self.started, 3),
+            'tables': tables,
+            'stages': {name: dict(h, buckets=dict(zip(map(str, self.BUCKETS), h['buckets'])))
+                       for name, h in self.histograms.items()},
+        }
+
+    def write_textfile(self, snapshot):
+        """Write the Prometheus text exposition format atomically"""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP pii_migration_{name} {help_text}")
+            lines.append(f"# TYPE pii_migration_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in dict(script=self.script, **labels).items())
+                lines.append(f"pii_migration_{name}{suffix}{{{label_text}}} {value}")
+
+        tables = snapshot['tables']
+        metric('rows_total', 'counter', "Rows handled by the PII migration, by result",
+               [('', dict(table=e['table'], column=e['column'], result=name), e[name])
+                for e in tables for name in self.COUNTS])
+        for name, kind, key, help_text in (
+                ('batches_total', 'counter', 'batches', "Committed batches"),
+                ('progress_ratio', 'gauge', 'progress', "Share of the Id range scanned"),
+                ('rows_per_second', 'gauge', 'rows_per_second', "Encrypted rows per second"),
+                ('eta_seconds', 'gauge', 'eta_seconds', "Estimated seconds until the scan finishes")):
+            metric(name, kind, help_text,
+                   [('', dict(table=e['table'], column=e['column']), e[key]) for e in tables if e[key] is not None])
+
+        samples = []
+        for stage, histogram in snapshot['stages'].items():
+            # Bucket counts are cumulative already: an observation counts under every bound it fits
+            samples.extend(('_bucket', dict(stage=stage, le=bound), count)
+                           for bound, count in histogram['buckets'].items())
+            samples.append(('_bucket', dict(stage=stage, le='+Inf'), histogram['count']))
+            samples.append(('_sum', dict(stage=stage), f"{histogram['sum']:.6f}"))
+            samples.append(('_count', dict(stage=stage), histogram['count']))
+        metric('stage_seconds', 'histogram', "Time per batch spent fetching, encrypting and writing", samples)
+        metric('last_update_timestamp_seconds', 'gauge', "When these metrics were written",
+               [('', {}, f"{time.time():.3f}")])
+
+        tmp_path = f"{self.textfile}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.textfile)
+
+
+def make_metrics(args, script):
+    return MigrationMetrics(script, args.status_interval, args.metrics_textfile, args.metrics_jsonl)
+
+
+class SamplingProfiler:
+    """Samples the Python stack of every thread of this process at a fixed interval.
+
+    Unlike cProfile it sees all --parallel-tables threads and adds almost no
+    overhead per call. Stacks are written in the folded format read by
+    flamegraph.pl, speedscope and inferno: "thread;outer;...;inner count".
+    """
+
+    def __init__(self, interval=DEFAULT_PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stack = ";".join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def write_stage_timings(path, timer, wall_seconds):
+    """Write the wall time of every named stage (and table, for MigrationMetrics) as JSON"""
+    stages = dict(timer.seconds) if timer is not None else {}
+    timings = {
+        'wall_seconds': round(wall_seconds, 6),
+        # Summed over threads, so with --parallel-tables this can exceed the wall time
+        'stage_seconds': {name: round(seconds, 6) for name, seconds in sorted(stages.items())},
+        'outside_stages_seconds': round(max(wall_seconds - sum(stages.values()), 0.0), 6),
+    }
+    if isinstance(timer, MigrationMetrics):
+        timings['batches'] = {name: h['count'] for name, h in timer.histograms.items()}
+        timings['table_seconds'] = {name: round(entry['seconds'], 6) for name, entry in timer.tables.items()}
+    with open(path, 'w') as f:
+        json.dump(timings, f, indent=2)
+        f.write("\n")
+
+
+@contextlib.contextmanager
+def profiled(args, timer=None):
+    """Run the body under --profile, then write the profile and the stage timings of `timer`.
+
+    cProfile (the default) writes a pstats file: python3 -m pstats PATH, or
+    snakeviz. It only sees the calling thread, and time spent in --workers
+    processes shows up as waiting; profile with --workers 1 to see the AES,
+    base64 and strptime calls themselves. --profile-mode sample writes
+    folded stacks of all threads for a flame graph instead.
+    """
+    if not args.profile:
+        yield
+        return
+    if args.profile_mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = SamplingProfiler(args.profile_interval)
+        profiler.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - started
+        if args.profile_mode == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"🔬 cProfile stats written to {args.profile} (python3 -m pstats {args.profile})")
+        else:
+            profiler.stop()
+            profiler.write(args.profile)
+            print(f"🔬 {profiler.samples} stack samples written to {args.profile} (flamegraph.pl / speedscope)")
+        stages_path = f"{args.profile}.stages.json"
+        write_stage_timings(stages_path, timer, wall_seconds)
+        print(f"🔬 Stage timings written to {stages_path}")
+
+
+def format_filter_report(table, candidates, fetched, client_skipped):
+    """Summarise how many rows were filtered by the database versus in Python"""
+    return (f"{table}: {candidates} non-empty rows, {candidates - fetched} filtered server-side, "
+            f"{fetched} transferred, {client_skipped} skipped client-side")
+
+
+def format_rate(rows, seconds):
+    """Format a throughput figure for the end-of-table summary"""
+    rate = rows / seconds if seconds > 0 else 0.0
+    return f"{rows} rows in {seconds:.2f}s ({rate:,.0f} rows/s)"
+
+
+def add_stream_arguments(parser):
+    """Add the read and write options shared by the migration scripts"""
+    parser.add_argument('--stream', choices=STREAM_MODES, default='keyset',
+                        help="How rows are read: keyset pagination (default), "
+                             "an unbuffered server-side cursor, or the legacy fetch-all")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Rows per read batch and per committed write batch "
+                             f"(default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--no-sql-filter', dest='sql_filter', action='store_false',
+                        help="Transfer every non-empty row and classify plain text in Python only")
+    parser.add_argument('--write-strategy', choices=WRITE_STRATEGIES, default='case',
+                        help="How encrypted values are written back: one multi-row "
+                             "CASE UPDATE per batch (default), executemany, one UPDATE per row, "
+                             "or a temporary staging table applied with one UPDATE ... JOIN per batch")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Encryption processes; batches are encrypted in parallel "
+                             "and written back in order (default: 1, no pool)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Read, encrypt and write on separate threads and connections, so the "
+                             "next batch is fetched while the previous one is written")
+    parser.add_argument('--pipeline-depth', type=int, default=DEFAULT_PIPELINE_DEPTH,
+                        help=f"Batches queued between --pipeline stages (default: {DEFAULT_PIPELINE_DEPTH})")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_FILE, metavar='PATH',
+                        help="State file recording the last committed Id per table and column "
+                             f"(default: {DEFAULT_CHECKPOINT_FILE}; empty string disables)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue from the checkpoint instead of starting at the first row")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Per-process LRU of plain text -> ciphertext; 0 disables "
+                             f"(default: {DEFAULT_CACHE_SIZE})")
+
+    progress = parser.add_argument_group('progress and metrics')
+    progress.add_argument('--status-interval', type=float, default=10, metavar='SECONDS',
+                          help="Seconds between progress lines with rows/s and ETA (default: 10)")
+    progress.add_argument('--metrics-textfile', metavar='PATH',
+                          help="Write Prometheus metrics here, e.g. into node_exporter's textfile directory")
+    progress.add_argument('--metrics-jsonl', metavar='PATH',
+                          help="Append a JSON snapshot of the metrics here at every progress line")
+    progress.add_argument('--verbose', action='store_true', help="Print a line for every row")
+
+    incremental = parser.add_argument_group('incremental mode (only rows written since the last pass)')
+    incremental.add_argument('--incremental', action='store_true',
+                             help="Start from the high-water mark stored in --checkpoint by the "
+                                  "previous --incremental pass instead of scanning the whole table")
+    incremental.add_argument('--poll', type=float, metavar='SECONDS',
+                             help="Keep running incremental passes this many seconds apart")
+    incremental.add_argument('--watermark-column', action='append', default=[], metavar='TABLE=COLUMN',
+                             help="Use an indexed timestamp (e.g. UserRequests=UpdatedAt) instead "
+                                  "of Id as TABLE's watermark, to also catch updated rows; repeatable")
+    incremental.add_argument('--rewind', type=int, default=DEFAULT_REWIND,
+                             help="Re-check this many Ids (or seconds, for a timestamp watermark) "
+                                  f"before the watermark (default: {DEFAULT_REWIND})")
+
+    profiling = parser.add_argument_group('profiling')
+    profiling.add_argument('--profile', metavar='PATH',
+                           help="Profile the run into PATH and write wall time per stage to PATH.stages.json")
+    profiling.add_argument('--profile-mode', choices=('cprofile', 'sample'), default='cprofile',
+                           help="cprofile: pstats file of the main thread (default); sample: folded "
+                                "stacks of all threads for a flame graph")
+    profiling.add_argument('--profile-interval', type=float, default=DEFAULT_PROFILE_INTERVAL, metavar='SECONDS',
+                           help=f"Sampling interval of --profile-mode sample (default: {DEFAULT_PROFILE_INTERVAL})")
+
+    online = parser.add_argument_group('online mode (live production database)')
+    online.add_argument('--online', action='store_true',
+                        help="Throttle the migration: adaptive batch size (up to --batch-size), "
+                             "a pause between batches, and holds while the database is busy")
+    online.add_argument('--target-latency-ms', type=float, default=200,
+                        help="Write latency per batch to aim for (default: 200)")
+    online.add_argument('--min-batch-size', type=int, default=50,
+                        help="Smallest batch the throttle shrinks to (default: 50)")
+    online.add_argument('--pause-ms', type=float, default=100,
+                        help="Sleep between batches (default: 100)")
+    online.add_argument('--max-threads-running', type=int, default=32,
+                        help="Hold while Threads_running is above this (default: 32)")
+    online.add_argument('--max-lock-waits', type=int, default=5,
+                        help="Hold while Innodb_row_lock_current_waits is above this (default: 5)")
+    online.add_argument('--replica', metavar='HOST[:PORT]',
+                        help="Replica to watch for lag, using the same credentials")
+    online.add_argument('--max-replica-lag', type=float, default=5,
+                        help="Hold while replica lag in seconds is above this (default: 5)")
+    online.add_argument('--load-check-interval', type=float, default=5,
+                        help="Seconds between load checks while held (default: 5)")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Re-encrypt DateOfBirthEncrypted / MobilePhoneEncrypted data from the current
+PiiEncryption:Key to a new key.
+
+Keys are derived exactly like PiiEncryptionService.cs (SHA256 key, fixed IV
+from SHA256(key + "IV")). Rows are streamed in Id order, decrypted with the old
+key and encrypted with the new one across --workers processes, and every new
+ciphertext is decrypted again and compared before it is written. Writes are
+guarded, so a row the application changed in the meantime is left alone, and
+each committed batch is checkpointed so --resume continues an interrupted run.
+
+The new key is read from an environment variable or a file, never from the
+command line:
+
+    PII_NEW_ENCRYPTION_KEY=... python3 rotate-pii-key.py /opt/mental-health-app/server/appsettings.Production.json
+
+Rows that are still plain text are not touched; run the encryption scripts for
+those. Deploy the new key to the application as soon as the rotation finishes.
+MobilePhoneBlindIndex is keyed by PiiEncryption:BlindIndexKey, not by the
+encryption key, so it stays valid and is left alone.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+try:
+    import pymysql
+except ImportError:
+    print("❌ Error: pymysql not installed. Install with: apt-get install python3-pymysql")
+    sys.exit(1)
+
+import pii_crypto
+import pii_migration
+
+TABLES = ('Users', 'UserRequests')
+COLUMNS = ('DateOfBirthEncrypted', 'MobilePhoneEncrypted')
+
+ALREADY_ROTATED = 'already encrypted with the new key'
+
+# Per-process state, set by _init_rekey_worker
+_old_cipher = None
+_new_cipher = None
+_column = None
+
+
+def _init_rekey_worker(old_key, old_iv, new_key, new_iv, column, cache_size):
+    global _old_cipher, _new_cipher, _column
+    _old_cipher = pii_crypto.FixedIvEncryptor(old_key, old_iv)
+    _new_cipher = pii_crypto.FixedIvEncryptor(new_key, new_iv, cache_size)
+    _column = column
+
+
+def _try_decrypt(cipher, values):
+    """Decrypt a batch, with None for values that don't decrypt to plausible plain text"""
+    return [plain_text if plain_text is not None and pii_migration.plausible_plain_text(_column, plain_text)
+            else None
+            for plain_text in cipher.decrypt_batch(values)]
+
+
+def _rekey_chunk(rows):
+    """Re-encrypt (Id, value) rows, returning (Id, new value or None, error or None)"""
+    values = [value for _, value in rows]
+    plain_texts = _try_decrypt(_old_cipher, values)
+    # Values the old key can't read may have been rotated already
+    on_new_key = iter(_try_decrypt(_new_cipher, [v for v, p in zip(values, plain_texts) if p is None]))
+    new_values = _new_cipher.encrypt_batch([p for p in plain_texts if p is not None])
+    # Round-trip check before anything is written
+    round_trips = iter(zip(new_values, _new_cipher.decrypt_batch(new_values)))
+
+    results = []
+    for (row_id, _), plain_text in zip(rows, plain_texts):
+        if plain_text is None:
+            if next(on_new_key) is not None:
+                results.append((row_id, None, ALREADY_ROTATED))
+            else:
+                results.append((row_id, None, 'does not decrypt with the old or the new key'))
+            continue
+        new_value, round_trip = next(round_trips)
+        if round_trip != plain_text:
+            results.append((row_id, None, 'round-trip verification failed'))
+            continue
+        results.append((row_id, new_value, None))
+    return results
+
+
+def rotate_column(conn, read_conn, checkpoint, table, column, old, new, args, throttle=None):
+    """Re-encrypt one column of one table, batch by batch"""
+    rotated_count = 0
+    already_count = 0
+    error_count = 0
+    started = time.perf_counter()
+
+    start_id = pii_migration.resume_point(checkpoint, table, column, args.resume)
+    if start_id is None:
+        print(f"  ⏭  {table}.{column} already rotated according to {args.checkpoint}")
+        return 0, 0, 0
+    if start_id:
+        print(f"  ↪  Resuming {table}.{column} after Id {start_id}")
+
+    writer = pii_migration.BatchWriter(conn, table, column, strategy=args.write_strategy,
+                                       batch_size=args.batch_size, guarded=True)
+    # Only values shaped like ciphertext; plain text is left for the encryption scripts
+    batches = pii_migration.iter_batches(
+        read_conn, table, column, pii_migration.ciphertext_predicate(column),
+        batch_size=throttle or args.batch_size, mode=args.stream, start_id=start_id
+    )
+    # The batch itself is the context, so the writer can guard on the old values
+    chunks = ((batch, batch) for batch in batches)
+
+    for batch, results in pii_migration.process_chunks(
+            chunks, _rekey_chunk, _init_rekey_worker,
+            old + new + (column, args.cache_size), args.workers):
+        originals = dict(batch)
+        updates = []
+        for row_id, new_value, error in results:
+            if new_value:
+                updates.append((row_id, new_value, originals[row_id]))
+            elif error == ALREADY_ROTATED:
+                already_count += 1
+            else:
+                print(f"  ❌ {table} {row_id} ({column}): {error}", file=sys.stderr)
+                error_count += 1
+        rotated_count += len(updates)
+
+        writer.write(updates)
+        checkpoint.record(table, column, batch[-1][0])
+        if throttle:
+            throttle.record(writer.last_write_seconds)
+            throttle.wait()
+
+    checkpoint.complete(table, column)
+    elapsed = time.perf_counter() - started
+    print(f"  ⏱  {table}.{column}: {pii_migration.format_rate(rotated_count, elapsed)}")
+    return rotated_count, already_count, error_count
+
+
+def read_new_key(args):
+    if args.new_key_file:
+        with open(args.new_key_file, 'r') as f:
+            return f.read().strip()
+    return os.environ.get(args.new_key_env, '')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-encrypt PII columns with a new encryption key")
+    parser.add_argument('config_file', help="Path to appsettings.Production.json (current key and database)")
+    parser.add_argument('--new-key-env', default='PII_NEW_ENCRYPTION_KEY',
+                        help="Environment variable holding the new key (default: PII_NEW_ENCRYPTION_KEY)")
+    parser.add_argument('--new-key-file', help="File holding the new key instead of the environment")
+    parser.add_argument('--tables', default=','.join(TABLES),
+                        help=f"Comma-separated tables (default: {','.join(TABLES)})")
+    parser.add_argument('--columns', default=','.join(COLUMNS),
+                        help=f"Comma-separated columns (default: {','.join(COLUMNS)})")
+    pii_migration.add_stream_arguments(parser)
+    args = parser.parse_args()
+    # Rotation is one sequential pass from the --resume point over rows already encrypted
+    pii_migration.reject_arguments(parser, args, ('incremental', 'poll', 'watermark_column', 'rewind',
+                                                  'pipeline', 'pipeline_depth'))
+    pii_migration.check_arguments(parser, args)
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 50)
+    print("PII Key Rotation")
+    print("=" * 50)
+
+    config = pii_migration.read_appsettings(args.config_file)
+    old_key_text = pii_migration.encryption_key_from_appsettings(config)
+    new_key_text = read_new_key(args)
+    if not new_key_text:
+        print(f"❌ No new key: set {args.new_key_env} or pass --new-key-file", file=sys.stderr)
+        sys.exit(1)
+    if new_key_text == old_key_text:
+        print("❌ The new key is the same as the current key", file=sys.stderr)
+        sys.exit(1)
+
+    old = pii_crypto.derive_key_and_iv(old_key_text)
+    new = pii_crypto.derive_key_and_iv(new_key_text)
+    pii_crypto.self_test()
+    new_fingerprint = pii_migration.key_fingerprint(*new).hex()
+    print(f"✅ Rotating to key fingerprint {new_fingerprint}")
+
+    db_config = pii_migration.db_config_from_appsettings(config)
+    try:
+        conn = pymysql.connect(**db_config)
+        read_conn = pymysql.connect(**db_config) if args.stream == 'server' else conn
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # Progress is tracked per target key, so a later rotation starts fresh
+    checkpoint = pii_migration.Checkpoint(
+        args.checkpoint, f"{db_config['database']}:rotate:{new_fingerprint}"
+    )
+    throttle = pii_migration.make_throttle(args, conn, db_config)
+
+    totals = [0, 0, 0]
+    try:
+        with pii_migration.profiled(args):
+            for table in args.tables.split(','):
+                for column in args.columns.split(','):
+                    print(f"\nRotating {table}.{column}...")
+                    counts = rotate_column(conn, read_conn, checkpoint, table, column, old, new, args, throttle)
+                    print(f"  ✅ {counts[0]} rotated, {counts[1]} already on the new key, {counts[2]} errors")
+                    totals = [t + c for t, c in zip(totals, counts)]
+    except Exception as e:
+        print(f"❌ Rotation stopped: {e}", file=sys.stderr)
+        print("   Re-run with --resume to continue after the last committed batch.", file=sys.stderr)
+        conn.rollback()
+        sys.exit(1)
+    finally:
+        if read_conn is not conn:
+            read_conn.close()
+        conn.close()
+
+    print()
+    print("=" * 50)
+    print(f"✅ Rotation complete: {totals[0]} rotated, {totals[1]} already rotated, {totals[2]} errors")
+    print("   Update PiiEncryption:Key to the new key and restart the application.")
+    print("=" * 50)
+    if totals[2]:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
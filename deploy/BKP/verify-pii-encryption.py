@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Verify that DateOfBirthEncrypted / MobilePhoneEncrypted values decrypt with the
+production PiiEncryption:Key.
+
+PiiEncryptionService.Decrypt returns its input unchanged when decryption fails,
+so a bad row looks fine in the application. This script splits each table into
+Id ranges of --chunk-size and checks the ranges in parallel across --workers
+processes, each with its own database connection. Every value is classified as
+encrypted, still plain text, or failed (ciphertext-shaped but not decryptable
+with the key), and failures are listed per range.
+
+Each range also gets an aggregate checksum computed by the database
+(COUNT(*) and BIT_XOR(CRC32(CONCAT(Id, ':', value)))), so two runs or two
+databases can be compared without transferring the rows:
+
+  --manifest PATH        save the checksums of this run
+  --compare PATH         compare against a saved manifest
+  --compare-config PATH  compare against the database of another appsettings file
+  --checksum-only        checksums only, no decryption
+
+When comparing, only the ranges whose checksums differ are fetched in full and
+verified (and diffed row by row against the other database).
+
+Exit code 0 when everything checks out, 2 on failures or mismatches.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import pymysql
+except ImportError:
+    print("❌ Error: pymysql not installed. Install with: apt-get install python3-pymysql")
+    sys.exit(1)
+
+import pii_crypto
+import pii_migration
+
+TABLES = ('Users', 'UserRequests')
+COLUMNS = ('DateOfBirthEncrypted', 'MobilePhoneEncrypted')
+DEFAULT_CHUNK_SIZE = 50000
+MAX_LISTED_IDS = 20
+MANIFEST_VERSION = 1
+
+
+# Per-process state, set by _init_verify_worker
+_db_configs = None
+_connections = {}
+_decryptor = None
+_columns = None
+
+
+def _init_verify_worker(db_configs, key, iv, columns):
+    global _db_configs, _decryptor, _columns
+    _db_configs = db_configs
+    _decryptor = pii_crypto.FixedIvEncryptor(key, iv)
+    _columns = columns
+    _connections.clear()
+
+
+def _connection(side):
+    """One autocommit connection per database and process, opened on first use"""
+    if side not in _connections:
+        _connections[side] = pymysql.connect(autocommit=True, **_db_configs[side])
+    return _connections[side]
+
+
+def _checksum(cursor, table, lo, hi):
+    checksums = ", ".join(
+        f"COALESCE(BIT_XOR(CRC32(CONCAT(Id, ':', COALESCE({column}, '')))), 0)"
+        for column in _columns
+    )
+    cursor.execute(f"SELECT COUNT(*), {checksums} FROM {table} WHERE Id >= %s AND Id < %s", (lo, hi))
+    row = cursor.fetchone()
+    return {'rows': int(row[0]), 'checksums': {c: int(v) for c, v in zip(_columns, row[1:])}}
+
+
+def _classify(column, values):
+    """'empty', 'plain', 'encrypted' or 'failed' for each stored value of one column"""
+    statuses = []
+    ciphertexts = []
+    for value in values:
+        if value is None or value == '':
+            statuses.append('empty')
+        elif not pii_migration.looks_like_ciphertext(value):
+            statuses.append('plain')
+        else:
+            statuses.append(None)
+            ciphertexts.append(value)
+    decrypted = iter(_decryptor.decrypt_batch(ciphertexts))
+    for i, status in enumerate(statuses):
+        if status is None:
+            plain_text = next(decrypted)
+            plausible = plain_text is not None and pii_migration.plausible_plain_text(column, plain_text)
+            statuses[i] = 'encrypted' if plausible else 'failed'
+    return statuses
+
+
+def _verify_chunk(task):
+    """Checksum one Id range and, unless only checksums were asked for, decrypt it.
+
+    `task` is (side, table, lo, hi, mode); mode 'rows' also returns the raw
+    rows so the range can be diffed against the other database.
+    """
+    side, table, lo, hi, mode = task
+    result = {'table': table, 'lo': lo, 'hi': hi}
+    with _connection(side).cursor() as cursor:
+        result.update(_checksum(cursor, table, lo, hi))
+        if mode == 'checksum':
+            return result
+
+        cursor.execute(
+            f"SELECT Id, {', '.join(_columns)} FROM {table} WHERE Id >= %s AND Id < %s ORDER BY Id",
+            (lo, hi)
+        )
+        rows = cursor.fetchall()
+
+    counts = {column: {'encrypted': 0, 'plain': 0, 'empty': 0, 'failed': 0} for column in _columns}
+    failed_ids = {column: [] for column in _columns}
+    for n, column in enumerate(_columns, 1):
+        for row, status in zip(rows, _classify(column, [row[n] for row in rows])):
+            counts[column][status] += 1
+            if status == 'failed':
+                failed_ids[column].append(row[0])
+    result['counts'] = counts
+    result['failed_ids'] = failed_ids
+    if mode == 'rows':
+        result['values'] = {row[0]: tuple(row[1:]) for row in rows}
+    return result
+
+
+def run_tasks(tasks, db_configs, key, iv, columns, workers):
+    """Yield results for (side, table, lo, hi, mode) tasks in order"""
+    chunks = ((task, task) for task in tasks)
+    for _, result in pii_migration.process_chunks(
+            chunks, _verify_chunk, _init_verify_worker, (db_configs, key, iv, columns), workers):
+        yield result
+
+
+def chunk_key(result):
+    return str(result['lo'])
+
+
+def diff_rows(ours, theirs):
+    """Ids whose values differ between the two databases within one range"""
+    changed = [row_id for row_id in ours if row_id in theirs and ours[row_id] != theirs[row_id]]
+    only_ours = [row_id for row_id in ours if row_id not in theirs]
+    only_theirs = [row_id for row_id in theirs if row_id not in ours]
+    return changed, only_ours, only_theirs
+
+
+def format_ids(ids):
+    listed = ', '.join(str(row_id) for row_id in ids[:MAX_LISTED_IDS])
+    if len(ids) > MAX_LISTED_IDS:
+        listed += f", ... ({len(ids)} total)"
+    return listed
+
+
+class Report:
+    """Totals per table and column, plus the checksums saved to the manifest"""
+
+    def __init__(self):
+        self.counts = {}
+        self.failures = 0
+        self.mismatches = 0
+        self.chunks = {}
+
+    def add(self, result):
+        table = result['table']
+        self.chunks.setdefault(table, {})[chunk_key(result)] = {
+            'hi': result['hi'], 'rows': result['rows'], 'checksums': result['checksums'],
+        }
+        for column, counts in result.get('counts', {}).items():
+            totals = self.counts.setdefault(f"{table}.{column}", {})
+            for status, count in counts.items():
+                totals[status] = totals.get(status, 0) + count
+        for column, ids in result.get('failed_ids', {}).items():
+            if ids:
+                self.failures += len(ids)
+                print(f"  ❌ {table} Id {result['lo']}-{result['hi'] - 1}: "
+                      f"{len(ids)} {column} values do not decrypt: {format_ids(ids)}")
+
+
+def compare_checksums(ours, theirs):
+    """Range start Ids whose row count or checksums differ"""
+    empty = {'rows': 0, 'checksums': {}}
+    mismatched = []
+    for lo in sorted(set(ours) | set(theirs), key=int):
+        a, b = ours.get(lo, empty), theirs.get(lo, empty)
+        columns = set(a['checksums']) | set(b['checksums'])
+        if a['rows'] != b['rows'] or any(a['checksums'].get(c, 0) != b['checksums'].get(c, 0) for c in columns):
+            mismatched.append(int(lo))
+    return mismatched
+
+
+def load_manifest(path, key, iv, chunk_size):
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise RuntimeError(f"{path} is not a version {MANIFEST_VERSION} manifest")
+    if manifest['chunk_size'] != chunk_size:
+        raise RuntimeError(f"{path} was made with --chunk-size {manifest['chunk_size']}")
+    if manifest['key_fingerprint'] != pii_migration.key_fingerprint(key, iv).hex():
+        print("⚠️  The manifest was made with a different key; every range will differ")
+    return manifest
+
+
+def save_manifest(path, report, database, key, iv, chunk_size, columns):
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'database': database,
+        'key_fingerprint': pii_migration.key_fingerprint(key, iv).hex(),
+        'chunk_size': chunk_size,
+        'columns': list(columns),
+        'tables': report.chunks,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify that PII columns decrypt with the production key")
+    parser.add_argument('config_file', help="Path to appsettings.Production.json")
+    parser.add_argument('--tables', default=','.join(TABLES),
+                        help=f"Comma-separated tables (default: {','.join(TABLES)})")
+    parser.add_argument('--columns', default=','.join(COLUMNS),
+                        help=f"Comma-separated columns (default: {','.join(COLUMNS)})")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Width of each Id range (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Processes, each with its own connection (default: CPU count)")
+    parser.add_argument('--checksum-only', action='store_true',
+                        help="Only compute range checksums, don't decrypt")
+    parser.add_argument('--manifest', metavar='PATH', help="Save this run's range checksums here")
+    compare = parser.add_mutually_exclusive_group()
+    compare.add_argument('--compare', metavar='MANIFEST', help="Compare against a saved manifest")
+    compare.add_argument('--compare-config', metavar='PATH',
+                         help="Compare against the database of another appsettings file")
+    args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    return args
+
+
+def main():
+    args = parse_args()
+    tables = args.tables.split(',')
+    columns = tuple(args.columns.split(','))
+
+    print("=" * 50)
+    print("PII Encryption Verification")
+    print("=" * 50)
+
+    config = pii_migration.read_appsettings(args.config_file)
+    key, iv = pii_crypto.derive_key_and_iv(pii_migration.encryption_key_from_appsettings(config))
+    db_configs = {'primary': pii_migration.db_config_from_appsettings(config)}
+    if args.compare_config:
+        other = pii_migration.read_appsettings(args.compare_config)
+        db_configs['other'] = pii_migration.db_config_from_appsettings(other)
+
+    manifest = None
+    if args.compare:
+        manifest = load_manifest(args.compare, key, iv, args.chunk_size)
+
+    try:
+        conn = pymysql.connect(**db_configs['primary'])
+        ranges = {table: pii_migration.id_ranges(conn, table, args.chunk_size) for table in tables}
+        if args.compare_config:
+            other_conn = pymysql.connect(**db_configs['other'])
+            for table in tables:
+                # Cover the Ids of both databases
+                other_ranges = pii_migration.id_ranges(other_conn, table, args.chunk_size)
+                ranges[table] = sorted(set(ranges[table]) | set(other_ranges))
+            other_conn.close()
+        conn.close()
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    comparing = manifest is not None or args.compare_config
+    first_mode = 'checksum' if args.checksum_only or comparing else 'verify'
+    report = Report()
+    started = time.perf_counter()
+
+    tasks = [('primary', table, lo, hi, first_mode) for table in tables for lo, hi in ranges[table]]
+    print(f"Checking {len(tasks)} ranges of {args.chunk_size} Ids with {args.workers} workers...")
+    for result in run_tasks(tasks, db_configs, key, iv, columns, args.workers):
+        report.add(result)
+
+    if comparing:
+        if manifest is not None:
+            theirs = manifest['tables']
+        else:
+            other_tasks = [('other', table, lo, hi, 'checksum') for table in tables for lo, hi in ranges[table]]
+            other_report = Report()
+            for result in run_tasks(other_tasks, db_configs, key, iv, columns, args.workers):
+                other_report.add(result)
+            theirs = other_report.chunks
+
+        mismatched = []
+        for table in tables:
+            for lo in compare_checksums(report.chunks.get(table, {}), theirs.get(table, {})):
+                mismatched.append((table, lo, lo + args.chunk_size))
+        report.mismatches = len(mismatched)
+        print(f"🔎 {len(mismatched)} of {len(tasks)} ranges differ")
+
+        # Only the differing ranges are fetched in full
+        if mismatched and not args.checksum_only:
+            mode = 'rows' if args.compare_config else 'verify'
+            fetched = [('primary', table, lo, hi, mode) for table, lo, hi in mismatched]
+            if args.compare_config:
+                fetched += [('other', table, lo, hi, 'rows') for table, lo, hi in mismatched]
+            results = list(run_tasks(fetched, db_configs, key, iv, columns, args.workers))
+            ours, others = results[:len(mismatched)], results[len(mismatched):]
+            for i, result in enumerate(ours):
+                report.add(result)
+                if others:
+                    changed, only_ours, only_theirs = diff_rows(result['values'], others[i]['values'])
+                    span = f"{result['table']} Id {result['lo']}-{result['hi'] - 1}"
+                    if changed:
+                        print(f"  ≠ {span}: {len(changed)} rows differ: {format_ids(changed)}")
+                    if only_ours:
+                        print(f"  + {span}: {len(only_ours)} rows only here: {format_ids(only_ours)}")
+                    if only_theirs:
+                        print(f"  - {span}: {len(only_theirs)} rows only in the other database: "
+                              f"{format_ids(only_theirs)}")
+        else:
+            for table, lo, hi in mismatched:
+                print(f"  ≠ {table} Id {lo}-{hi - 1}")
+
+    elapsed = time.perf_counter() - started
+
+    if args.manifest:
+        save_manifest(args.manifest, report, db_configs['primary']['database'], key, iv,
+                      args.chunk_size, columns)
+        print(f"✅ Checksums saved to {args.manifest}")
+
+    print()
+    for name, counts in report.counts.items():
+        print(f"  {name}: {counts['encrypted']} encrypted, {counts['plain']} plain text, "
+              f"{counts['empty']} empty, {counts['failed']} failed")
+    print("=" * 50)
+    status = "❌" if report.failures or report.mismatches else "✅"
+    print(f"{status} {report.failures} values failed to decrypt, {report.mismatches} ranges differ "
+          f"({elapsed:.1f}s)")
+    print("=" * 50)
+    if report.failures or report.mismatches:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
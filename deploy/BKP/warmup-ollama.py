@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Warm up Ollama after a deploy so the first clinical AI request doesn't pay
+the model load.
+
+Reads Ollama:BaseUrl and the model names (Ollama:Model, plus an optional
+Ollama:Models list) from appsettings.Production.json, asks Ollama to load
+every model at once with a keep_alive (Ollama:KeepAlive, default 30m), then
+sends each a tiny prompt until it answers within --max-latency. Exits
+non-zero if a model isn't ready within --timeout:
+
+    python3 warmup-ollama.py /opt/mental-health-app/server/appsettings.Production.json
+
+Models are loaded with the options the server sends. LlmClient and
+ChainedAIService send no num_ctx, so neither does this script: a request
+with another context size would load the model again.
+Try it against ollama_stub_server.py with --base-url http://127.0.0.1:11435.
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_FILE = "/opt/mental-health-app/server/appsettings.Production.json"
+
+# Same defaults as LlmClient
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_MODEL = "tinyllama:latest"
+DEFAULT_KEEP_ALIVE = "30m"
+
+PROBE_PROMPT = "Reply with OK."
+
+
+def read_config(config_file):
+    with open(config_file, 'r') as f:
+        return json.load(f)
+
+
+def configured_models(section):
+    """Ollama:Model followed by Ollama:Models, without duplicates"""
+    models = [section.get('Model') or DEFAULT_MODEL]
+    extra = section.get('Models') or []
+    if isinstance(extra, str):
+        extra = extra.split(',')
+    for model in extra:
+        model = model.strip()
+        if model and model not in models:
+            models.append(model)
+    return models
+
+
+def post_generate(base_url, body, timeout):
+    """Non-streamed /api/generate; returns (response JSON, seconds)"""
+    request = urllib.request.Request(f"{base_url}/api/generate", data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        result = json.loads(response.read())
+    if result.get('error'):
+        raise RuntimeError(result['error'])
+    return result, time.perf_counter() - started
+
+
+def warm_up(model, args):
+    """Load one model, then probe it until it is fast enough; returns its report"""
+    report = {'model': model, 'load_seconds': None, 'probes': 0, 'latency': None, 'ready': False, 'error': None}
+    deadline = time.monotonic() + args.timeout
+    try:
+        # A request without a prompt only loads the model and sets its keep_alive
+        _, report['load_seconds'] = post_generate(
+            args.base_url, {'model': model, 'keep_alive': args.keep_alive, 'stream': False}, args.timeout
+        )
+        while True:
+            report['probes'] += 1
+            _, report['latency'] = post_generate(args.base_url, {
+                'model': model, 'prompt': PROBE_PROMPT, 'keep_alive': args.keep_alive, 'stream': False,
+                'options': {'num_predict': 1},
+            }, max(deadline - time.monotonic(), 1.0))
+            if report['latency'] <= args.max_latency:
+                report['ready'] = True
+                return report
+            if time.monotonic() + args.interval >= deadline:
+                report['error'] = f"still {report['latency']:.2f}s after {args.timeout:g}s"
+                return report
+            time.sleep(args.interval)
+    except urllib.error.HTTPError as e:
+        report['error'] = f"HTTP {e.code}: {e.read().decode('utf-8', 'replace').strip() or e.reason}"
+    except (urllib.error.URLError, OSError, ValueError, RuntimeError) as e:
+        report['error'] = str(getattr(e, 'reason', e))
+    return report
+
+
+def resident_models(base_url, timeout):
+    """Names of the models Ollama has in memory (/api/ps), or None if it can't say"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/api/ps", timeout=timeout) as response:
+            return {model.get('name') for model in json.loads(response.read()).get('models', [])}
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Preload the configured Ollama models after a deploy")
+    parser.add_argument('config_file', nargs='?', default=CONFIG_FILE,
+                        help=f"appsettings file with the Ollama section (default: {CONFIG_FILE})")
+    parser.add_argument('--base-url', help="Ollama endpoint (default: Ollama:BaseUrl from the config)")
+    parser.add_argument('--model', dest='models', action='append',
+                        help="Model to warm up; repeatable (default: Ollama:Model and Ollama:Models)")
+    parser.add_argument('--keep-alive', help=f"How long Ollama keeps the models loaded "
+                                             f"(default: Ollama:KeepAlive or {DEFAULT_KEEP_ALIVE})")
+    parser.add_argument('--max-latency', type=float, default=2.0,
+                        help="A model is ready once a one-token reply takes at most this many seconds (default: 2)")
+    parser.add_argument('--timeout', type=float, default=300,
+                        help="Seconds each model has to become ready (default: 300)")
+    parser.add_argument('--interval', type=float, default=2.0, help="Seconds between probes (default: 2)")
+    args = parser.parse_args()
+    if args.max_latency <= 0 or args.timeout <= 0 or args.interval < 0:
+        parser.error("--max-latency and --timeout must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 50)
+    print("Ollama Warm-up")
+    print("=" * 50)
+
+    try:
+        section = read_config(args.config_file).get('Ollama', {})
+    except FileNotFoundError:
+        if not (args.base_url and args.models):
+            print(f"❌ Config file not found: {args.config_file}")
+            sys.exit(1)
+        section = {}
+    except json.JSONDecodeError as e:
+        print(f"❌ Invalid JSON in config file: {e}")
+        sys.exit(1)
+    args.base_url = (args.base_url or section.get('BaseUrl') or DEFAULT_BASE_URL).rstrip('/')
+    args.keep_alive = args.keep_alive or section.get('KeepAlive') or DEFAULT_KEEP_ALIVE
+    models = args.models or configured_models(section)
+
+    print(f"   Endpoint: {args.base_url}")
+    print(f"   Models: {', '.join(models)} (keep_alive {args.keep_alive})")
+    print()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        reports = list(pool.map(lambda model: warm_up(model, args), models))
+    elapsed = time.perf_counter() - started
+    resident = resident_models(args.base_url, 10)
+
+    for report in reports:
+        if report['ready']:
+            loaded = "" if resident is None or report['model'] in resident else " (not listed by /api/ps)"
+            print(f"✅ {report['model']}: loaded in {report['load_seconds']:.2f}s, "
+                  f"answers in {report['latency']:.2f}s after {report['probes']} probe(s){loaded}")
+        else:
+            load = f"loaded in {report['load_seconds']:.2f}s, " if report['load_seconds'] is not None else ""
+            print(f"❌ {report['model']}: {load}not ready: {report['error']}")
+    print()
+    ready = sum(1 for report in reports if report['ready'])
+    print(f"⏱  {ready} of {len(models)} model(s) ready in {elapsed:.1f}s")
+    print("=" * 50)
+    if ready < len(models):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
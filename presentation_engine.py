@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Markdown to PDF rendering shared by create_presentation.py and
+create_enhanced_presentation.py.
+
+The markdown is parsed once, line by line, into a flat list of block nodes
+(headings, paragraphs, lists with their items, code blocks, tables, quotes
+and rules). Each node kind is turned into ReportLab flowables by one
+handler in Renderer.handlers. Inline **bold**, *italic*, `code` and
+[links](url) are converted with a single regex pass per line. Both parsing
+and rendering are linear in the size of the document.
+
+What differs between presentations (files, margins, styles, section page
+breaks, a closing page) is a PresentationConfig.
+
+With a cache_dir, builds are incremental: every "## " section (which starts
+a new page anyway) is rendered to its own PDF fragment, named after a hash
+of its markdown, the styles and ENGINE_VERSION. Only new or changed
+sections are rendered again, and the fragments are merged with pypdf
+(optional; without it every build is a full one). With workers > 1 the
+sections that need rendering are laid out in a process pool; page numbers
+are stamped on the merged document, so they match a serial build.
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+import reportlab
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfgen import canvas as pdf_canvas
+from reportlab.platypus import PageBreak, Paragraph, Preformatted, SimpleDocTemplate, Spacer, Table, TableStyle
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# Part of every cached fragment's key: bump it when a change to this file changes the rendered output
+ENGINE_VERSION = 2
+
+# Style name -> (sample stylesheet parent, attributes); PresentationConfig.styles overrides attributes
+DEFAULT_STYLES = {
+    'title': ('Heading1', dict(fontSize=24, spaceAfter=30, alignment=TA_CENTER, textColor=colors.darkblue)),
+    'subtitle': ('Normal', dict(fontSize=16, leading=20, spaceAfter=20, alignment=TA_CENTER,
+                                textColor=colors.darkgreen, fontName='Helvetica-Oblique')),
+    'heading1': ('Heading1', dict(fontSize=18, spaceAfter=12, spaceBefore=20, textColor=colors.darkblue)),
+    'heading2': ('Heading2', dict(fontSize=14, spaceAfter=8, spaceBefore=12, textColor=colors.darkgreen)),
+    'heading3': ('Heading3', dict(fontSize=12, spaceAfter=6, spaceBefore=10, textColor=colors.darkred)),
+    'bullet': ('Normal', dict(fontSize=11, spaceAfter=6, leftIndent=20, bulletIndent=10)),
+    'normal': ('Normal', dict(fontSize=11, spaceAfter=6, alignment=TA_JUSTIFY)),
+    'quote': ('Normal', dict(fontSize=11, spaceAfter=6, leftIndent=20, textColor=colors.dimgrey,
+                             fontName='Helvetica-Oblique')),
+    'code': ('Code', dict(fontSize=9, leading=11, spaceAfter=6, leftIndent=20, fontName='Courier')),
+    'table_header': ('Normal', dict(fontSize=10, fontName='Helvetica-Bold', alignment=TA_LEFT)),
+    'table_cell': ('Normal', dict(fontSize=10, alignment=TA_LEFT)),
+}
+
+TABLE_ALIGNMENTS = {'LEFT': TA_LEFT, 'CENTER': TA_CENTER, 'RIGHT': TA_RIGHT}
+
+# Markdown heading level -> style; deeper headings use the last one
+HEADING_STYLES = ('title', 'heading1', 'heading2', 'heading3')
+
+# Extra indent per nesting level of a list
+LIST_INDENT = 15
+
+
+class PresentationConfig:
+    """Everything a presentation script chooses; the engine supplies the rest"""
+
+    def __init__(self, source, output, pagesize=A4, margins=(72, 72, 72, 72), styles=None,
+                 section_page_break=True, strip_bullet_emoji=True, bold_leading_emoji=False,
+                 bold_line_style='normal', skip_prefixes=(), closing=None, cache_dir=None, workers=1,
+                 page_numbers=False):
+        self.source = source
+        self.output = output
+        self.pagesize = pagesize
+        # (left, right, top, bottom) in points
+        self.margins = margins
+        # {style name: {attribute: value}} on top of DEFAULT_STYLES
+        self.styles = styles or {}
+        # Start every "## " section on a new page
+        self.section_page_break = section_page_break
+        # Helvetica has no emoji glyphs: drop them from the start of list items...
+        self.strip_bullet_emoji = strip_bullet_emoji
+        # ...or keep them in bold at the start of paragraphs
+        self.bold_leading_emoji = bold_leading_emoji
+        # Style of a paragraph that is bold as a whole ("**...**")
+        self.bold_line_style = bold_line_style
+        # Paragraphs starting with one of these (in markdown) are left out
+        self.skip_prefixes = tuple(skip_prefixes)
+        # Callable(styles) -> flowables appended after the document
+        self.closing = closing
+        # Directory for per-section PDF fragments; None renders everything on every build
+        self.cache_dir = cache_dir
+        # Processes that lay out sections; more than one needs pypdf and section page breaks
+        self.workers = max(1, workers)
+        # Number every page in the bottom margin
+        self.page_numbers = page_numbers
+
+
+class Node:
+    """One block of the parsed document.
+
+    `children` holds the items of a list (nodes of kind 'item'), the lines of
+    a code block or the rows of a table (lists of cell strings, header first).
+    """
+
+    __slots__ = ('kind', 'text', 'level', 'children', 'info')
+
+    def __init__(self, kind, text='', level=0, children=None, info=None):
+        self.kind = kind
+        self.text = text
+        self.level = level
+        self.children = children if children is not None else []
+        self.info = info
+
+    def __repr__(self):
+        return f"Node({self.kind!r}, {self.text!r}, level={self.level}, children={len(self.children)})"
+
+
+HEADING_RE = re.compile(r'(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+RULE_RE = re.compile(r'(?:[-*_]\s*){3,}$')
+LIST_ITEM_RE = re.compile(r'(\s*)([-*+]|\d{1,9}[.)])\s+(.*)$')
+FENCE_RE = re.compile(r'\s*(```|~~~)\s*([\w+-]*)')
+TABLE_SEPARATOR_RE = re.compile(r'\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+
+
+def split_table_row(line):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|'):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split('|')]
+
+
+def table_alignments(separator):
+    alignments = []
+    for cell in split_table_row(separator):
+        if cell.startswith(':') and cell.endswith(':'):
+            alignments.append('CENTER')
+        elif cell.endswith(':'):
+            alignments.append('RIGHT')
+        else:
+            alignments.append('LEFT')
+    return alignments
+
+
+def parse(text):
+    """Parse markdown into a list of block Nodes in one pass over its lines"""
+    lines = text.split('\n')
+    blocks = []
+    current_list = None
+    i = 0
+    while i < len(lines):
+        raw = lines[i]
+        line = raw.strip()
+        i += 1
+
+        if not line:
+            current_list = None
+            continue
+
+        fence = FENCE_RE.match(raw)
+        if fence:
+            # Everything up to the closing fence (or the end) is code, verbatim
+            code = Node('code', info=fence.group(2) or None)
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                code.children.append(lines[i])
+                i += 1
+            i += 1
+            blocks.append(code)
+            current_list = None
+            continue
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            blocks.append(Node('heading', heading.group(2), level=len(heading.group(1))))
+            current_list = None
+            continue
+
+        if RULE_RE.match(line):
+            blocks.append(Node('rule'))
+            current_list = None
+            continue
+
+        if '|' in line and i < len(lines) and '|' in lines[i] and TABLE_SEPARATOR_RE.match(lines[i]):
+            table = Node('table', children=[split_table_row(line)], info=table_alignments(lines[i]))
+            i += 1
+            while i < len(lines) and '|' in lines[i] and lines[i].strip():
+                table.children.append(split_table_row(lines[i]))
+                i += 1
+            blocks.append(table)
+            current_list = None
+            continue
+
+        item = LIST_ITEM_RE.match(raw)
+        if item:
+            indent, marker, item_text = item.groups()
+            ordered = marker[0].isdigit()
+            if current_list is None or (current_list.info == 'ordered') != ordered and not indent:
+                current_list = Node('list', info='ordered' if ordered else 'bullet')
+                blocks.append(current_list)
+            current_list.children.append(Node('item', item_text, level=len(indent.expandtabs(4)) // 2,
+                                              info=marker if ordered else None))
+            continue
+
+        if line.startswith('>'):
+            blocks.append(Node('quote', line.lstrip('>').strip()))
+            current_list = None
+            continue
+
+        # One paragraph per line, as the presentations are written
+        blocks.append(Node('paragraph', line))
+        current_list = None
+    return blocks
+
+
+INLINE_RE = re.compile(
+    r'`([^`]+)`'                                  # code
+    r'|\*\*(.+?)\*\*|__(.+?)__'                   # bold
+    r'|(?<![\w*])\*(?![\s*])(.+?)(?<!\s)\*(?!\*)'  # italic
+    r'|(?<!\w)_(?![\s_])(.+?)(?<!\s)_(?!\w)'
+    r'|\[([^\]]+)\]\(([^)\s]+)\)'                 # link
+)
+# Only absolute URLs become PDF links; "#anchors" and relative paths have no target in the deck
+URL_SCHEME_RE = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+
+def inline(text):
+    """Markdown inline formatting -> ReportLab paragraph markup, escaping everything else"""
+    parts = []
+    position = 0
+    for match in INLINE_RE.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        code, bold, bold2, italic, italic2, label, url = match.groups()
+        if code is not None:
+            parts.append(f'<font name="Courier">{escape(code)}</font>')
+        elif bold is not None or bold2 is not None:
+            parts.append(f"<b>{inline(bold if bold is not None else bold2)}</b>")
+        elif italic is not None or italic2 is not None:
+            parts.append(f"<i>{inline(italic if italic is not None else italic2)}</i>")
+        elif URL_SCHEME_RE.match(url):
+            parts.append(f'<link href="{escape(url, {chr(34): "&quot;"})}" color="blue">{inline(label)}</link>')
+        else:
+            parts.append(inline(label))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts)
+
+
+# Emoji and pictographs (with their variation selectors and joiners) at the start of a line
+LEADING_EMOJI_RE = re.compile(r'^((?:[\u2300-\u23ff\u2600-\u27bf\u2b00-\u2bff\U0001f000-\U0001faff][\ufe0f\u200d]*)+)\s*')
+
+
+def build_styles(config):
+    sample = getSampleStyleSheet()
+    styles = {}
+    for name, (parent, attributes) in DEFAULT_STYLES.items():
+        styles[name] = ParagraphStyle(name, parent=sample[parent], **dict(attributes, **config.styles.get(name, {})))
+    return styles
+
+
+class Renderer:
+    """Turns parsed Nodes into flowables, one handler per node kind"""
+
+    def __init__(self, config, styles=None):
+        self.config = config
+        self.styles = styles or build_styles(config)
+        self.handlers = {
+            'heading': self.heading,
+            'paragraph': self.paragraph,
+            'list': self.list_items,
+            'code': self.code,
+            'table': self.table,
+            'quote': self.quote,
+            'rule': self.rule,
+        }
+
+    def flowables(self, blocks):
+        story = []
+        for block in blocks:
+            story.extend(self.handlers[block.kind](block))
+        return story
+
+    def heading(self, node):
+        style = self.styles[HEADING_STYLES[min(node.level, len(HEADING_STYLES)) - 1]]
+        flowables = [Paragraph(inline(node.text), style)]
+        if node.level == 1:
+            return flowables + [Spacer(1, 20)]
+        if node.level == 2 and self.config.section_page_break:
+            return [PageBreak()] + flowables
+        return flowables
+
+    def paragraph(self, node):
+        text = node.text
+        if self.config.skip_prefixes and text.startswith(self.config.skip_prefixes):
+            return []
+        if text.startswith('**') and text.endswith('**') and len(text) > 4 and '**' not in text[2:-2]:
+            return [Paragraph(inline(text[2:-2]) if self.config.bold_line_style == 'subtitle'
+                              else f"<b>{inline(text[2:-2])}</b>", self.styles[self.config.bold_line_style])]
+        emoji = LEADING_EMOJI_RE.match(text) if self.config.bold_leading_emoji else None
+        if emoji:
+            return [Paragraph(f"<b>{emoji.group(1)}</b> {inline(text[emoji.end():])}", self.styles['normal'])]
+        return [Paragraph(inline(text), self.styles['normal'])]
+
+    def list_items(self, node):
+        base = self.styles['bullet']
+        indented = {}
+        flowables = []
+        for item in node.children:
+            text = item.text
+            if self.config.strip_bullet_emoji:
+                text = LEADING_EMOJI_RE.sub('', text)
+            style = indented.get(item.level)
+            if style is None:
+                style = indented[item.level] = ParagraphStyle(
+                    f"{base.name}{item.level}", parent=base,
+                    leftIndent=base.leftIndent + item.level * LIST_INDENT,
+                    bulletIndent=base.bulletIndent + item.level * LIST_INDENT)
+            # Per item: a numbered item can be nested in a bullet list and vice versa
+            bullet = item.info if item.info else ('•' if item.level == 0 else '–')
+            flowables.append(Paragraph(inline(text), style, bulletText=bullet))
+        return flowables
+
+    def code(self, node):
+        if not node.children:
+            return []
+        style = self.styles['code']
+        if style.backColor is None:
+            return [Preformatted('\n'.join(node.children), style)]
+        # Preformatted ignores backColor: put the block on shaded cells, indented instead of its text.
+        # One row per line, as a table only breaks across pages between rows.
+        if 'code_shaded' not in self.styles:
+            self.styles['code_shaded'] = ParagraphStyle('code_shaded', parent=style, leftIndent=0,
+                                                        spaceBefore=0, spaceAfter=0)
+        shaded_style = self.styles['code_shaded']
+        # A blank Preformatted has no height; keep blank lines one line high
+        rows = [[Preformatted(line, shaded_style) if line.strip() else Spacer(1, shaded_style.leading)]
+                for line in node.children]
+        shaded = Table(rows, colWidths=[self.frame_width() - style.leftIndent])
+        shaded.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, -1), style.backColor),
+                                    ('LEFTPADDING', (0, 0), (-1, -1), 4),
+                                    ('TOPPADDING', (0, 1), (-1, -1), 0),
+                                    ('BOTTOMPADDING', (0, 0), (-1, -2), 0)]))
+        shaded.hAlign = 'RIGHT'
+        return [shaded, Spacer(1, style.spaceAfter)]
+
+    def table(self, node):
+        header, *rows = node.children
+        columns = max(len(row) for row in node.children)
+        alignments = node.info + ['LEFT'] * (columns - len(node.info))
+        # Cells are Paragraphs, which align by their style rather than by the table's ALIGN
+        header_styles = [self.aligned('table_header', align) for align in alignments]
+        cell_styles = [self.aligned('table_cell', align) for align in alignments]
+        data = [[Paragraph(inline(cell), style) for cell, style in zip(header, header_styles)]
+                + [''] * (columns - len(header))]
+        for row in rows:
+            data.append([Paragraph(inline(cell), style) for cell, style in zip(row, cell_styles)]
+                        + [''] * (columns - len(row)))
+        table = Table(data, colWidths=[self.frame_width() / columns] * columns, repeatRows=1)
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]))
+        return [table, Spacer(1, 8)]
+
+    def aligned(self, name, align):
+        key = f"{name}_{align.lower()}"
+        if key not in self.styles:
+            self.styles[key] = ParagraphStyle(key, parent=self.styles[name], alignment=TABLE_ALIGNMENTS[align])
+        return self.styles[key]
+
+    def frame_width(self):
+        left, right, _, _ = self.config.margins
+        return self.config.pagesize[0] - left - right
+
+    def quote(self, node):
+        return [Paragraph(inline(node.text), self.styles['quote'])]
+
+    def rule(self, node):
+        # Slides are separated by "## " page breaks; rules are only visual noise in the source
+        return []
+
+
+def split_sections(text):
+    """Split markdown into the part before the first "## " heading and one part per "## " section"""
+    sections = []
+    current = []
+    fence = None
+    for line in text.split('\n'):
+        if fence:
+            if line.strip().startswith(fence):
+                fence = None
+        else:
+            opening = FENCE_RE.match(line)
+            if opening:
+                fence = opening.group(1)
+            elif line.startswith('## ') and current:
+                sections.append('\n'.join(current))
+                current = []
+        current.append(line)
+    sections.append('\n'.join(current))
+    return [section for section in sections if section.strip()]
+
+
+def style_fingerprint(config):
+    """Hash of everything besides the markdown that changes how a section looks"""
+    styles = sorted((name, sorted(dict(attributes, **config.styles.get(name, {})).items()))
+                    for name, (_, attributes) in DEFAULT_STYLES.items())
+    layout = (tuple(config.pagesize), config.margins, config.strip_bullet_emoji, config.bold_leading_emoji,
+              config.bold_line_style, config.skip_prefixes)
+    return hashlib.sha256(repr((ENGINE_VERSION, reportlab.Version, styles, layout)).encode('utf-8')).hexdigest()
+
+
+def draw_page_number(canvas, config, number):
+    """Page number centred in the bottom margin"""
+    canvas.saveState()
+    canvas.setFont('Helvetica', 9)
+    canvas.setFillColor(colors.grey)
+    canvas.drawCentredString(config.pagesize[0] / 2, config.margins[3] / 2, str(number))
+    canvas.restoreState()
+
+
+def render_pdf(config, story, path, on_page=None):
+    """Lay out `story` into a PDF at `path`, which only appears once complete"""
+    left, right, top, bottom = config.margins
+    tmp_path = f"{path}.tmp"
+    doc = SimpleDocTemplate(tmp_path, pagesize=config.pagesize, leftMargin=left, rightMargin=right,
+                            topMargin=top, bottomMargin=bottom)
+    if on_page:
+        doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+    else:
+        doc.build(story)
+    os.replace(tmp_path, path)
+
+
+def _without_leading_page_break(story):
+    # Nothing precedes it: a fragment, or a document, starts on a new page already
+    return story[1:] if story and isinstance(story[0], PageBreak) else story
+
+
+def render_section(renderer, config, section, path):
+    """Render one section to a fragment at `path`; False if it has nothing to show"""
+    story = _without_leading_page_break(renderer.flowables(parse(section)))
+    if not story:
+        return False
+    render_pdf(config, story, path)
+    return True
+
+
+# Per-process state of the build pool
+_worker = {}
+
+
+def _start_worker(config):
+    _worker['config'] = config
+    _worker['renderer'] = Renderer(config)
+
+
+def _render_in_worker(job):
+    section, path = job
+    return render_section(_worker['renderer'], _worker['config'], section, path)
+
+
+def stamp_page_numbers(config, writer):
+    """Number the pages of a merged pypdf.PdfWriter in place"""
+    overlay = io.BytesIO()
+    canvas = pdf_canvas.Canvas(overlay, pagesize=config.pagesize)
+    for number in range(1, len(writer.pages) + 1):
+        draw_page_number(canvas, config, number)
+        canvas.showPage()
+    canvas.save()
+    # Underneath, like the onPage drawing of a serial build, so both come out the same
+    for page, numbered in zip(writer.pages, pypdf.PdfReader(overlay).pages):
+        page.merge_page(numbered, over=False)
+
+
+def build(config):
+    """Render config.source to config.output.
+
+    Returns {'output', 'sections', 'rendered'}: how many "## " sections (plus
+    the part before the first one) the document has, and how many of them
+    had to be laid out.
+    """
+    with open(config.source, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if config.section_page_break and pypdf is not None:
+        if config.cache_dir:
+            return build_sections(config, text, config.cache_dir)
+        if config.workers > 1:
+            with tempfile.TemporaryDirectory(prefix='presentation-') as fragment_dir:
+                return build_sections(config, text, fragment_dir)
+
+    sections = split_sections(text)
+    renderer = Renderer(config)
+    # A deck that starts with "## " would otherwise open with a blank page
+    story = _without_leading_page_break(renderer.flowables(parse(text)))
+    if config.closing:
+        story.extend(config.closing(renderer.styles))
+    on_page = None
+    if config.page_numbers:
+        def on_page(canvas, doc):
+            draw_page_number(canvas, config, canvas.getPageNumber())
+    render_pdf(config, story, config.output, on_page)
+    return {'output': config.output, 'sections': len(sections), 'rendered': len(sections)}
+
+
+def build_sections(config, text, fragment_dir):
+    """build() from one PDF fragment per section, reusing those already in fragment_dir"""
+    os.makedirs(fragment_dir, exist_ok=True)
+    renderer = Renderer(config)
+    fingerprint = style_fingerprint(config)
+    sections = split_sections(text)
+    paths = []
+    pending = {}
+    for section in sections:
+        key = hashlib.sha256(f"{fingerprint}\0{section}".encode('utf-8')).hexdigest()[:32]
+        path = os.path.join(fragment_dir, f"{key}.pdf")
+        paths.append(path)
+        # Identical sections share a fragment, which is rendered once
+        if not os.path.exists(path):
+            pending[path] = section
+
+    jobs = [(section, path) for path, section in pending.items()]
+    if config.workers > 1 and len(jobs) > 1:
+        workers = min(config.workers, len(jobs))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(config,)) as pool:
+            rendered = sum(pool.map(_render_in_worker, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        rendered = sum(render_section(renderer, config, section, path) for section, path in jobs)
+    # Sections with nothing to show have no fragment
+    fragments = [path for path in paths if os.path.exists(path)]
+
+    # The closing page comes from code rather than markdown, so it has no content hash
+    if config.closing:
+        closing_path = os.path.join(fragment_dir, 'closing.pdf')
+        render_pdf(config, _without_leading_page_break(config.closing(renderer.styles)), closing_path)
+        fragments.append(closing_path)
+
+    writer = pypdf.PdfWriter()
+    for path in fragments:
+        writer.append(path)
+    if config.page_numbers:
+        stamp_page_numbers(config, writer)
+    tmp_path = f"{config.output}.tmp"
+    with open(tmp_path, 'wb') as f:
+        writer.write(f)
+    os.replace(tmp_path, config.output)
+
+    # Fragments of sections that no longer exist
+    keep = {os.path.basename(path) for path in fragments}
+    for name in os.listdir(fragment_dir):
+        if name.endswith('.pdf') and name not in keep:
+            os.remove(os.path.join(fragment_dir, name))
+    return {'output': config.output, 'sections': len(sections), 'rendered': rendered}